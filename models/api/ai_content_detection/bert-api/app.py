@@ -4,15 +4,22 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from model_handler import BertModelHandler
+from pathlib import Path
 import uvicorn
 import sys
 import signal
 
+# Add project root to Python path
+project_root = Path(__file__).resolve().parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.instrumentation import instrument_model_service
+
 app = FastAPI(
     title="BERT AI Content Detection API",
     description="API for detecting AI-generated content using BERT",
     version="1.0.0"
 )
+model_queue = instrument_model_service(app, "bert-detector")
 
 # Initialize model handler
 try:
@@ -36,7 +43,7 @@ async def predict(request: TextRequest):
         if not request.text.strip():
             raise HTTPException(status_code=400, detail="Empty text provided")
         
-        result = model_handler.predict(request.text)
+        result = await model_queue.run(model_handler.predict, request.text)
         return result
     
     except Exception as e:
@@ -2,6 +2,12 @@ import tensorflow as tf
 from transformers import TFAutoModel, AutoTokenizer
 import os
 import sys
+from pathlib import Path
+
+# Add project root to Python path
+project_root = Path(__file__).resolve().parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common import instrumentation
 
 class BertModelHandler:
     def __init__(self):
@@ -43,15 +49,17 @@ class BertModelHandler:
 
     def predict(self, text):
         text = text.strip()
-        inputs = self.tokenizer(
-            text,
-            padding='max_length',
-            truncation=True,
-            max_length=256,
-            return_tensors="tf"
-        )
+        with instrumentation.stage("tokenize"):
+            inputs = self.tokenizer(
+                text,
+                padding='max_length',
+                truncation=True,
+                max_length=256,
+                return_tensors="tf"
+            )
         
-        prediction = self.model(inputs)
+        with instrumentation.in_flight("inference"), instrumentation.stage("inference"):
+            prediction = self.model(inputs)
         probabilities = tf.nn.softmax(prediction, axis=1).numpy()[0]
         predicted_class = tf.argmax(prediction, axis=1).numpy()[0]
         
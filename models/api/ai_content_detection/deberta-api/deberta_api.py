@@ -5,14 +5,24 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 import numpy as np
 import logging
+import sys
+from pathlib import Path
 import uvicorn
 
+# Add project root to Python path
+project_root = Path(__file__).resolve().parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common import instrumentation
+from models.common.instrumentation import instrument_model_service
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Content Detection API")
 
+model_queue = instrument_model_service(app, "deberta-detector")
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -46,6 +56,16 @@ class DetectionResponse(BaseModel):
 async def root():
     return {"message": "Content Detection API is running"}
 
+def _probabilities(text: str) -> np.ndarray:
+    """Class probabilities for one text"""
+    with instrumentation.stage("tokenize"):
+        inputs = tokenizer([text], padding=True, truncation=True, return_tensors="pt")
+
+    with torch.no_grad(), instrumentation.in_flight("inference"), instrumentation.stage("inference"):
+        outputs = model(**inputs)
+        logits = outputs.logits.numpy()
+        return np.exp(logits) / np.sum(np.exp(logits), axis=1, keepdims=True)
+
 @app.post("/detect", response_model=DetectionResponse)
 async def detect_content(request: TextRequest):
     try:
@@ -53,12 +73,7 @@ async def detect_content(request: TextRequest):
         AI_THRESHOLD = 50.0  # threshold for AI classification
 
         # Tokenize and get model output
-        inputs = tokenizer([request.text], padding=True, truncation=True, return_tensors="pt")
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits.numpy()
-            probabilities = np.exp(logits) / np.sum(np.exp(logits), axis=1, keepdims=True)
+        probabilities = await model_queue.run(_probabilities, request.text)
 
         human_prob, ai_prob = probabilities[0]
         human_percentage = human_prob * 100
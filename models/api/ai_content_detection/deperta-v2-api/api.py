@@ -5,14 +5,24 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 import numpy as np
 import logging
+import sys
+from pathlib import Path
 import uvicorn
 
+# Add project root to Python path
+project_root = Path(__file__).resolve().parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common import instrumentation
+from models.common.instrumentation import instrument_model_service
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="MGT-Detection API")
 
+model_queue = instrument_model_service(app, "mgt-detector")
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -51,6 +61,21 @@ async def root():
     return {"message": "MGT-Detection API is running"}
 
 
+def _probabilities(text: str) -> np.ndarray:
+    """Class probabilities for one text"""
+    with instrumentation.stage("tokenize"):
+        inputs = tokenizer(
+            [text], padding=True, truncation=True, return_tensors="pt"
+        )
+
+    with torch.no_grad(), instrumentation.in_flight("inference"), instrumentation.stage("inference"):
+        outputs = model(**inputs)
+        logits = outputs.logits.numpy()
+        return np.exp(logits) / np.sum(
+            np.exp(logits), axis=1, keepdims=True
+        )
+
+
 @app.post("/detect", response_model=DetectionResponse)
 async def detect_content(request: TextRequest):
     try:
@@ -58,28 +83,19 @@ async def detect_content(request: TextRequest):
         MACHINE_THRESHOLD = 50.0  # threshold for machine-generated classification
 
         # Tokenize and get model output
-        inputs = tokenizer(
-            [request.text], padding=True, truncation=True, return_tensors="pt"
-        )
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits.numpy()
-            probabilities = np.exp(logits) / np.sum(
-                np.exp(logits), axis=1, keepdims=True
-            )
-
-            # Map the output indices to their respective labels
-            labels = [
-                "Human-Written",  # Index 0
-                "Human-Written, Machine-Polished",  # Index 1
-                "Machine-Generated",  # Index 2
-                "Machine-Written, Machine-Humanized",  # Index 3
-            ]
-
-            # Extract probabilities
-            human_prob = probabilities[0, 0]  # Human-Written is at index 0
-            machine_prob = probabilities[0, 2]  # Machine-Generated is at index 2
+        probabilities = await model_queue.run(_probabilities, request.text)
+
+        # Map the output indices to their respective labels
+        labels = [
+            "Human-Written",  # Index 0
+            "Human-Written, Machine-Polished",  # Index 1
+            "Machine-Generated",  # Index 2
+            "Machine-Written, Machine-Humanized",  # Index 3
+        ]
+
+        # Extract probabilities
+        human_prob = probabilities[0, 0]  # Human-Written is at index 0
+        machine_prob = probabilities[0, 2]  # Machine-Generated is at index 2
 
         human_percentage = human_prob * 100
         machine_percentage = machine_prob * 100
@@ -8,9 +8,14 @@ from model_utils import (
     retrieve_context,
     generate_answer_with_gemini,
     compute_similarity,
+    get_scheduler,
 )
+from models.common.instrumentation import instrument_app, register_queue
 
 app = FastAPI(title="Answer Comparison API")
+# Prometheus /metrics with RAG retrieval, Gemini and embedding timings
+instrument_app(app, "roberta-api")
+register_queue("gemini_scheduler", lambda: get_scheduler().metrics()["queued"])
 
 
 class ComparisonRequest(BaseModel):
@@ -36,8 +41,9 @@ class DetectionResponse(BaseModel):
     machine_probability: float
 
 
+# Plain def so FastAPI runs it in its threadpool: the Gemini call may wait on the scheduler
 @app.post("/compare-answers", response_model=ComparisonResponse)
-async def compare_answers(request: ComparisonRequest):
+def compare_answers(request: ComparisonRequest):
     try:
         # Retrieve context from RAG
         context_nodes = retrieve_context(request.question)
@@ -89,6 +95,11 @@ async def detect_ai_fallback(request: TextRequest):
         )
 
 
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return get_scheduler().metrics()
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,91 @@
+"""Measure VLM API cold start: import time of main_api and time until /ready would report ready.
+
+Each run is a fresh interpreter, so imports are cold.
+
+Usage (from the project root):
+    python models/api/vlm/benchmark_startup.py --runs 5
+    python models/api/vlm/benchmark_startup.py --max-import-s 1.0  # exit 1 on a regression
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+project_root = Path(__file__).parent.parent.parent.parent
+
+# Runs in the child interpreter and prints one JSON line
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import models.api.vlm.main_api
+imported = time.perf_counter()
+from models.api.vlm.processor_provider import readiness, warm_up
+warm_up()
+ready = time.perf_counter()
+state = readiness()
+print(json.dumps({
+    "importS": imported - start,
+    "warmupS": ready - imported,
+    "timeToReadyS": ready - start,
+    "ready": state["ready"],
+    "error": state["error"],
+}))
+"""
+
+
+def run_once() -> Dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--max-import-s", type=float, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-ready-s", type=float, help="fail if the median time to ready exceeds this")
+    args = parser.parse_args()
+
+    runs = []
+    for index in range(args.runs):
+        run = run_once()
+        runs.append(run)
+        print(f"🚀 run {index + 1}: import {run['importS']:.3f} s, ready after {run['timeToReadyS']:.3f} s"
+              + ("" if run["ready"] else f" (not ready: {run['error']})"))
+
+    summary = {
+        "runs": len(runs),
+        "medianImportS": round(statistics.median(r["importS"] for r in runs), 3),
+        "medianWarmupS": round(statistics.median(r["warmupS"] for r in runs), 3),
+        "medianTimeToReadyS": round(statistics.median(r["timeToReadyS"] for r in runs), 3),
+        "allReady": all(r["ready"] for r in runs),
+    }
+    print("\n📊 Summary")
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        args.output.write_text(json.dumps({"summary": summary, "runs": runs}, indent=2))
+        print(f"Report written to {args.output}")
+
+    failures = []
+    if args.max_import_s is not None and summary["medianImportS"] > args.max_import_s:
+        failures.append(f"import {summary['medianImportS']} s > {args.max_import_s} s")
+    if args.max_ready_s is not None and summary["medianTimeToReadyS"] > args.max_ready_s:
+        failures.append(f"time to ready {summary['medianTimeToReadyS']} s > {args.max_ready_s} s")
+    if failures:
+        print("❌ Startup regression: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from typing import Dict, Optional
+
+import pytest
+
+STUB_EXAM = {"title": "Stub Exam", "questions": []}
+
+
+@pytest.fixture
+def serve_processor(tmp_path):
+    """Serves the API with a stand-in processor and exam structures from a throwaway SQLite store.
+
+    Call it with the processor and, optionally, {exam_id: structure} (exam 1 is
+    STUB_EXAM by default); it returns the processor. Both are unset afterwards.
+    """
+    from models.api.vlm.exam_structures import ExamStructureProvider, SQLiteExamLoader, set_exam_provider
+    from models.api.vlm.processor_provider import set_processor
+
+    def serve(processor, exams: Optional[Dict] = None):
+        loader = SQLiteExamLoader(tmp_path / "exams.sqlite3")
+        for exam_id, structure in (exams or {1: STUB_EXAM}).items():
+            loader.save(exam_id, structure)
+        set_exam_provider(ExamStructureProvider(loader))
+        set_processor(processor)
+        return processor
+
+    yield serve
+    set_processor(None)
+    set_exam_provider(None)
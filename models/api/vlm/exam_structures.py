@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where exam structures come from: "postgres" (the app database), "sqlite" or "json".
+# Defaults to postgres when DATABASE_URL is set, else the JSON directory. Only a store
+# configured by either variable turns unknown exams into 404s; with the default one,
+# sheets of unknown exams are read without a structure.
+VLM_EXAM_LOADER = os.getenv("VLM_EXAM_LOADER", "")
+VLM_EXAM_DIR = os.getenv("VLM_EXAM_DIR", "exam_structures")
+VLM_EXAM_DB = os.getenv("VLM_EXAM_DB", "exam_structures.sqlite3")
+# Structures kept in memory, and for how long before they are loaded again
+VLM_EXAM_CACHE_SIZE = int(os.getenv("VLM_EXAM_CACHE_SIZE", "256"))
+VLM_EXAM_CACHE_TTL = float(os.getenv("VLM_EXAM_CACHE_TTL", "300"))
+# Locks serializing loads; exams sharing one only wait for each other on a miss
+_LOAD_LOCKS = 32
+
+ExamId = Union[int, str]
+
+
+class ExamNotFoundError(LookupError):
+    """Raised when no structure exists for an exam id"""
+
+
+class ExamStructureLoader(ABC):
+    """Fetches one exam structure ({"title", ..., "questions": [...]}) by id; None if unknown"""
+
+    @abstractmethod
+    def load(self, exam_id: ExamId) -> Optional[Dict]:
+        """The structure stored for exam_id, or None"""
+
+
+class JsonExamLoader(ExamStructureLoader):
+    """One <exam_id>.json file per exam in a directory"""
+
+    def __init__(self, directory: Union[str, Path] = VLM_EXAM_DIR):
+        self.directory = Path(directory)
+
+    def _path(self, exam_id: ExamId) -> Path:
+        name = str(exam_id)
+        if not name.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Invalid exam id: {name}")
+        return self.directory / f"{name}.json"
+
+    def load(self, exam_id: ExamId) -> Optional[Dict]:
+        path = self._path(exam_id)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def save(self, exam_id: ExamId, structure: Dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path(exam_id).write_text(json.dumps(structure), encoding="utf-8")
+
+
+class SQLiteExamLoader(ExamStructureLoader):
+    """Exam structures stored as JSON text in a local SQLite table"""
+
+    def __init__(self, path: Union[str, Path] = VLM_EXAM_DB):
+        self.path = str(path)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS exam_structures (exam_id TEXT PRIMARY KEY, structure TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call; sqlite3 connections can't be shared between worker threads
+        return sqlite3.connect(self.path)
+
+    def load(self, exam_id: ExamId) -> Optional[Dict]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT structure FROM exam_structures WHERE exam_id = ?", (str(exam_id),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, exam_id: ExamId, structure: Dict):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO exam_structures (exam_id, structure) VALUES (?, ?)",
+                (str(exam_id), json.dumps(structure)),
+            )
+
+
+class PostgresExamLoader(ExamStructureLoader):
+    """Reads exams, questions and options from the app database (needs psycopg2)"""
+
+    def __init__(self, dsn: Optional[str] = None):
+        try:
+            import psycopg2
+        except ImportError:
+            raise ImportError("PostgresExamLoader needs psycopg2: pip install psycopg2-binary")
+        self._psycopg2 = psycopg2
+        self.dsn = dsn or os.getenv("DATABASE_URL")
+        if not self.dsn:
+            raise ValueError("DATABASE_URL not found in environment variables")
+
+    def load(self, exam_id: ExamId) -> Optional[Dict]:
+        connection = self._psycopg2.connect(self.dsn)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT title, course_code, instructions, duration FROM exams WHERE id = %s", (int(exam_id),)
+                )
+                exam = cursor.fetchone()
+                if exam is None:
+                    return None
+                cursor.execute(
+                    'SELECT id, text, type, points, model_answer FROM questions WHERE exam_id = %s ORDER BY "order"',
+                    (int(exam_id),),
+                )
+                questions = cursor.fetchall()
+                cursor.execute(
+                    'SELECT o.question_id, o.text, o.is_correct FROM options o '
+                    'JOIN questions q ON q.id = o.question_id WHERE q.exam_id = %s ORDER BY o."order"',
+                    (int(exam_id),),
+                )
+                options = cursor.fetchall()
+        finally:
+            connection.close()
+
+        by_question = {}
+        for question_id, text, is_correct in options:
+            by_question.setdefault(question_id, []).append({"text": text, "isCorrect": bool(is_correct)})
+        title, course_code, instructions, duration = exam
+        return {
+            "title": title,
+            "courseCode": course_code,
+            "instructions": instructions or "",
+            "duration": duration,
+            "questions": [
+                {
+                    "text": text,
+                    # The database stores multiple_choice / essay; extraction uses MCQ / ESSAY
+                    "type": "MCQ" if question_type == "multiple_choice" else "ESSAY",
+                    "points": points,
+                    "modelAnswer": model_answer or "",
+                    "options": by_question.get(question_id, []),
+                }
+                for question_id, text, question_type, points, model_answer in questions
+            ],
+        }
+
+
+def loader_configured() -> bool:
+    """Whether VLM_EXAM_LOADER or DATABASE_URL picked the store, rather than the JSON fallback"""
+    return bool(VLM_EXAM_LOADER or os.getenv("DATABASE_URL"))
+
+
+def default_loader() -> ExamStructureLoader:
+    """The loader selected by VLM_EXAM_LOADER"""
+    kind = VLM_EXAM_LOADER or ("postgres" if os.getenv("DATABASE_URL") else "json")
+    if kind == "postgres":
+        return PostgresExamLoader()
+    if kind == "sqlite":
+        return SQLiteExamLoader()
+    if kind == "json":
+        loader = JsonExamLoader()
+        if not any(loader.directory.glob("*.json")):
+            logger.warning(f"No exam structures in {loader.directory.resolve()}; answer sheets are read without "
+                           "one until some are saved there, or set DATABASE_URL / VLM_EXAM_LOADER")
+        return loader
+    raise ValueError(f"Unknown VLM_EXAM_LOADER: {kind}")
+
+
+class ExamStructureProvider:
+    """LRU cache with a TTL in front of an ExamStructureLoader.
+
+    Returned structures are shared between callers and must be treated as read-only.
+    Concurrent misses for the same exam load it once. required says whether callers
+    should treat an unknown exam as an error or carry on without a structure.
+    """
+
+    def __init__(self, loader: ExamStructureLoader, max_entries: int = VLM_EXAM_CACHE_SIZE,
+                 ttl: float = VLM_EXAM_CACHE_TTL, required: bool = True):
+        self.loader = loader
+        self.required = required
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = [threading.Lock() for _ in range(_LOAD_LOCKS)]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, exam_id: ExamId) -> Dict:
+        key = str(exam_id)
+        structure = self._cached(key)
+        if structure is not None:
+            return structure
+
+        with self._load_locks[hash(key) % len(self._load_locks)]:
+            # Another request may have loaded it while we waited
+            structure = self._cached(key, count=False)
+            if structure is not None:
+                return structure
+            structure = self.loader.load(exam_id)
+            if structure is None:
+                raise ExamNotFoundError(f"No exam structure for exam {exam_id}")
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, structure)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            logger.info(f"Loaded structure for exam {exam_id} ({len(structure.get('questions', []))} questions)")
+            return structure
+
+    def invalidate(self, exam_id: Optional[ExamId] = None):
+        """Forget one exam (e.g. after its key was corrected), or all of them"""
+        with self._lock:
+            if exam_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(exam_id), None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / total if total else 0.0,
+                "loader": type(self.loader).__name__,
+            }
+
+    def _cached(self, key: str, count: bool = True) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if count:
+                self.misses += 1
+            return None
+
+
+_provider: Optional[ExamStructureProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_exam_provider() -> ExamStructureProvider:
+    """The provider shared by the student endpoints, created on first use"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = ExamStructureProvider(default_loader(), required=loader_configured())
+    return _provider
+
+
+def set_exam_provider(provider: Optional[ExamStructureProvider]):
+    """Swap the shared provider, e.g. for a SQLite or JSON stand-in in tests"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
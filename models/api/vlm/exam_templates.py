@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from models.common.page_template import PageTemplate
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Page templates of exams, one <exam_id>.npz each
+VLM_TEMPLATE_DIR = os.getenv("VLM_TEMPLATE_DIR", "exam_templates")
+
+ExamId = Union[int, str]
+
+
+class TemplateStore:
+    """Page templates by exam id, on disk and kept in memory once read.
+
+    Exams without a template return None and their sheets are sent whole.
+    """
+
+    def __init__(self, directory: Union[str, Path] = VLM_TEMPLATE_DIR):
+        self.directory = Path(directory)
+        self._templates: Dict[str, Optional[PageTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, exam_id: ExamId) -> Path:
+        name = str(exam_id)
+        if not name.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Invalid exam id: {name}")
+        return self.directory / f"{name}.npz"
+
+    def get(self, exam_id: ExamId) -> Optional[PageTemplate]:
+        key = str(exam_id)
+        with self._lock:
+            if key in self._templates:
+                return self._templates[key]
+        path = self._path(exam_id)
+        template = PageTemplate.load(path) if path.exists() else None
+        with self._lock:
+            self._templates[key] = template
+        return template
+
+    def save(self, exam_id: ExamId, template: PageTemplate):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        template.save(self._path(exam_id))
+        with self._lock:
+            self._templates[str(exam_id)] = template
+        logger.info(f"Saved page template for exam {exam_id}")
+
+    def delete(self, exam_id: ExamId) -> bool:
+        path = self._path(exam_id)
+        existed = path.exists()
+        if existed:
+            path.unlink()
+        with self._lock:
+            self._templates.pop(str(exam_id), None)
+        return existed
+
+
+_store: Optional[TemplateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_template_store() -> TemplateStore:
+    """The store shared by the teacher and student endpoints, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TemplateStore()
+    return _store
+
+
+def set_template_store(store: Optional[TemplateStore]):
+    """Swap the shared store, e.g. for a temporary directory in tests"""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Jobs waiting or running at once; further submissions are rejected instead of queueing forever
+VLM_MAX_ACTIVE_JOBS = int(os.getenv("VLM_MAX_ACTIVE_JOBS", "32"))
+# Jobs running at once, on their own threads so a burst of jobs can't starve the
+# synchronous endpoints of the shared worker pool; the rest wait as "queued"
+VLM_JOB_WORKERS = int(os.getenv("VLM_JOB_WORKERS", "2"))
+# How long finished jobs (and their results) are kept for polling
+VLM_JOB_TTL_SECONDS = int(os.getenv("VLM_JOB_TTL_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting or running"""
+
+
+class Job:
+    """One background extraction and its progress"""
+
+    def __init__(self, kind: str, total_steps: int):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: List[str] = [QUEUED] * total_steps
+        self.result = None
+        self.error: Optional[str] = None
+        # Bumped on every change so watchers can tell when to report again
+        self.version = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict:
+        data = {
+            "jobId": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "progress": {
+                "completed": sum(step in (DONE, FAILED) for step in self.steps),
+                "total": len(self.steps),
+                "pages": list(self.steps),
+            },
+        }
+        if self.status == DONE:
+            data["result"] = self.result
+        if self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """Runs extraction jobs on a bounded pool of their own and keeps finished results for a TTL"""
+
+    def __init__(self, max_active_jobs: int = VLM_MAX_ACTIVE_JOBS, result_ttl: int = VLM_JOB_TTL_SECONDS,
+                 max_workers: int = VLM_JOB_WORKERS):
+        self.max_active_jobs = max_active_jobs
+        self.result_ttl = result_ttl
+        self.max_workers = max_workers
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, kind: str, func: Callable, total_steps: int = 1) -> Job:
+        """Queue func(progress) in the background; progress(step_index, status) reports per-page progress"""
+        with self._lock:
+            self._purge_expired()
+            active = sum(not job.finished for job in self._jobs.values())
+            if active >= self.max_active_jobs:
+                raise QueueFullError(f"{active} jobs already queued or running")
+            job = Job(kind, total_steps)
+            self._jobs[job.id] = job
+
+        self._get_executor().submit(self._run, job, func)
+        logger.info(f"Queued {kind} job {job.id} with {total_steps} step(s)")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(job.status == QUEUED for job in self._jobs.values())
+
+    def shutdown(self):
+        """Stop the job pool, waiting for running jobs to finish"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="vlm-job")
+            return self._executor
+
+    def _run(self, job: Job, func: Callable):
+        self._update(job, status=RUNNING, started_at=time.time())
+
+        def progress(step: int, status: str):
+            with self._lock:
+                job.steps[step] = status
+                job.version += 1
+
+        try:
+            result = func(progress)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            self._update(job, status=FAILED, error=str(e), finished_at=time.time())
+            return
+
+        with self._lock:
+            job.steps = [DONE if step != FAILED else step for step in job.steps]
+        self._update(job, status=DONE, result=result, finished_at=time.time())
+        logger.info(f"Job {job.id} finished in {job.finished_at - job.started_at:.1f}s")
+
+    def _update(self, job: Job, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
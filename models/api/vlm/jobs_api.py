@@ -0,0 +1,119 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import List
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.api.vlm import student_api
+from models.api.vlm.jobs import QueueFullError, job_manager
+from models.api.vlm.processor_provider import require_processor
+from models.api.vlm.uploads import read_upload
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# Seconds between progress checks on the event stream
+SSE_POLL_INTERVAL = 0.25
+# Suggested wait before resubmitting when the queue is full
+RETRY_AFTER_SECONDS = 30
+
+
+def _accepted(job) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content={
+            **job.to_dict(),
+            "statusUrl": f"/jobs/{job.id}",
+            "eventsUrl": f"/jobs/{job.id}/events",
+        },
+    )
+
+
+def _queue_full(e: QueueFullError) -> HTTPException:
+    logger.warning(f"Rejecting job: {str(e)}")
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many extraction jobs in progress: {str(e)}",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+@router.post("/teacher/process-exam/")
+async def submit_exam_job(files: List[UploadFile] = File(...), bypass_cache: bool = Form(False),
+                         processor=Depends(require_processor)):
+    """Queue extraction of an exam (one or more pages, in order) and return its job id immediately"""
+    # Read the pages now; the request's files are closed once this handler returns
+    pages = [await read_upload(file) for file in files]
+
+    def run(progress):
+        return processor.process_teacher_exam_pages(
+            pages, use_cache=not bypass_cache, progress=progress
+        )
+
+    try:
+        job = job_manager.submit("teacher-exam", run, total_steps=len(pages))
+    except QueueFullError as e:
+        raise _queue_full(e)
+    return _accepted(job)
+
+
+@router.post("/student/process-answers/")
+async def submit_answers_job(file: UploadFile = File(...), exam_id: int = Form(...),
+                             processor=Depends(require_processor)):
+    """Queue extraction of one student's answer sheet and return its job id immediately"""
+    exam_structure = await student_api.get_exam_structure(exam_id)
+    template = await student_api.get_exam_template(exam_id)
+    sheet = await read_upload(file)
+
+    def run(progress):
+        return processor.process_student_answers(sheet, exam_structure, template)
+
+    try:
+        job = job_manager.submit("student-answers", run)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    return _accepted(job)
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Status, per-page progress and, once done, the result of a job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.to_dict()
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job state on every change, ending when the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def stream():
+        seen_version = -1
+        while True:
+            if job.version != seen_version:
+                seen_version = job.version
+                state = job.to_dict()
+                event = "done" if job.finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+                if job.finished:
+                    return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
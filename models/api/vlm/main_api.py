@@ -1,5 +1,9 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import asyncio
+import logging
 import uvicorn
 import sys
 from pathlib import Path
@@ -15,8 +19,30 @@ sys.path.append(str(project_root))
 # Import routers
 from models.api.vlm.teacher_api import router as teacher_router
 from models.api.vlm.student_api import router as student_router
+from models.api.vlm.jobs_api import router as jobs_router
+from models.api.vlm.workers import queue_depth, run_blocking, shutdown_executor
+from models.api.vlm.jobs import job_manager
+from models.common.instrumentation import instrument_app, register_queue
+from models.api.vlm.processor_provider import VLM_WARMUP, readiness, warm_up
+from models.common.gemini_scheduler import get_scheduler
 
-app = FastAPI(title="AI Grader API")
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop shared resources with the app"""
+    # Warm up in the background: /health answers at once, /ready turns 200 when warm-up is done
+    warmup = asyncio.ensure_future(run_blocking(warm_up)) if VLM_WARMUP else None
+    yield
+    if warmup is not None and not warmup.done():
+        logger.info("Shutting down before warm-up finished")
+    # Let in-flight extractions finish before the process exits
+    shutdown_executor()
+    job_manager.shutdown()
+
+app = FastAPI(title="AI Grader API", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -30,12 +56,30 @@ app.add_middleware(
 # Include routers
 app.include_router(teacher_router)
 app.include_router(student_router)
+app.include_router(jobs_router)
+
+# Prometheus /metrics: per-stage latency quantiles, in-flight work and queue depths
+instrument_app(app, "vlm-api")
+register_queue("worker_pool", queue_depth)
+register_queue("jobs", job_manager.queue_depth)
+register_queue("gemini_scheduler", lambda: get_scheduler().metrics()["queued"])
 
 @app.get("/health")
 async def health_check():
     """Main API health check endpoint"""
     return {"status": "healthy", "message": "AI Grader API is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the extraction model is set up, 503 until then (liveness is /health)"""
+    state = readiness()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Gemini scheduler queue-wait, retry and in-flight statistics"""
+    return get_scheduler().metrics()
+
 def main():
     """Run the API server"""
     server = uvicorn.Server(
@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Build the processor while the app starts instead of on the first request; set to 0 to stay lazy
+VLM_WARMUP = os.getenv("VLM_WARMUP", "1") != "0"
+
+_processor = None
+_processor_lock = threading.Lock()
+_state = {"ready": False, "error": None, "initSeconds": None, "warmupSeconds": None}
+
+
+def get_processor():
+    """The ExamProcessor shared by every router, created on first use.
+
+    Raises whatever stopped it from being built (e.g. a missing GOOGLE_API_KEY);
+    the next call tries again.
+    """
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                start = time.perf_counter()
+                try:
+                    # Imported here so importing the routers doesn't load the Gemini SDK
+                    from models.vlm.gemini.exam_processor import ExamProcessor
+                    _processor = ExamProcessor()
+                except Exception as e:
+                    _state["error"] = str(e)
+                    logger.error(f"Could not create ExamProcessor: {str(e)}")
+                    raise
+                _state["error"] = None
+                _state["initSeconds"] = round(time.perf_counter() - start, 3)
+                logger.info(f"ExamProcessor ready in {_state['initSeconds']}s")
+    return _processor
+
+
+def require_processor():
+    """FastAPI dependency: the shared processor, or 503 while it can't be built"""
+    try:
+        return get_processor()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Extraction service not ready: {str(e)}")
+
+
+def warm_up():
+    """Build the processor and touch what its first request would otherwise pay for"""
+    start = time.perf_counter()
+    try:
+        processor = get_processor()
+        # Loads the JPEG codec and numpy code paths used on every upload
+        from PIL import Image
+        processor.preprocessor.encode(Image.new("RGB", (64, 64), "white"))
+    except Exception as e:
+        logger.error(f"Warm-up failed: {str(e)}")
+        return
+    _state["warmupSeconds"] = round(time.perf_counter() - start, 3)
+    _state["ready"] = True
+    logger.info(f"VLM API warmed up in {_state['warmupSeconds']}s")
+
+
+def readiness() -> Dict:
+    """Whether requests can be served now, and how long getting there took"""
+    return {
+        "ready": _state["ready"] or (_processor is not None and _state["error"] is None),
+        "error": _state["error"],
+        "initSeconds": _state["initSeconds"],
+        "warmupSeconds": _state["warmupSeconds"],
+    }
+
+
+def set_processor(processor: Optional[object]):
+    """Swap the shared processor, e.g. for a stub in tests; None makes the next call build one"""
+    global _processor
+    with _processor_lock:
+        _processor = processor
+        _state["ready"] = processor is not None
+        _state["error"] = None
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+import asyncio
+import json
+import shutil
 import sys
 import os
 import logging
+import tempfile
+import zipfile
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -13,36 +19,58 @@ logger = logging.getLogger(__name__)
 # Add project root to Python path
 project_root = Path(__file__).parent.parent.parent.parent
 sys.path.append(str(project_root))
-from models.vlm.gemini.exam_processor import ExamProcessor
+from models.api.vlm.workers import run_blocking
+from models.api.vlm.uploads import read_upload
+from models.api.vlm.exam_structures import ExamNotFoundError, get_exam_provider
+from models.api.vlm.exam_templates import get_template_store
+from models.api.vlm.processor_provider import require_processor
 
 # Create router instead of app
+# The shared ExamProcessor is injected per request (see processor_provider) rather than built at import
 router = APIRouter(prefix="/student", tags=["student"])
-processor = ExamProcessor()
+
+# Sheets of one batch processed at the same time, so one class scan can't take over the whole worker pool
+VLM_BATCH_CONCURRENCY = int(os.getenv("VLM_BATCH_CONCURRENCY", "4"))
+# Batch uploads larger than this wait on disk, not in memory, until their sheet's turn
+VLM_MAX_INMEMORY_UPLOAD = int(os.getenv("VLM_MAX_INMEMORY_UPLOAD", str(16 * 1024 * 1024)))
+# Largest single sheet accepted from a ZIP archive
+VLM_MAX_SHEET_BYTES = int(os.getenv("VLM_MAX_SHEET_BYTES", str(32 * 1024 * 1024)))
+SHEET_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+async def get_exam_structure(exam_id: int) -> Optional[Dict]:
+    """Exam structure for exam_id from the shared provider.
+
+    An unknown exam is a 404 when a store was configured; otherwise the sheet is
+    read without a structure (None), as before structures were looked up.
+    """
+    provider = get_exam_provider()
+    try:
+        return await run_blocking(provider.get, exam_id)
+    except ExamNotFoundError as e:
+        if provider.required:
+            raise HTTPException(status_code=404, detail=str(e))
+        logger.warning(f"{str(e)}; reading the sheet without it")
+        return None
+
+async def get_exam_template(exam_id: int):
+    """Page template for exam_id, or None if the teacher never stored one"""
+    return await run_blocking(get_template_store().get, exam_id)
 
 @router.post("/process-answers/")
 async def process_answers(
     file: UploadFile = File(...),
-    exam_id: int = Form(...)
+    exam_id: int = Form(...),
+    processor=Depends(require_processor)
 ):
     """Process student's answer sheet"""
+    exam_structure = await get_exam_structure(exam_id)
+    template = await get_exam_template(exam_id)
+    image = await read_upload(file)
     try:
-        # Create temp directory if it doesn't exist
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Save uploaded file temporarily
-        file_path = temp_dir / file.filename
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        logger.info(f"Processing student answers for exam ID: {exam_id} from file: {file_path}")
-        
-        # Process student answers
-        result = processor.process_student_answers(str(file_path), exam_id)
-        
-        # Clean up
-        os.remove(file_path)
+        logger.info(f"Processing student answers for exam ID: {exam_id} from upload: {file.filename}")
+
+        # Process student answers in the worker pool so the event loop stays responsive
+        result = await run_blocking(processor.process_student_answers, image, exam_structure, template)
         
         logger.info(f"Student answers processed successfully")
         
@@ -52,6 +80,140 @@ async def process_answers(
         logger.error(f"Error processing student answers: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _copy_upload(file: UploadFile):
+    """Copy an upload into a buffer we own; the request closes its files before a streamed response ends"""
+    buffer = tempfile.SpooledTemporaryFile(max_size=VLM_MAX_INMEMORY_UPLOAD)
+    file.file.seek(0)
+    shutil.copyfileobj(file.file, buffer)
+    buffer.seek(0)
+    return buffer
+
+def _archive_sheets(archive: zipfile.ZipFile) -> List[str]:
+    """Image members of a ZIP in name order, skipping folders and macOS metadata"""
+    return sorted(
+        info.filename for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and Path(info.filename).suffix.lower() in SHEET_SUFFIXES
+    )
+
+def _read_archive_sheet(archive: zipfile.ZipFile, name: str) -> bytes:
+    size = archive.getinfo(name).file_size
+    if size > VLM_MAX_SHEET_BYTES:
+        raise ValueError(f"Sheet is {size} bytes, the limit is {VLM_MAX_SHEET_BYTES}")
+    return archive.read(name)
+
+@router.post("/process-answers/batch/")
+async def process_answers_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    exam_id: int = Form(...),
+    processor=Depends(require_processor)
+):
+    """Process a class's answer sheets for one exam, streaming one NDJSON line per sheet as it finishes.
+
+    Sheets come either as repeated `files` parts or as a ZIP `archive`. A failing
+    sheet yields an error line and does not stop the rest of the batch.
+    """
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Send answer sheets as 'files' or a ZIP 'archive'")
+    # Looked up once for the whole batch
+    exam_structure = await get_exam_structure(exam_id)
+    template = await get_exam_template(exam_id)
+
+    buffers = []
+    zip_file = None
+    try:
+        # Each entry is (sheet name, coroutine function returning the sheet's image source)
+        sheets: List[Tuple[str, object]] = []
+        for file in files or []:
+            buffer = await run_blocking(_copy_upload, file)
+            buffers.append(buffer)
+            async def read_upload(buffer=buffer):
+                return buffer
+            sheets.append((file.filename, read_upload))
+        if archive is not None:
+            buffer = await run_blocking(_copy_upload, archive)
+            buffers.append(buffer)
+            zip_file = zipfile.ZipFile(buffer)
+            # ZipFile reads are not safe to interleave across threads
+            zip_lock = asyncio.Lock()
+            for name in _archive_sheets(zip_file):
+                async def read_member(name=name):
+                    async with zip_lock:
+                        return await run_blocking(_read_archive_sheet, zip_file, name)
+                sheets.append((name, read_member))
+    except Exception as e:
+        for buffer in buffers:
+            buffer.close()
+        logger.error(f"Error reading answer sheet batch: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read batch: {str(e)}")
+
+    logger.info(f"Processing batch of {len(sheets)} answer sheets for exam ID: {exam_id}")
+    limit = asyncio.Semaphore(VLM_BATCH_CONCURRENCY)
+
+    async def process_sheet(index: int, name: str, load) -> dict:
+        async with limit:
+            try:
+                image = await load()
+                result = await run_blocking(processor.process_student_answers, image, exam_structure, template)
+                return {"index": index, "filename": name, "status": "ok", "result": result}
+            except Exception as e:
+                logger.error(f"Error processing answer sheet {name}: {str(e)}")
+                return {"index": index, "filename": name, "status": "error", "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.ensure_future(process_sheet(i, name, load)) for i, (name, load) in enumerate(sheets)]
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                succeeded += line["status"] == "ok"
+                yield json.dumps(line) + "\n"
+            yield json.dumps({
+                "done": True,
+                "total": len(sheets),
+                "succeeded": succeeded,
+                "failed": len(sheets) - succeeded,
+            }) + "\n"
+            logger.info(f"Batch finished: {succeeded}/{len(sheets)} sheets processed")
+        finally:
+            # Client went away or the batch ended: stop queued sheets and release buffers
+            for task in tasks:
+                task.cancel()
+            if zip_file is not None:
+                zip_file.close()
+            for buffer in buffers:
+                buffer.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+class GradeClassRequest(BaseModel):
+    exam: Dict[str, Any]
+    # Each: {"studentId": ..., "answers": [...]} as returned by /process-answers/
+    students: List[Dict[str, Any]]
+
+@router.post("/grade-class/")
+async def grade_class(request: GradeClassRequest, processor=Depends(require_processor)):
+    """Grade a whole class against an answer key, e.g. again after the key was corrected"""
+    student_ids = [student.get("studentId", index) for index, student in enumerate(request.students)]
+    try:
+        return await run_blocking(processor.grade_class, request.exam, request.students, student_ids)
+    except Exception as e:
+        logger.error(f"Error grading class: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/exam-structures/stats")
+async def exam_structure_stats():
+    """Exam-structure cache counters"""
+    return get_exam_provider().stats()
+
+@router.delete("/exam-structures/{exam_id}")
+async def invalidate_exam_structure(exam_id: int):
+    """Drop a cached exam structure, e.g. after its answer key was edited"""
+    get_exam_provider().invalidate(exam_id)
+    return {"invalidated": exam_id}
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint for student API"""
@@ -1,49 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Body, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import io
+import json
 import sys
-import os
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import List
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 # Add project root to Python path
 project_root = Path(__file__).parent.parent.parent.parent
 sys.path.append(str(project_root))
-from models.vlm.gemini.exam_processor import ExamProcessor
-
-# Verify API key is present
-if not os.getenv('GOOGLE_API_KEY'):
-    raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in .env file")
+from models.api.vlm.workers import iterate_blocking, run_blocking
+from models.api.vlm.uploads import read_upload
+from models.api.vlm.processor_provider import require_processor
+from models.api.vlm.exam_templates import get_template_store
 
 # Create router instead of app
+# The shared ExamProcessor is injected per request (see processor_provider) rather than built at import
 router = APIRouter(prefix="/teacher", tags=["teacher"])
-processor = ExamProcessor()
 
 @router.post("/process-exam/")
-async def process_exam(file: UploadFile = File(...)):
+async def process_exam(file: UploadFile = File(...), bypass_cache: bool = Form(False),
+                       processor=Depends(require_processor)):
     """Process teacher's exam and extract structure"""
+    image = await read_upload(file)
     try:
-        # Create temp directory if it doesn't exist
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Save uploaded file temporarily
-        file_path = temp_dir / file.filename
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        logger.info(f"Processing exam from file: {file_path}")
-        
-        # Process the exam
-        result = processor.process_teacher_exam(str(file_path))
+        logger.info(f"Processing exam from upload: {file.filename}")
+
+        # Process the exam in the worker pool so the event loop keeps serving other requests
+        result = await run_blocking(processor.process_teacher_exam, image, use_cache=not bypass_cache)
         
         # Ensure the result has the expected structure
         if not isinstance(result, dict):
@@ -51,9 +40,6 @@ async def process_exam(file: UploadFile = File(...)):
                 "title": "Extracted Exam",
                 "questions": []
             }
-            
-        # Clean up
-        os.remove(file_path)
         
         logger.info(f"Exam processed successfully, returning {len(result.get('questions', []))} questions")
         
@@ -63,6 +49,109 @@ async def process_exam(file: UploadFile = File(...)):
         logger.error(f"Error processing exam: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/process-exam/stream/")
+async def process_exam_stream(file: UploadFile = File(...), bypass_cache: bool = Form(False),
+                              processor=Depends(require_processor)):
+    """Process teacher's exam, pushing each question over server-sent events as soon as it is read.
+
+    Emits `question` events, then one `exam` event with the full structure, or an `error` event.
+    """
+    # Own the bytes; the request closes its files before a streamed response ends
+    image = await read_upload(file)
+    logger.info(f"Streaming exam extraction for upload: {file.filename}")
+
+    async def stream():
+        try:
+            async for event in iterate_blocking(processor.stream_teacher_exam, image, use_cache=not bypass_cache):
+                payload = event["question"] if event["type"] == "question" else event["exam"]
+                if event["type"] == "question":
+                    payload = {"index": event["index"], **payload}
+                yield f"event: {event['type']}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming exam: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/process-exam-pages/")
+async def process_exam_pages(files: List[UploadFile] = File(...), bypass_cache: bool = Form(False),
+                             processor=Depends(require_processor)):
+    """Process a multi-page exam, given its pages in order, into one exam structure"""
+    images = [await read_upload(file) for file in files]
+    try:
+        logger.info(f"Processing {len(images)} exam pages")
+
+        result = await run_blocking(
+            processor.process_teacher_exam_pages,
+            images,
+            use_cache=not bypass_cache,
+        )
+
+        logger.info(f"Exam pages processed successfully, returning {len(result.get('questions', []))} questions")
+
+        return JSONResponse(content=result)
+
+    except Exception as e:
+        logger.error(f"Error processing exam pages: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/answer-sheet/")
+async def answer_sheet(exam: dict = Body(...)):
+    """Printable bubble answer sheet for an extracted exam structure, read back locally by OMR"""
+    def render() -> bytes:
+        from models.common.omr import SheetLayout
+        sheet = SheetLayout(exam.get("questions", [])).render(exam.get("title", ""))
+        buffer = io.BytesIO()
+        sheet.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    try:
+        png = await run_blocking(render)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=png, media_type="image/png")
+
+@router.post("/exam-template/{exam_id}")
+async def create_exam_template(exam_id: int, file: UploadFile = File(...), skip_header: bool = Form(True),
+                               regions: str = Form(None), processor=Depends(require_processor)):
+    """Store the page template of an exam's (blank) page; students' photos of it are then cropped to their answers.
+
+    regions optionally gives the answer boxes as a JSON list of [left, top, right, bottom]
+    page fractions; by default the page's question blocks are used.
+    """
+    image = await read_upload(file)
+    try:
+        answer_regions = json.loads(regions) if regions else None
+        template = await run_blocking(processor.build_template, image, skip_header, answer_regions)
+        await run_blocking(get_template_store().save, exam_id, template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building exam template: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"examId": exam_id, **template.to_dict()}
+
+@router.delete("/exam-template/{exam_id}")
+async def delete_exam_template(exam_id: int):
+    """Stop cropping this exam's sheets, e.g. after the printed layout changed"""
+    return {"examId": exam_id, "deleted": await run_blocking(get_template_store().delete, exam_id)}
+
+@router.get("/cache/stats")
+async def cache_stats(processor=Depends(require_processor)):
+    """Extraction cache hit/miss counters"""
+    if processor.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **processor.cache.stats()}
+
+@router.get("/extraction/stats")
+async def extraction_stats(processor=Depends(require_processor)):
+    """Local JSON repairs, targeted re-queries and the full extractions they saved"""
+    return processor.repair_stats()
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,104 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import zipfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from models.api.vlm import main_api, student_api
+
+MODEL_DELAY = 0.2
+
+
+class SheetProcessor:
+    """Stand-in for ExamProcessor that echoes each sheet's bytes, failing sheets that read "bad" """
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def process_student_answers(self, image, exam_structure, template=None):
+        data = image if isinstance(image, bytes) else image.read()
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(MODEL_DELAY)
+            if data == b"bad":
+                raise ValueError("unreadable sheet")
+            return {"answers": [data.decode()]}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def sheet_processor(serve_processor):
+    return serve_processor(SheetProcessor())
+
+
+def _post(**kwargs):
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/student/process-answers/batch/", data={"exam_id": "1"}, **kwargs)
+
+    return asyncio.run(run())
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_files_stream_one_line_per_sheet_and_errors_stay_per_sheet(sheet_processor):
+    files = [("files", (f"s{i}.png", body, "image/png")) for i, body in enumerate([b"one", b"bad", b"three"])]
+    response = _post(files=files)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    *sheets, summary = _lines(response)
+    by_name = {line["filename"]: line for line in sheets}
+    assert by_name["s0.png"] == {"index": 0, "filename": "s0.png", "status": "ok", "result": {"answers": ["one"]}}
+    assert by_name["s1.png"]["status"] == "error" and "unreadable" in by_name["s1.png"]["error"]
+    assert by_name["s2.png"]["result"] == {"answers": ["three"]}
+    assert summary == {"done": True, "total": 3, "succeeded": 2, "failed": 1}
+
+
+def test_zip_archive_skips_folders_and_non_images(sheet_processor):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("class/b.jpg", b"second")
+        archive.writestr("class/a.png", b"first")
+        archive.writestr("class/notes.txt", b"not a sheet")
+        archive.writestr("__MACOSX/class/._a.png", b"metadata")
+    response = _post(files={"archive": ("class.zip", buffer.getvalue(), "application/zip")})
+
+    assert response.status_code == 200
+    *sheets, summary = _lines(response)
+    assert sorted((line["index"], line["filename"], line["result"]["answers"][0]) for line in sheets) == [
+        (0, "class/a.png", "first"), (1, "class/b.jpg", "second")]
+    assert summary["total"] == 2
+
+
+def test_batch_concurrency_is_limited(sheet_processor, monkeypatch):
+    monkeypatch.setattr(student_api, "VLM_BATCH_CONCURRENCY", 2)
+    files = [("files", (f"s{i}.png", b"sheet", "image/png")) for i in range(6)]
+
+    start = time.perf_counter()
+    response = _post(files=files)
+    elapsed = time.perf_counter() - start
+
+    assert _lines(response)[-1]["succeeded"] == 6
+    assert sheet_processor.peak == 2
+    # Three rounds of two sheets
+    assert elapsed >= MODEL_DELAY * 3
+
+
+def test_batch_without_sheets_is_rejected(sheet_processor):
+    assert _post().status_code == 400
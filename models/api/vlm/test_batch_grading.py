@@ -0,0 +1,118 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from models.common.generation_backends import ReplayBackend
+from models.vlm.gemini.batch_grading import MISSING, UNRECOGNIZED, AnswerKey
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+
+def _mcq(points, correct, *options):
+    return {"type": "MCQ", "points": points,
+            "options": [{"text": option, "isCorrect": option == correct} for option in options]}
+
+
+EXAM = {"questions": [
+    _mcq(1, "Paris", "London", "Paris", "Rome"),
+    _mcq(2, "True", "True", "False"),
+    {"type": "ESSAY", "points": 5, "options": []},
+    _mcq(1, "4", "3", "4"),
+]}
+
+
+@pytest.fixture
+def processor(tmp_path):
+    return ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=ReplayBackend(tmp_path, fallback="{}"))
+
+
+def test_answers_are_encoded_as_option_indices():
+    key = AnswerKey(EXAM)
+
+    assert key.encode_answer(0, {"answer": "paris"}) == 1
+    assert key.encode_answer(0, {"answer": "whatever", "selectedOption": "c"}) == 2
+    assert key.encode_answer(0, "(a)") == 0
+    assert key.encode_answer(1, {"answer": "FALSE."}) == 1
+    assert key.encode_answer(0, {"answer": "na"}) == MISSING
+    assert key.encode_answer(0, None) == MISSING
+    assert key.encode_answer(0, {"answer": "berlin"}) == UNRECOGNIZED
+    # A letter beyond the question's options isn't an option
+    assert key.encode_answer(1, "c") == UNRECOGNIZED
+
+
+def test_partial_and_overlong_answer_lists():
+    key = AnswerKey(EXAM)
+    students = [
+        {"answers": [{"answer": "paris"}, {"answer": "true"}, {"answer": "an essay"}, {"answer": "4"}]},
+        # Stopped after the first question
+        {"answers": [{"answer": "paris"}]},
+        # One answer too many, and "na" for the second
+        [{"answer": "rome"}, {"answer": "na"}, {"answer": ""}, {"answer": "4"}, {"answer": "extra"}],
+    ]
+
+    selected = key.encode(students)
+    grades = key.grade(selected)
+
+    assert selected.shape == (3, 4)
+    assert selected[1].tolist() == [1, MISSING, MISSING, MISSING]
+    assert grades.totals.tolist() == [4.0, 1.0, 1.0]
+    assert grades.max_points == 4.0
+    assert grades.correct.tolist() == [[True, True, False, True], [True, False, False, False],
+                                       [False, False, False, True]]
+    assert grades.missing[2].tolist() == [False, True, True, False]
+    # Essays are never auto-graded
+    assert not grades.correct[:, 2].any()
+
+
+def test_grade_class_reports_students_and_question_rates(processor):
+    students = [{"answers": [{"answer": "paris"}, {"answer": "true"}]}, {"answers": []}]
+
+    report = processor.grade_class(EXAM, students, ["s1", "s2"])
+
+    assert [(s["studentId"], s["total"]) for s in report["students"]] == [("s1", 3.0), ("s2", 0.0)]
+    first, second, essay, last = report["questions"]
+    assert first == {"question_number": 1, "autoGraded": True, "correctRate": 0.5, "missingRate": 0.5}
+    assert essay["autoGraded"] is False
+    assert last["missingRate"] == 1.0
+    assert processor.grade_class(EXAM, [])["students"] == []
+
+
+def test_compare_answers_handles_length_mismatches(processor):
+    teacher = [{"answer": "Paris", "points": 1}, {"answer": "True", "points": 2}, {"answer": "4", "points": 1}]
+
+    short = processor.compare_answers(teacher, [{"answer": "paris"}])
+    assert [r["points_awarded"] for r in short] == [1, 0, 0]
+    assert [r["attempted"] for r in short] == [True, False, False]
+
+    extra = processor.compare_answers(teacher, [{"answer": "paris"}, {"answer": "na"}, {"answer": "4"},
+                                                {"answer": "x"}])
+    assert len(extra) == 3
+    assert [r["is_correct"] for r in extra] == [True, False, True]
+
+
+def test_grade_class_endpoint(processor):
+    httpx = pytest.importorskip("httpx")
+    from models.api.vlm import main_api
+    from models.api.vlm.processor_provider import set_processor
+
+    set_processor(processor)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/student/grade-class/", json={
+                "exam": EXAM,
+                "students": [{"studentId": "a", "answers": [{"answer": "london"}, {"answer": "true"}]},
+                             {"answers": [{"answer": "paris"}]}],
+            })
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        set_processor(None)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(s["studentId"], s["total"]) for s in body["students"]] == [("a", 2.0), (1, 1.0)]
+    assert np.isclose(body["questions"][0]["correctRate"], 0.5)
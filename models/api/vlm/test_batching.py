@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from models.common.batching import BatchQueueFullError, DynamicBatcher
+
+
+class RecordingModel:
+    """Doubles its inputs, taking a fixed time per batch; fails any batch holding "bad" """
+
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        time.sleep(self.delay)
+        if "bad" in items:
+            raise ValueError("unreadable image")
+        return [item * 2 for item in items]
+
+
+def test_concurrent_requests_share_batches():
+    model = RecordingModel()
+    batcher = DynamicBatcher(model, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.run(n) for n in range(8)))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    batcher.stop()
+
+    assert results == [n * 2 for n in range(8)]
+    assert [len(batch) for batch in model.batches] == [4, 4]
+    # Two batch calls, not eight one-item calls
+    assert elapsed < model.delay * 4
+    assert batcher.stats()["meanBatchSize"] == 4
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    release = threading.Event()
+    batcher = DynamicBatcher(lambda items: release.wait() and items, max_batch_size=1, max_wait_ms=0, max_queue=2)
+
+    first = batcher.submit(1)
+    # Wait for the worker to pick the first request up, leaving the queue empty
+    while batcher.queue_depth():
+        time.sleep(0.01)
+    queued = [batcher.submit(2), batcher.submit(3)]
+    with pytest.raises(BatchQueueFullError) as rejected:
+        batcher.submit(4)
+    assert rejected.value.retry_after >= 1
+
+    release.set()
+    assert [f.result(timeout=2) for f in [first] + queued] == [1, 2, 3]
+    batcher.stop()
+
+
+def test_failed_batch_is_retried_per_item():
+    model = RecordingModel(delay=0)
+    batcher = DynamicBatcher(model, max_batch_size=3, max_wait_ms=50)
+
+    futures = [batcher.submit(item) for item in ("a", "bad", "c")]
+    batcher.stop()
+
+    assert futures[0].result() == "aa"
+    assert futures[2].result() == "cc"
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert [len(batch) for batch in model.batches] == [3, 1, 1, 1]
+
+
+def test_concurrent_submits_never_overshoot_max_queue():
+    release = threading.Event()
+    batcher = DynamicBatcher(lambda items: release.wait() and items, max_batch_size=1, max_wait_ms=0, max_queue=4)
+    batcher.submit(0)
+    while batcher.queue_depth():
+        time.sleep(0.01)
+
+    start = threading.Barrier(16)
+    accepted, rejected = [], []
+
+    def submit(n):
+        start.wait()
+        try:
+            accepted.append(batcher.submit(n))
+        except BatchQueueFullError:
+            rejected.append(n)
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(1, 17)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(accepted) == 4 and len(rejected) == 12
+    release.set()
+    batcher.stop()
@@ -0,0 +1,58 @@
+import json
+
+from models.vlm.gemini.benchmark_pipeline import compare, load_golden, score_exam
+
+# The layout of exams/<name>/exam_results.json: one answer list per section
+SECTIONS = {"exam_id": "EXAM1", "questions": [
+    {"question_number": 1, "correct_answer": ["F", "T", "T"]},
+    {"question_number": 2, "correct_answer": ["C", "B"]},
+]}
+
+
+def _true_false(answer: bool):
+    return {"type": "MCQ",
+            "options": [{"text": "True", "isCorrect": answer}, {"text": "False", "isCorrect": not answer}]}
+
+
+def _lettered(correct: int):
+    return {"type": "MCQ", "options": [{"text": f"option {n}", "isCorrect": n == correct} for n in range(4)]}
+
+
+def test_section_answers_are_flattened_into_one_key(tmp_path):
+    (tmp_path / "exam_results.json").write_text(json.dumps(SECTIONS))
+
+    assert load_golden(tmp_path) == {"source": "exam_results.json", "questions": 5,
+                                     "answers": ["f", "t", "t", "c", "b"]}
+    assert load_golden(tmp_path / "missing") is None
+
+
+def test_golden_extraction_is_keyed_by_correct_option(tmp_path):
+    golden = {"questions": [_true_false(True), _lettered(2), {"type": "ESSAY", "options": []}]}
+    (tmp_path / "golden.json").write_text(json.dumps(golden))
+
+    assert load_golden(tmp_path) == {"source": "golden.json", "questions": 3, "answers": ["t", "c", None]}
+
+
+def test_extraction_is_scored_by_position(tmp_path):
+    (tmp_path / "exam_results.json").write_text(json.dumps(SECTIONS))
+    golden = load_golden(tmp_path)
+    # Second true/false answer wrong, last question missing
+    extracted = {"questions": [_true_false(False), _true_false(False), _true_false(True), _lettered(2)]}
+
+    score = score_exam(extracted, golden)
+
+    assert score == {
+        "golden": "exam_results.json",
+        "expectedQuestions": 5,
+        "extractedQuestions": 4,
+        "questionCountMatch": False,
+        "questionCountError": -1,
+        "answerAgreement": 0.6,
+    }
+
+
+def test_compare_lists_changed_summary_keys():
+    baseline = {"images": 4, "p50LatencyS": 1.5, "meanAnswerAgreement": None, "errors": 0}
+    summary = {"images": 4, "p50LatencyS": 1.25, "meanAnswerAgreement": 0.8, "errors": 0}
+
+    assert compare(summary, baseline) == ["p50LatencyS: 1.5 -> 1.25 (-0.25)", "meanAnswerAgreement: None -> 0.8"]
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from models.api.vlm import main_api
+from models.api.vlm import processor_provider
+from models.api.vlm.processor_provider import set_processor
+from models.api.vlm.workers import VLM_MAX_WORKERS, queue_depth, run_blocking
+
+# Seconds each stubbed extraction takes
+MODEL_DELAY = 0.5
+CONCURRENT_UPLOADS = min(4, VLM_MAX_WORKERS)
+
+
+class SlowProcessor:
+    """Stand-in for ExamProcessor whose model call blocks like a real Gemini request"""
+
+    def process_teacher_exam(self, image_path, use_cache=True):
+        time.sleep(MODEL_DELAY)
+        return {"title": "Stub Exam", "questions": []}
+
+    def process_student_answers(self, image_path, exam_structure, template=None):
+        time.sleep(MODEL_DELAY)
+        return {"answers": []}
+
+
+@pytest.fixture
+def slow_processor(serve_processor):
+    return serve_processor(SlowProcessor())
+
+
+def _client():
+    transport = httpx.ASGITransport(app=main_api.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def test_concurrent_uploads_finish_in_time_of_one(slow_processor):
+    async def run():
+        async with _client() as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post(
+                    "/teacher/process-exam/",
+                    files={"file": (f"page{i}.png", b"not-a-real-image", "image/png")},
+                )
+                for i in range(CONCURRENT_UPLOADS)
+            ])
+            return responses, time.perf_counter() - start
+
+    responses, elapsed = asyncio.run(run())
+
+    assert all(response.status_code == 200 for response in responses)
+    # Serialized handling would take CONCURRENT_UPLOADS * MODEL_DELAY
+    assert elapsed < MODEL_DELAY * 2
+
+
+def test_health_responds_during_extraction(slow_processor):
+    async def run():
+        async with _client() as client:
+            upload = asyncio.create_task(client.post(
+                "/student/process-answers/",
+                files={"file": ("sheet.png", b"not-a-real-image", "image/png")},
+                data={"exam_id": "1"},
+            ))
+            # Give the upload time to reach the stubbed model call
+            await asyncio.sleep(MODEL_DELAY / 5)
+
+            start = time.perf_counter()
+            health = await client.get("/health")
+            health_elapsed = time.perf_counter() - start
+
+            return health, health_elapsed, await upload
+
+    health, health_elapsed, upload = asyncio.run(run())
+
+    assert health.status_code == 200
+    assert upload.status_code == 200
+    assert health_elapsed < MODEL_DELAY / 2
+
+
+def test_ready_is_separate_from_health(monkeypatch):
+    def unavailable():
+        raise ValueError("GOOGLE_API_KEY not found in environment variables")
+
+    set_processor(None)
+    monkeypatch.setattr(processor_provider, "get_processor", unavailable)
+
+    async def run():
+        async with _client() as client:
+            health = await client.get("/health")
+            not_ready = await client.get("/ready")
+            upload = await client.post(
+                "/teacher/process-exam/",
+                files={"file": ("page.png", b"not-a-real-image", "image/png")},
+            )
+            set_processor(SlowProcessor())
+            ready = await client.get("/ready")
+            return health, not_ready, upload, ready
+
+    try:
+        health, not_ready, upload, ready = asyncio.run(run())
+    finally:
+        set_processor(None)
+
+    assert health.status_code == 200
+    assert not_ready.status_code == 503
+    assert upload.status_code == 503
+    assert ready.status_code == 200
+
+
+def test_oversized_uploads_are_refused(slow_processor, monkeypatch):
+    monkeypatch.setattr("models.api.vlm.uploads.VLM_MAX_UPLOAD_BYTES", 16)
+
+    async def run():
+        async with _client() as client:
+            large = {"file": ("page.png", b"x" * 17, "image/png")}
+            return [
+                await client.post("/teacher/process-exam/", files=large),
+                await client.post("/student/process-answers/", data={"exam_id": "1"}, files=large),
+                await client.post("/jobs/teacher/process-exam/", files=[("files", large["file"])]),
+                await client.post("/teacher/process-exam/", files={"file": ("page.png", b"x" * 16, "image/png")}),
+            ]
+
+    *refused, accepted = asyncio.run(run())
+
+    assert [response.status_code for response in refused] == [413, 413, 413]
+    assert accepted.status_code == 200
+
+
+def test_metrics_report_stage_latency_and_queues(slow_processor):
+    async def run():
+        async with _client() as client:
+            await client.post(
+                "/student/process-answers/",
+                data={"exam_id": "1"},
+                files={"file": ("sheet.png", b"fake-image-bytes", "image/png")},
+            )
+            return await client.get("/metrics")
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'grader_stage_seconds{service="vlm-api",stage="http_request",quantile="0.99"}' in body
+    assert 'grader_in_flight{service="vlm-api",name="http_requests"} 0' in body
+    assert 'grader_queue_depth{service="vlm-api",queue="worker_pool"}' in body
+
+
+def test_queue_depth_counts_jobs_waiting_for_a_worker():
+    release = threading.Event()
+
+    async def run():
+        jobs = [asyncio.ensure_future(run_blocking(release.wait, 5)) for _ in range(VLM_MAX_WORKERS + 2)]
+        await asyncio.sleep(0.2)
+        waiting = queue_depth()
+        # A job cancelled before it started stops counting
+        jobs[-1].cancel()
+        await asyncio.sleep(0.05)
+        after_cancel = queue_depth()
+        release.set()
+        await asyncio.gather(*jobs[:-1])
+        return waiting, after_cancel
+
+    waiting, after_cancel = asyncio.run(run())
+
+    assert waiting == 2
+    assert after_cancel == 1
+    assert queue_depth() == 0
+
+
+def test_model_queue_runs_one_call_at_a_time_and_reports_waiters():
+    from models.common.instrumentation import ModelQueue, registry
+
+    queue = ModelQueue("test_model")
+    release = threading.Event()
+    running = []
+
+    def infer(n):
+        running.append(n)
+        assert release.wait(5)
+        return n * 2
+
+    async def run():
+        calls = [asyncio.ensure_future(queue.run(infer, n)) for n in range(3)]
+        await asyncio.sleep(0.2)
+        waiting, started = queue.depth(), list(running)
+        release.set()
+        return waiting, started, await asyncio.gather(*calls)
+
+    waiting, started, results = asyncio.run(run())
+
+    assert len(started) == 1 and waiting == 2
+    assert results == [0, 2, 4]
+    assert queue.depth() == 0
+    assert 'queue="test_model"} 0' in registry.render()
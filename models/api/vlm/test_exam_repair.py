@@ -0,0 +1,108 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.exam_schema import load_json, question_errors, repair_json
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+ESSAY = {"text": "Explain recursion.", "type": "ESSAY", "points": 3, "modelAnswer": "Self reference.",
+         "options": []}
+MCQ = {"text": "Pick the even number.", "type": "MCQ", "points": 1, "modelAnswer": "2",
+       "options": [{"text": "2", "isCorrect": True}, {"text": "3", "isCorrect": False}]}
+
+
+class ScriptedBackend(GenerationBackend):
+    """Answers calls with the given responses in turn, keeping the prompts"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def generate_content(self, contents, stream=False, schema=None):
+        self.prompts.append(contents[0])
+        return GeneratedText(self.responses.pop(0))
+
+
+def _page() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_truncated_json_keeps_the_complete_questions():
+    text = json.dumps({"title": "Cut", "questions": [ESSAY, MCQ]})
+    cut = text[:text.index("Pick the even") + 8]  # inside the second question's text
+
+    repaired = json.loads(repair_json(cut))
+
+    assert repaired["title"] == "Cut"
+    assert repaired["questions"][0] == ESSAY
+    # The incomplete question is closed off, without its unfinished value
+    assert "text" not in repaired["questions"][1]
+
+
+def test_trailing_commas_and_fences_are_repaired():
+    text = 'Here you go:\n```json\n{"title": "T", "questions": [{"text": "a", "type": "ESSAY",},],}\n```\nThanks!'
+
+    value, repaired = load_json(text)
+
+    assert repaired
+    assert value == {"title": "T", "questions": [{"text": "a", "type": "ESSAY"}]}
+    assert load_json(json.dumps(ESSAY)) == (ESSAY, False)
+    with pytest.raises(ValueError):
+        repair_json("no json here")
+
+
+def test_question_errors_flag_unusable_questions():
+    lowered = json.loads(json.dumps(MCQ).lower())
+    assert question_errors(lowered) == []
+    assert question_errors(json.loads(json.dumps(ESSAY).lower())) == []
+    assert question_errors(dict(lowered, options=lowered["options"][:1])) == ["MCQ has fewer than two options"]
+    # An unmarked MCQ, as on a blank exam, is fine
+    assert question_errors(dict(lowered, options=[{"text": "2"}, {"text": "3"}])) == []
+    assert question_errors({"text": "", "type": "quiz", "points": "many"}) == [
+        "missing question text", "unknown type QUIZ", "points is not a number"]
+
+
+def test_only_invalid_questions_are_requeried(tmp_path):
+    broken = dict(MCQ, options=[{"text": "2", "isCorrect": True}])
+    first = json.dumps({"title": "Repair", "questions": [ESSAY, broken, ESSAY]})
+    backend = ScriptedBackend(first, json.dumps({"questions": [MCQ]}))
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=backend, structured=True)
+
+    exam = processor.process_teacher_exam(_page())
+
+    assert len(backend.prompts) == 2
+    requery = backend.prompts[1]
+    assert "question 2 on the page" in requery and "MCQ has fewer than two options" in requery
+    assert "question 1 on the page" not in requery and "question 3 on the page" not in requery
+    assert [len(q["options"]) for q in exam["questions"]] == [0, 2, 0]
+    stats = processor.repair_stats()
+    assert (stats["invalidQuestions"], stats["recoveredQuestions"], stats["requeryCalls"]) == (1, 1, 1)
+
+
+def test_valid_response_is_not_requeried(tmp_path):
+    backend = ScriptedBackend(json.dumps({"title": "Fine", "questions": [ESSAY, MCQ]}) + ",")
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=backend, structured=True)
+
+    exam = processor.process_teacher_exam(_page())
+
+    assert len(backend.prompts) == 1
+    assert len(exam["questions"]) == 2
+    assert processor.repair_stats()["requeryCalls"] == 0
+
+
+def test_blank_mcq_page_is_not_requeried(tmp_path):
+    unmarked = dict(MCQ, modelAnswer="", options=[dict(o, isCorrect=False) for o in MCQ["options"]])
+    backend = ScriptedBackend(json.dumps({"title": "Blank", "questions": [unmarked, unmarked]}))
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=backend, structured=True)
+
+    exam = processor.process_teacher_exam(_page())
+
+    assert len(backend.prompts) == 1
+    assert len(exam["questions"]) == 2
+    assert processor.repair_stats()["requeryCalls"] == 0
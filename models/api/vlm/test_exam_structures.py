@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from models.api.vlm import main_api
+from models.api.vlm.exam_structures import (
+    ExamNotFoundError,
+    ExamStructureLoader,
+    ExamStructureProvider,
+    JsonExamLoader,
+    SQLiteExamLoader,
+    loader_configured,
+    set_exam_provider,
+)
+from models.api.vlm.processor_provider import set_processor
+
+EXAM = {
+    "title": "Stub Exam",
+    "questions": [
+        {"text": "2 + 2?", "type": "MCQ", "points": 1,
+         "options": [{"text": "4", "isCorrect": True}, {"text": "5", "isCorrect": False}]},
+        {"text": "Explain.", "type": "ESSAY", "points": 2, "options": []},
+    ],
+}
+
+
+class CountingLoader(SQLiteExamLoader):
+    def __init__(self, path):
+        super().__init__(path)
+        self.loaded = []
+
+    @property
+    def loads(self):
+        return len(self.loaded)
+
+    def load(self, exam_id):
+        self.loaded.append(str(exam_id))
+        return super().load(exam_id)
+
+
+class RecordingProcessor:
+    """Stand-in for ExamProcessor that records the structure each sheet was processed with"""
+
+    def __init__(self):
+        self.structures = []
+
+    def process_student_answers(self, image, exam_structure, template=None):
+        self.structures.append(exam_structure)
+        return {"answers": [{"answer": "na"} for _ in (exam_structure or {}).get("questions", [])]}
+
+
+@pytest.fixture
+def loader(tmp_path):
+    loader = CountingLoader(tmp_path / "exams.sqlite3")
+    loader.save(7, EXAM)
+    return loader
+
+
+def test_provider_caches_until_ttl(loader):
+    provider = ExamStructureProvider(loader, ttl=0.2)
+    assert provider.get(7) == EXAM
+    assert provider.get("7") == EXAM
+    assert loader.loads == 1
+
+    time.sleep(0.25)
+    provider.get(7)
+    assert loader.loads == 2
+
+
+def test_provider_evicts_least_recently_used(tmp_path):
+    loader = JsonExamLoader(tmp_path)
+    for exam_id in (1, 2, 3):
+        loader.save(exam_id, {"questions": [], "title": str(exam_id)})
+    provider = ExamStructureProvider(loader, max_entries=2)
+    provider.get(1)
+    provider.get(2)
+    provider.get(1)
+    provider.get(3)
+
+    assert provider.stats()["entries"] == 2
+    assert provider.get(1)["title"] == "1"
+    assert provider.stats()["hits"] == 2  # the repeated 1s; 2 was evicted
+
+
+def test_unknown_exam_raises_and_is_not_cached(loader):
+    provider = ExamStructureProvider(loader)
+    with pytest.raises(ExamNotFoundError):
+        provider.get(99)
+    loader.save(99, EXAM)
+    assert provider.get(99) == EXAM
+
+
+def test_batch_fetches_structure_once(loader):
+    processor = RecordingProcessor()
+    set_processor(processor)
+    set_exam_provider(ExamStructureProvider(loader))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            batch = await client.post(
+                "/student/process-answers/batch/",
+                files=[("files", (f"s{i}.png", b"sheet", "image/png")) for i in range(5)],
+                data={"exam_id": "7"},
+            )
+            missing = await client.post(
+                "/student/process-answers/",
+                files={"file": ("s.png", b"sheet", "image/png")},
+                data={"exam_id": "8"},
+            )
+            return batch, missing
+
+    try:
+        batch, missing = asyncio.run(run())
+    finally:
+        set_exam_provider(None)
+        set_processor(None)
+
+    assert batch.status_code == 200
+    assert loader.loaded.count("7") == 1
+    assert len(processor.structures) == 5
+    assert all(structure == EXAM for structure in processor.structures)
+    assert missing.status_code == 404
+
+
+def test_unknown_exam_without_a_configured_store_is_read_blind(loader, monkeypatch):
+    monkeypatch.setattr("models.api.vlm.exam_structures.VLM_EXAM_LOADER", "")
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    assert not loader_configured()
+    processor = RecordingProcessor()
+    set_processor(processor)
+    set_exam_provider(ExamStructureProvider(loader, required=loader_configured()))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/student/process-answers/",
+                files={"file": ("s.png", b"sheet", "image/png")},
+                data={"exam_id": "8"},
+            )
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        set_exam_provider(None)
+        set_processor(None)
+
+    assert response.status_code == 200
+    assert processor.structures == [None]
+    monkeypatch.setenv("DATABASE_URL", "postgresql://localhost/edugrade")
+    assert loader_configured()
+
+
+def test_loader_must_implement_load():
+    with pytest.raises(TypeError):
+        ExamStructureLoader()
+
+    class Incomplete(ExamStructureLoader):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
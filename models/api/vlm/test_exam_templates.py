@@ -0,0 +1,108 @@
+import asyncio
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from PIL import Image, ImageDraw
+
+from models.api.vlm import main_api
+from models.api.vlm.exam_templates import TemplateStore, set_template_store
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.common.omr import _homography, _project
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+EXAM_PAGE = Path(__file__).parent.parent.parent.parent / "exams" / "deep" / "deep1.jpg"
+EXAM = {"title": "Deep Learning", "questions": [{"text": "Explain backpropagation.", "type": "ESSAY", "points": 5}]}
+# Where the page's corners land in the synthetic phone photo
+PHOTO_SIZE = (1800, 2400)
+PAGE_CORNERS = np.array([[260, 300], [1560, 240], [1640, 2150], [180, 2080]], dtype=np.float64)
+
+
+class AnswerBackend(GenerationBackend):
+    """Answers every sheet the same and keeps the image payloads it was sent"""
+
+    def __init__(self):
+        self.payloads = []
+
+    def generate_content(self, contents, stream=False, schema=None):
+        self.payloads.append(contents[1])
+        return GeneratedText(json.dumps({"answers": [{"question": 1, "answer": "chain rule"}]}))
+
+
+def _student_photo(page: Image.Image) -> Image.Image:
+    """The page with handwriting, photographed at an angle on a desk"""
+    sheet = page.convert("RGB")
+    draw = ImageDraw.Draw(sheet)
+    rng = np.random.default_rng(1)
+    for _ in range(30):
+        x, y = rng.integers(0, sheet.width - 60), rng.integers(30, sheet.height - 30)
+        draw.line([(x, y), (x + 40, y + 15), (x + 55, y - 5)], fill=(20, 20, 160), width=3)
+    page_corners = np.array([[0, 0], [sheet.width, 0], [sheet.width, sheet.height], [0, sheet.height]], dtype=np.float64)
+    to_page = _homography(PAGE_CORNERS, page_corners)
+    coefficients = tuple((to_page / to_page[2, 2]).ravel()[:8])
+    photo = Image.new("RGB", PHOTO_SIZE, (120, 90, 60))
+    warped = sheet.transform(PHOTO_SIZE, Image.PERSPECTIVE, coefficients, Image.BILINEAR)
+    mask = Image.new("L", sheet.size, 255).transform(PHOTO_SIZE, Image.PERSPECTIVE, coefficients, Image.BILINEAR)
+    photo.paste(warped, (0, 0), mask)
+    return photo
+
+
+@pytest.fixture
+def processor(tmp_path, serve_processor):
+    set_template_store(TemplateStore(tmp_path / "templates"))
+    backend = AnswerBackend()
+    yield serve_processor(ExamProcessor(cache=ExtractionCache(tmp_path / "cache"), omr=None, backend=backend),
+                          exams={3: EXAM})
+    set_template_store(None)
+
+
+def test_student_photo_registers_to_the_template(processor):
+    page = processor._load_page(EXAM_PAGE.read_bytes())
+    template = processor.build_template(str(EXAM_PAGE))
+    registration = processor.registrar.register(_student_photo(page), template)
+
+    assert registration.registered
+    # Template pixels -> page pixels -> photo pixels, as constructed
+    scale = page.width / template.size[0]
+    page_corners = np.array([[0, 0], [page.width, 0], [page.width, page.height], [0, page.height]], dtype=np.float64)
+    expected = _homography(page_corners, PAGE_CORNERS) @ np.diag([scale, scale, 1.0])
+    points = np.array([[0, 0], [template.size[0], template.size[1]], [template.size[0] / 2, template.size[1] / 2]],
+                      dtype=np.float64)
+    error = np.linalg.norm(_project(registration.homography, points) - _project(expected, points), axis=1)
+    assert error.max() < 5
+
+
+def test_sheets_are_cropped_to_answer_regions_once_a_template_exists(processor):
+    page = processor._load_page(EXAM_PAGE.read_bytes())
+    buffer = io.BytesIO()
+    _student_photo(page).save(buffer, format="JPEG", quality=90)
+    photo = buffer.getvalue()
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            before = await client.post("/student/process-answers/", data={"exam_id": "3"},
+                                       files={"file": ("sheet.jpg", photo, "image/jpeg")})
+            created = await client.post("/teacher/exam-template/3",
+                                        files={"file": ("page.jpg", EXAM_PAGE.read_bytes(), "image/jpeg")})
+            after = await client.post("/student/process-answers/", data={"exam_id": "3"},
+                                      files={"file": ("sheet.jpg", photo, "image/jpeg")})
+            return before, created, after
+
+    before, created, after = asyncio.run(run())
+
+    assert before.status_code == 200 and "template" not in before.json()
+    assert created.status_code == 200 and created.json()["regions"]
+    assert after.status_code == 200
+    report = after.json()["template"]
+    assert report["registered"]
+    assert after.json()["answers"][0]["answer"] == "chain rule"
+    whole, cropped = processor.backend.payloads
+    assert report["sentBytes"] == len(cropped["data"]) < len(whole["data"])
@@ -0,0 +1,108 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("fastapi")
+
+from PIL import Image
+
+from models.api.vlm import main_api
+from models.api.vlm.processor_provider import set_processor
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+EXAM = {"title": "Cached Exam", "questions": [
+    {"text": "Define entropy.", "type": "ESSAY", "points": 2, "modelAnswer": "Disorder.", "options": []},
+]}
+
+
+class CountingBackend(GenerationBackend):
+    """Answers every call with EXAM, counting the calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False, schema=None):
+        self.calls += 1
+        return GeneratedText(json.dumps(EXAM))
+
+
+def _page() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_least_recently_used_entry_is_evicted_by_count(tmp_path):
+    cache = ExtractionCache(tmp_path, max_entries=2)
+    cache.put("aa1", {"n": 1})
+    cache.put("bb2", {"n": 2})
+    assert cache.get("aa1") == {"n": 1}  # now more recent than bb2
+    cache.put("cc3", {"n": 3})
+
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") == {"n": 1}
+    assert cache.get("cc3") == {"n": 3}
+    assert not (tmp_path / "bb" / "bb2.json").exists()
+
+
+def test_entries_are_evicted_by_bytes(tmp_path):
+    value = {"text": "x" * 100}
+    size = len(json.dumps(value).encode())
+    cache = ExtractionCache(tmp_path, max_entries=100, max_bytes=size * 3)
+    for n in range(5):
+        cache.put(f"k{n}", value)
+
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] <= size * 3
+    assert [cache.get(f"k{n}") is not None for n in range(5)] == [False, False, True, True, True]
+
+
+def test_hit_and_miss_counters_and_reload_from_disk(tmp_path):
+    cache = ExtractionCache(tmp_path)
+    key = ExtractionCache.make_key(b"image", "prompt", "model")
+    assert cache.get(key) is None
+    cache.put(key, EXAM)
+    assert cache.get(key) == EXAM
+    assert cache.get(key) == EXAM
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hitRate"] == pytest.approx(2 / 3)
+    # A different prompt or model misses
+    assert key != ExtractionCache.make_key(b"image", "prompt", "other-model")
+    # A restarted process finds the entry on disk
+    assert ExtractionCache(tmp_path).get(key) == EXAM
+
+
+def test_bypass_cache_form_field_forces_a_fresh_extraction(tmp_path):
+    backend = CountingBackend()
+    set_processor(ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=backend))
+    page = _page()
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = []
+            for bypass in ("false", "false", "true"):
+                responses.append(await client.post(
+                    "/teacher/process-exam/",
+                    files={"file": ("page.png", page, "image/png")},
+                    data={"bypass_cache": bypass},
+                ))
+            return responses
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        set_processor(None)
+
+    assert all(response.status_code == 200 for response in responses)
+    assert responses[0].json() == responses[1].json() == responses[2].json()
+    # Cold call, cache hit, bypassed call
+    assert backend.calls == 2
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from models.common import gemini_scheduler
+from models.common.gemini_scheduler import BULK, INTERACTIVE, GeminiScheduler, TokenBucket
+
+
+class APIError(Exception):
+    """Like google.api_core exceptions: the HTTP status is .code"""
+
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def _wait_until(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(gemini_scheduler.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(60)  # one token per second
+
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    now[0] += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.wait_time(1) == 0
+    # Never more than a minute's worth, and oversized requests wait for a full bucket only
+    now[0] += 1000
+    assert bucket.tokens <= 60 and bucket.wait_time(500) == 0
+    bucket.consume(80)
+    assert bucket.wait_time(1) == pytest.approx(21.0)
+
+
+def test_interactive_call_jumps_ahead_of_queued_bulk_call():
+    scheduler = GeminiScheduler(max_concurrency=1)
+    release = threading.Event()
+    order = []
+    blocker = threading.Thread(target=scheduler.call, args=(release.wait,))
+    blocker.start()
+    _wait_until(lambda: scheduler.metrics()["inFlight"] == 1)
+
+    bulk = threading.Thread(target=scheduler.call, args=(order.append, "bulk"), kwargs={"priority": BULK})
+    bulk.start()
+    _wait_until(lambda: scheduler.metrics()["queued"] == 1)
+    interactive = threading.Thread(target=scheduler.call, args=(order.append, "interactive"),
+                                   kwargs={"priority": INTERACTIVE})
+    interactive.start()
+    _wait_until(lambda: scheduler.metrics()["queued"] == 2)
+
+    release.set()
+    for thread in (blocker, bulk, interactive):
+        thread.join(2)
+    assert order == ["interactive", "bulk"]
+    assert scheduler.metrics()["queuedByPriority"] == {"interactive": 0, "bulk": 0}
+
+
+def test_rate_limited_call_is_retried_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(gemini_scheduler.time, "sleep", sleeps.append)
+    monkeypatch.setattr(gemini_scheduler.random, "uniform", lambda low, high: high)
+    scheduler = GeminiScheduler(base_backoff=0.5, max_backoff=1.5)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 4:
+            raise APIError(429)
+        return "ok"
+
+    assert scheduler.call(flaky) == "ok"
+    assert sleeps == [0.5, 1.0, 1.5]
+    stats = scheduler.metrics()["classes"]["interactive"]
+    assert (stats["calls"], stats["retries"], stats["failures"]) == (4, 3, 0)
+
+    # Client errors are not retried
+    with pytest.raises(APIError):
+        scheduler.call(lambda: (_ for _ in ()).throw(APIError(400)))
+    assert scheduler.metrics()["classes"]["interactive"]["failures"] == 1
+
+
+def test_concurrency_slot_is_released_after_failures_and_streams():
+    scheduler = GeminiScheduler(max_concurrency=1, max_retries=0)
+
+    def broken():
+        raise APIError(503)
+
+    with pytest.raises(APIError):
+        scheduler.call(broken)
+    assert scheduler.metrics()["inFlight"] == 0
+
+    # A stream holds its slot until consumed
+    stream = scheduler.call(lambda stream: iter(["a", "b"]), stream=True)
+    assert scheduler.metrics()["inFlight"] == 1
+    assert list(stream) == ["a", "b"]
+    assert scheduler.metrics()["inFlight"] == 0
+
+    # ...or abandoned
+    stream = scheduler.call(lambda stream: iter(["a", "b"]), stream=True)
+    next(stream)
+    stream.close()
+    assert scheduler.metrics()["inFlight"] == 0
+    assert scheduler.call(lambda: "admitted") == "admitted"
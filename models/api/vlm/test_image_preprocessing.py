@@ -0,0 +1,87 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from models.vlm.gemini.image_preprocessing import ImagePreprocessor
+
+
+def _only(**stages) -> ImagePreprocessor:
+    """A preprocessor running just the given stages, without shrinking the page"""
+    settings = dict(normalize_contrast=False, deskew=False, auto_crop=False, adaptive=False, target_long_edge=4000)
+    settings.update(stages)
+    return ImagePreprocessor(**settings)
+
+
+def _ruled_page() -> Image.Image:
+    page = Image.new("L", (600, 800), 255)
+    draw = ImageDraw.Draw(page)
+    for y in range(60, 760, 40):
+        draw.line([(40, y), (560, y)], fill=0, width=3)
+    return page
+
+
+def _line_center(ink: np.ndarray, column: int) -> float:
+    """Middle row of the first ruled line crossing a column"""
+    rows = np.flatnonzero(ink[:, column])
+    first = rows[rows < rows[0] + 10]
+    return float(first.mean())
+
+
+def _skew_degrees(image: Image.Image) -> float:
+    ink = np.asarray(image) < 128
+    cols = np.flatnonzero(ink.any(axis=0))
+    left, right = int(cols[0] + 0.25 * (cols[-1] - cols[0])), int(cols[0] + 0.75 * (cols[-1] - cols[0]))
+    return math.degrees(math.atan2(_line_center(ink, right) - _line_center(ink, left), right - left))
+
+
+def test_rotated_ruled_page_is_deskewed():
+    photo = _ruled_page().rotate(3, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    assert abs(_skew_degrees(photo)) > 2.5
+
+    straightened = _only(deskew=True).apply(photo)
+
+    assert abs(_skew_degrees(straightened)) < 0.5
+    # A straight page is left alone
+    assert _only(deskew=True).apply(_ruled_page()).size == (600, 800)
+
+
+def test_margins_are_cropped_to_the_content():
+    page = Image.new("L", (1000, 1400), 255)
+    draw = ImageDraw.Draw(page)
+    for y in range(300, 1100, 30):
+        draw.rectangle([200, y, 799, y + 10], fill=0)
+
+    cropped = _only(auto_crop=True).apply(page)
+
+    # The content box is 600 x 791, plus up to 2% padding on each side
+    width, height = cropped.size
+    assert 600 <= width <= 600 + 2 * 0.02 * 1000 + 4
+    assert 791 <= height <= 791 + 2 * 0.02 * 1400 + 4
+    # A blank page has nothing to crop to
+    assert _only(auto_crop=True).apply(Image.new("L", (500, 700), 255)).size == (500, 700)
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale():
+    buffer = io.BytesIO()
+    Image.new("RGB", (4000, 3000), "white").save(buffer, format="JPEG")
+    photo = Image.open(io.BytesIO(buffer.getvalue()))
+
+    result = ImagePreprocessor(target_long_edge=1000, adaptive=False).apply(photo)
+
+    # libjpeg decoded at 1/2 scale, the smallest that still covers 1000 x 1000
+    assert photo.size == (2000, 1500)
+    assert max(result.size) <= 1000 and result.mode == "L"
+
+
+def test_uneven_lighting_is_flattened_to_white_paper():
+    # Paper darkening from 250 on the left to 150 on the right, with one dark line
+    shade = np.tile(np.linspace(250, 150, 800, dtype=np.float32), (600, 1))
+    shade[300:304, 100:700] = 20
+    page = Image.fromarray(shade.astype(np.uint8))
+
+    flattened = np.asarray(_only(normalize_contrast=True).apply(page))
+
+    assert flattened[100, 50] == 255 and flattened[100, 750] == 255
+    assert flattened[302, 400] < 80
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from models.api.vlm import jobs_api, main_api
+from models.api.vlm.jobs import DONE, FAILED, JobManager
+from models.api.vlm.workers import run_blocking
+
+
+class GatedProcessor:
+    """Stand-in for ExamProcessor whose extractions wait until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def process_student_answers(self, image, exam_structure, template=None):
+        assert self.release.wait(5)
+        return {"answers": [image.decode()]}
+
+
+@pytest.fixture
+def gated(serve_processor, monkeypatch):
+    processor = serve_processor(GatedProcessor())
+    manager = JobManager(max_active_jobs=2, max_workers=1)
+    monkeypatch.setattr(jobs_api, "job_manager", manager)
+    monkeypatch.setattr(jobs_api, "SSE_POLL_INTERVAL", 0.01)
+    yield processor
+    processor.release.set()
+    manager.shutdown()
+
+
+def _submit(client, sheet: bytes):
+    return client.post("/jobs/student/process-answers/", data={"exam_id": "1"},
+                       files={"file": ("sheet.png", sheet, "image/png")})
+
+
+def test_full_job_queue_is_rejected_with_retry_after(gated):
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await _submit(client, f"sheet {n}".encode()) for n in range(3)]
+
+    accepted, queued, rejected = asyncio.run(run())
+
+    assert accepted.status_code == queued.status_code == 202
+    assert queued.json()["status"] == "queued"
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == str(jobs_api.RETRY_AFTER_SECONDS)
+
+
+def test_events_stream_progress_until_done(gated):
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            job_id = (await _submit(client, b"B")).json()["jobId"]
+            events = asyncio.ensure_future(client.get(f"/jobs/{job_id}/events"))
+            await asyncio.sleep(0.1)
+            gated.release.set()
+            return await events, await client.get(f"/jobs/{job_id}")
+
+    events, status = asyncio.run(run())
+
+    assert events.headers["content-type"].startswith("text/event-stream")
+    messages = [block.split("\n") for block in events.text.strip().split("\n\n")]
+    kinds = [lines[0].removeprefix("event: ") for lines in messages]
+    assert kinds[0] == "progress" and kinds[-1] == "done" and kinds.count("done") == 1
+    final = json.loads(messages[-1][1].removeprefix("data: "))
+    assert final["status"] == DONE and final["result"] == {"answers": ["B"]}
+    assert status.json()["progress"] == {"completed": 1, "total": 1, "pages": [DONE]}
+
+
+def test_finished_jobs_expire_after_their_ttl():
+    manager = JobManager(result_ttl=60)
+    finished = threading.Event()
+    job = manager.submit("test", lambda progress: finished.set() or 42)
+    failing = manager.submit("test", lambda progress: 1 / 0)
+    assert finished.wait(2)
+    manager.shutdown()
+
+    assert manager.get(job.id).result == 42
+    assert manager.get(failing.id).status == FAILED
+    # Just past the TTL
+    job.finished_at -= 61
+    assert manager.get(job.id) is None
+    assert manager.get(failing.id) is not None
+
+
+def test_jobs_do_not_take_the_request_worker_pool():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+    threads = []
+    for _ in range(3):
+        manager.submit("test", lambda progress: threads.append(threading.current_thread().name) or release.wait(5))
+
+    while not threads:
+        time.sleep(0.01)
+
+    async def request():
+        # Served at once although every job thread is busy
+        return await asyncio.wait_for(run_blocking(lambda: "served"), timeout=1)
+
+    try:
+        assert asyncio.run(request()) == "served"
+        assert manager.queue_depth() == 2
+    finally:
+        release.set()
+        manager.shutdown()
+    assert all(name.startswith("vlm-job") for name in threads)
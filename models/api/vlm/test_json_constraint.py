@@ -0,0 +1,83 @@
+import json
+
+from models.common.json_constraint import JsonSchemaMatcher, select_tokens
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": ["string", "null"]},
+        "duration": {"type": "integer", "nullable": True},
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "type": {"type": "STRING", "enum": ["MCQ", "ESSAY"]},
+                    "points": {"type": "number"},
+                    "isCorrect": {"type": "boolean"},
+                },
+                "required": ["text", "type"],
+            },
+        },
+    },
+    "required": ["questions"],
+}
+
+DOCUMENT = {
+    "title": "Physics \"Final\" été",
+    "duration": 90,
+    "questions": [
+        {"text": "Define inertia.\nExplain.", "type": "ESSAY", "points": 2.5},
+        {"text": "Is g = 9.8?", "type": "MCQ", "isCorrect": True},
+    ],
+}
+
+
+def feeds(data: str) -> bool:
+    return JsonSchemaMatcher(SCHEMA).feed(data.encode("utf-8"))
+
+
+def test_valid_document_is_accepted_and_closes():
+    for text in (json.dumps(DOCUMENT), json.dumps(DOCUMENT, indent=2, ensure_ascii=False)):
+        matcher = JsonSchemaMatcher(SCHEMA)
+        assert matcher.feed(text.encode("utf-8"))
+        assert matcher.done
+        # Nothing may follow the closed document
+        assert not matcher.accepts(b" ")
+
+
+def test_partial_prefixes_are_accepted():
+    text = json.dumps(DOCUMENT)
+    matcher = JsonSchemaMatcher(SCHEMA)
+    for end in range(len(text) - 1):
+        assert matcher.accepts(text[:end].encode("utf-8"))
+    assert matcher.accepts(b'{"questions": [{"type": "ESS')
+    assert not matcher.done
+
+
+def test_schema_violations_are_rejected():
+    assert not feeds('{"title": "x"}')  # missing required questions
+    assert not feeds('{"subtitle": "x"')  # unknown key
+    assert not feeds('{"title": "x", "title"')  # duplicate key
+    assert not feeds('{"questions": [{"type": "MCX"')  # not in the enum
+    assert not feeds('{"duration": 1.5')  # integer only
+    assert not feeds('{"questions": [{"text": "x"}]}')  # missing required type
+    assert not feeds('{"questions": [{"isCorrect": yes')
+    assert not feeds('{"title": "line\nbreak"')  # raw control character in a string
+    assert not feeds("```json")
+    assert feeds('{"title": null, "duration": null, "questions": []}')
+
+
+def test_whitespace_runs_are_capped():
+    matcher = JsonSchemaMatcher(SCHEMA, max_whitespace=4)
+    assert matcher.accepts(b"{    ")
+    assert not matcher.accepts(b"{     ")
+
+
+def test_select_tokens_keeps_best_ranked_valid_tokens():
+    token_bytes = [b'{"', b"```", b"{", None, b' {"', b'{"title": "']
+    matcher = JsonSchemaMatcher(SCHEMA)
+    # Ranked by score: the fence and the special token are skipped
+    assert select_tokens(matcher, [1, 3, 5, 0, 2, 4], token_bytes, keep=2) == [5, 0]
+    assert select_tokens(matcher, [1, 3], token_bytes, keep=2) == []
@@ -0,0 +1,110 @@
+import io
+import json
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.common.omr import BUBBLE_RADIUS, OMRReader, SheetLayout, _homography, _project
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+OPTIONS = ["red", "green", "blue", "white"]
+QUESTIONS = [
+    {"text": f"Question {n}", "type": "MCQ", "points": 1,
+     "options": [{"text": option, "isCorrect": False} for option in OPTIONS]}
+    for n in range(10)
+] + [{"text": "Explain your choices.", "type": "ESSAY", "points": 5, "options": []}]
+# Option chosen on each bubble question
+MARKED = [0, 1, 2, 3, 0, 1, 2, 3, 1, 2]
+
+
+class AnswerBackend(GenerationBackend):
+    """Answers the essay (question 11) whatever the prompt asks for, keeping the prompts"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, contents, stream=False, schema=None):
+        self.prompts.append(contents[0])
+        return GeneratedText(json.dumps({"answers": [{"question": 11, "answer": "From the model"}]}))
+
+
+def _sheet(marked, angle: float = 4.0, faint=()) -> Image.Image:
+    layout = SheetLayout(QUESTIONS)
+    sheet = layout.render("Quiz").convert("RGB")
+    draw = ImageDraw.Draw(sheet)
+    for (x, y), question, option in zip(layout.centers, layout.question_index, layout.option_index):
+        if marked[question] == option:
+            # A faint mark only covers part of the bubble
+            radius = BUBBLE_RADIUS * (0.35 if question in faint else 0.9)
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=(20, 20, 20))
+    # Photographed slightly rotated on a darker desk
+    return sheet.rotate(angle, expand=True, fillcolor=(150, 140, 130), resample=Image.BICUBIC)
+
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_homography_maps_corners_exactly():
+    source = np.array([[0, 0], [100, 0], [100, 200], [0, 200]], dtype=np.float64)
+    target = np.array([[12, 7], [118, 15], [110, 230], [3, 214]], dtype=np.float64)
+    matrix = _homography(source, target)
+
+    assert np.allclose(_project(matrix, source), target)
+    assert np.allclose(_project(np.linalg.inv(matrix), target), source)
+
+
+def test_rotated_sheet_reads_every_bubble():
+    reading = OMRReader().read(_sheet(MARKED), QUESTIONS)
+
+    assert reading.registered
+    assert reading.uncertain == []
+    assert {index: answer["selectedOption"] for index, answer in reading.answers.items()} == {
+        index: "abcd"[option] for index, option in enumerate(MARKED)}
+    assert reading.answers[0]["answer"] == "red"
+    assert all(answer["source"] == "omr" for answer in reading.answers.values())
+
+
+def test_unclear_marks_and_essays_fall_back_to_the_model(tmp_path):
+    backend = AnswerBackend()
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=OMRReader(), backend=backend)
+
+    result = processor.process_student_answers(_png(_sheet(MARKED, faint={3})), {"questions": QUESTIONS})
+
+    assert len(backend.prompts) == 1
+    answers = result["answers"]
+    assert [answer["answer"] for answer in answers[:3]] == ["red", "green", "blue"]
+    # The faint mark is neither read as blank nor as an answer locally
+    assert answers[3].get("source") != "omr"
+    assert answers[10] == {"answer": "from the model", "source": "vlm"}
+    assert result["omr"]["registered"]
+    assert result["omr"]["localAnswers"] == 9
+    assert result["omr"]["vlmQuestions"] == 2
+
+
+def test_sheet_without_markers_is_read_by_the_model(tmp_path):
+    backend = AnswerBackend()
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=OMRReader(), backend=backend)
+    photo = Image.new("RGB", (900, 1200), "white")
+
+    result = processor.process_student_answers(_png(photo), {"questions": QUESTIONS})
+
+    assert len(backend.prompts) == 1
+    assert not result["omr"]["registered"]
+    assert result["omr"]["vlmQuestions"] == len(QUESTIONS)
+    assert len(result["answers"]) == len(QUESTIONS)
+
+
+def test_all_bubbles_read_locally_skips_the_model(tmp_path):
+    backend = AnswerBackend()
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=OMRReader(), backend=backend)
+
+    result = processor.process_student_answers(_png(_sheet(MARKED)), {"questions": QUESTIONS[:10]})
+
+    assert backend.prompts == []
+    assert result["omr"]["vlmCalls"] == 0
+    assert [answer["selectedOption"] for answer in result["answers"]] == ["abcd"[option] for option in MARKED]
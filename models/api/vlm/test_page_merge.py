@@ -0,0 +1,65 @@
+import pytest
+
+from models.common.generation_backends import ReplayBackend
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+
+def _mcq(text, *options):
+    return {"text": text, "type": "MCQ", "points": 1, "modelAnswer": options[0],
+            "options": [{"text": option, "isCorrect": i == 0} for i, option in enumerate(options)]}
+
+
+def _essay(text):
+    return {"text": text, "type": "ESSAY", "points": 3, "modelAnswer": "", "options": []}
+
+
+@pytest.fixture
+def processor(tmp_path):
+    return ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=ReplayBackend(tmp_path, fallback="{}"))
+
+
+def test_questions_sharing_a_stem_are_all_kept(processor):
+    page = {"questions": [
+        _mcq("Which of the following is true?", "2 is prime", "4 is prime"),
+        _mcq("Which of the following is true?", "Water boils at 100 C", "Ice is hot"),
+        _essay("Explain the water cycle."),
+        _essay("Explain the water cycle in detail, with a diagram."),
+    ]}
+    # The same stem also starts the next page, with different options
+    next_page = {"questions": [_mcq("Which of the following is true?", "Sound is faster than light", "It isn't")]}
+
+    merged = processor.merge_exam_pages([page, next_page])
+
+    assert len(merged["questions"]) == 5
+
+
+def test_question_repeated_across_a_page_boundary_is_dropped(processor):
+    repeated = _mcq("2. Which planet is closest to the sun?", "Mercury", "Venus", "Earth")
+    first = {"title": "Astronomy", "questions": [_essay("Name the planets."), repeated]}
+    # The next photo overlaps: the same question again, numbered differently
+    second = {"questions": [dict(repeated, text="2) Which planet is closest to the sun?"),
+                            _essay("Why is Pluto not a planet?")]}
+
+    merged = processor.merge_exam_pages([first, second])
+
+    assert merged["title"] == "Astronomy"
+    assert [q["text"] for q in merged["questions"]] == [
+        "Name the planets.", "2. Which planet is closest to the sun?", "Why is Pluto not a planet?"]
+
+
+def test_question_cut_at_the_page_edge_keeps_the_complete_copy(processor):
+    full = _mcq("Which gas do plants take in during photosynthesis?", "Carbon dioxide", "Oxygen", "Nitrogen")
+    cut = _mcq("Which gas do plants take in during photo", "Carbon dioxide")
+
+    merged = processor.merge_exam_pages([{"questions": [cut]}, {"questions": [full, _essay("Define osmosis.")]}])
+
+    assert merged["questions"] == [full, _essay("Define osmosis.")]
+
+
+def test_repeats_far_from_the_boundary_are_kept(processor):
+    repeated = _essay("Summarize the passage above.")
+    pages = [{"questions": [repeated] + [_essay(f"Question {n}") for n in range(4)]},
+             {"questions": [repeated]}]
+
+    assert len(processor.merge_exam_pages(pages)["questions"]) == 6
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.common.prefix_cache import PrefixKVCache
+
+PREFIX = [11, 12, 13]
+PAD = 0
+
+
+class PrefixTokenizer:
+    """Tokenizes any text as PREFIX"""
+
+    def __call__(self, text, return_tensors="pt", add_special_tokens=False):
+        return SimpleNamespace(input_ids=torch.tensor([PREFIX]))
+
+
+class RecordingModel:
+    """Stands in for Qwen2.5-VL: forward passes return a placeholder cache, generate calls are kept"""
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.generated = []
+
+    def __call__(self, **kwargs):
+        return SimpleNamespace(past_key_values="prefix cache")
+
+    def generate(self, **kwargs):
+        self.generated.append(kwargs)
+        return kwargs["input_ids"]
+
+
+def _prefix_cache(model=None) -> PrefixKVCache:
+    return PrefixKVCache(model or RecordingModel(), SimpleNamespace(tokenizer=PrefixTokenizer()), "system prompt")
+
+
+def _left_padded(*rows):
+    """input_ids and attention_mask as the processor returns them, padded on the left"""
+    width = max(len(row) for row in rows)
+    ids = torch.tensor([[PAD] * (width - len(row)) + row for row in rows])
+    mask = torch.tensor([[0] * (width - len(row)) + [1] * len(row) for row in rows])
+    return ids, mask
+
+
+def test_padding_moves_behind_the_shared_prefix():
+    ids, mask = _left_padded(PREFIX + [1, 2, 3], PREFIX + [4])
+
+    arranged_ids, arranged_mask = _prefix_cache().arrange(ids, mask)
+
+    assert arranged_ids.tolist() == [PREFIX + [1, 2, 3], PREFIX + [PAD, PAD, 4]]
+    assert arranged_mask.tolist() == [[1, 1, 1, 1, 1, 1], [1, 1, 1, 0, 0, 1]]
+
+
+def test_prompts_without_the_prefix_are_not_arranged():
+    cache = _prefix_cache()
+
+    assert cache.arrange(*_left_padded([9, 9, 9, 1])) is None
+    # One row with the prefix and one without can't share it either
+    assert cache.arrange(*_left_padded(PREFIX + [1, 2], [9, 9, 9, 1])) is None
+    # Nor a row padded anywhere but the start
+    assert cache.arrange(torch.tensor([PREFIX + [PAD]]), torch.tensor([[1, 1, 1, 0]])) is None
+
+
+def test_mixed_batch_falls_back_to_a_full_forward_pass():
+    model = RecordingModel()
+    ids, mask = _left_padded(PREFIX + [1, 2], [9, 9, 9, 1])
+
+    _prefix_cache(model).generate(ids, mask, pixel_values="pixels", max_new_tokens=5)
+
+    call, = model.generated
+    assert torch.equal(call["input_ids"], ids)
+    assert torch.equal(call["attention_mask"], mask)
+    assert call["pixel_values"] == "pixels" and call["max_new_tokens"] == 5
+    assert "past_key_values" not in call
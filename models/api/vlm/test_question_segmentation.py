@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+from models.vlm.gemini.question_segmentation import QuestionSegmenter
+
+QUESTIONS = 6
+MODEL_DELAY = 0.3
+
+
+def _page() -> Image.Image:
+    """A printed page: a two-line header, then questions with indented options"""
+    font = ImageFont.load_default(size=22)
+    page = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(page)
+    y = 60
+    draw.text((80, y), "Midterm Exam - CS101 - Duration 60 minutes", font=font, fill=0)
+    draw.text((80, y + 40), "Answer all questions", font=font, fill=0)
+    y += 120
+    for number in range(1, QUESTIONS + 1):
+        draw.text((80, y), f"{number}. What does question number {number} of this exam ask about?", font=font, fill=0)
+        y += 34
+        for letter in "abcd":
+            draw.text((130, y), f"{letter}) option {letter} of question {number}", font=font, fill=0)
+            y += 30
+        y += 22
+    return page
+
+
+class RegionBackend(GenerationBackend):
+    """Answers every region with one question after a fixed delay, failing the third call"""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, schema=None):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(MODEL_DELAY)
+        if call == 3:
+            raise RuntimeError("unreadable region")
+        return GeneratedText(json.dumps({"questions": [{
+            "text": f"Question read in call {call}", "type": "MCQ", "points": 1, "modelAnswer": "a",
+            "options": [{"text": "a", "isCorrect": True}, {"text": "b", "isCorrect": False}],
+        }]}))
+
+
+def test_page_splits_into_header_and_one_block_per_question():
+    page = _page()
+    boxes = QuestionSegmenter(max_regions=20).segment(page)
+
+    assert len(boxes) == QUESTIONS + 1
+    tops = [box[1] for box in boxes]
+    assert tops == sorted(tops)
+    assert all(0 <= l < r <= page.width and 0 <= t < b <= page.height for l, t, r, b in boxes)
+
+
+def test_blocks_are_merged_down_to_max_regions():
+    assert len(QuestionSegmenter(max_regions=3).segment(_page())) == 3
+
+
+def test_blank_page_is_one_region():
+    page = Image.new("L", (600, 800), 255)
+    assert QuestionSegmenter().segment(page) == [(0, 0, 600, 800)]
+
+
+def test_regions_are_extracted_concurrently_and_a_failed_one_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr("models.vlm.gemini.exam_processor.DEFAULT_REGION_CONCURRENCY", 8)
+    backend = RegionBackend()
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=backend,
+                              segmenter=QuestionSegmenter(max_regions=QUESTIONS + 1))
+    page = tmp_path / "page.png"
+    _page().save(page)
+
+    start = time.perf_counter()
+    exam = processor.process_teacher_exam(str(page))
+    elapsed = time.perf_counter() - start
+
+    assert backend.calls == QUESTIONS + 1
+    assert len(exam["questions"]) == QUESTIONS
+    # All regions in flight at once, not one after another
+    assert elapsed < MODEL_DELAY * 3
+    stats = processor.repair_stats()
+    assert stats["regions"] == QUESTIONS + 1
+    assert stats["failedRegions"] == 1
+    # The incomplete page is reported and extracted again next time
+    assert exam["failedRegions"] == [3]
+    assert processor.cache.stats()["entries"] == 0
+    processor.process_teacher_exam(str(page))
+    assert backend.calls == 2 * (QUESTIONS + 1)
+    assert processor.cache.stats()["entries"] == 1
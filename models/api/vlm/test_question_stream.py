@@ -0,0 +1,71 @@
+import io
+import json
+
+from PIL import Image
+
+from models.common.generation_backends import GeneratedText, GenerationBackend
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+from models.vlm.gemini.incremental_json import QuestionStreamParser
+
+QUESTIONS = [
+    {"text": "Name a {curly} brace", "type": "ESSAY", "points": 1, "modelAnswer": "}", "options": []},
+    {"text": "2 + 2?", "type": "MCQ", "points": 1, "modelAnswer": "4",
+     "options": [{"text": "4", "isCorrect": True}, {"text": "5", "isCorrect": False}]},
+    {"text": "Say \"done\"", "type": "ESSAY", "points": 2, "modelAnswer": "done", "options": []},
+]
+DOCUMENT = json.dumps({"title": "Streamed", "questions": QUESTIONS})
+
+
+class ChunkedBackend(GenerationBackend):
+    """Streams DOCUMENT in the given chunk boundaries"""
+
+    def __init__(self, cuts):
+        self.cuts = cuts
+
+    def generate_content(self, contents, stream=False, schema=None):
+        bounds = [0, *self.cuts, len(DOCUMENT)]
+        chunks = [GeneratedText(DOCUMENT[start:end]) for start, end in zip(bounds, bounds[1:])]
+        return iter(chunks) if stream else GeneratedText(DOCUMENT)
+
+
+def _page() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_parser_finds_several_questions_in_one_chunk():
+    parser = QuestionStreamParser()
+    found = parser.feed("```json\n" + DOCUMENT + "\n```")
+
+    assert [json.loads(fragment) for fragment in found] == QUESTIONS
+    assert parser.emitted == 3 and parser.complete
+
+
+def test_parser_joins_a_question_split_across_chunks():
+    parser = QuestionStreamParser()
+    split = DOCUMENT.index("2 + 2")
+    first, second = parser.feed(DOCUMENT[:split]), parser.feed(DOCUMENT[split:])
+
+    assert [json.loads(fragment) for fragment in first] == QUESTIONS[:1]
+    assert [json.loads(fragment) for fragment in second] == QUESTIONS[1:]
+
+
+def test_parser_byte_by_byte_matches_one_chunk():
+    parser = QuestionStreamParser()
+    found = [fragment for char in DOCUMENT for fragment in parser.feed(char)]
+    assert [json.loads(fragment) for fragment in found] == QUESTIONS
+
+
+def test_streamed_questions_get_consecutive_indexes(tmp_path):
+    # The last two questions finish in the same chunk
+    cut = DOCUMENT.index("2 + 2") - 10
+    processor = ExamProcessor(cache=ExtractionCache(tmp_path), omr=None, backend=ChunkedBackend([cut]))
+
+    events = list(processor.stream_teacher_exam(_page()))
+
+    questions = [event for event in events if event["type"] == "question"]
+    assert [event["index"] for event in questions] == [0, 1, 2]
+    assert events[-1]["type"] == "exam"
+    assert len(events[-1]["exam"]["questions"]) == 3
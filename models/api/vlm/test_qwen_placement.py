@@ -0,0 +1,39 @@
+import logging
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from models.common.generation_backends import load_qwen_model, resolve_qwen_placement
+
+
+def _cuda(monkeypatch, available: bool):
+    """torch as far as resolve_qwen_placement looks at it, with or without a GPU"""
+    torch = SimpleNamespace(cuda=SimpleNamespace(is_available=lambda: available))
+    monkeypatch.setitem(sys.modules, "torch", torch)
+
+
+def test_auto_picks_the_gpu_only_when_there_is_one(monkeypatch):
+    _cuda(monkeypatch, False)
+    assert resolve_qwen_placement("auto", "auto") == ("cpu", "int8")
+    assert resolve_qwen_placement("AUTO", "none") == ("cpu", "none")
+
+    _cuda(monkeypatch, True)
+    assert resolve_qwen_placement("auto", "auto") == ("cuda", "none")
+
+
+def test_int8_on_cuda_loads_unquantized(caplog):
+    with caplog.at_level(logging.WARNING, logger="models.common.generation_backends"):
+        assert resolve_qwen_placement("cuda", "int8") == ("cuda", "none")
+
+    assert "only runs on CPU" in caplog.text
+    assert resolve_qwen_placement("cpu", "int8") == ("cpu", "int8")
+
+
+@pytest.mark.parametrize("device, quantize", [("tpu", "auto"), ("cuda:1", "none"), ("cpu", "int4"), ("cpu", "")])
+def test_unknown_settings_are_rejected(device, quantize):
+    with pytest.raises(ValueError):
+        resolve_qwen_placement(device, quantize)
+    # Before torch or the weights are touched
+    with pytest.raises(ValueError):
+        load_qwen_model("unused", device=device, quantize=quantize)
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("fastapi")
+
+from PIL import Image
+
+from models.api.vlm import main_api
+from models.api.vlm.processor_provider import set_processor
+from models.common.generation_backends import GenerationBackend, LatencyModel, RecordingBackend, ReplayBackend, ReplayMissError
+from models.vlm.gemini.exam_processor import ExamProcessor
+from models.vlm.gemini.extraction_cache import ExtractionCache
+
+RECORDED_EXAM = {
+    "title": "Replayed Exam",
+    "questions": [
+        {"text": "2 + 2 = 4", "type": "MCQ", "points": 1, "modelAnswer": "true",
+         "options": [{"text": "True", "isCorrect": True}, {"text": "False", "isCorrect": False}]},
+        {"text": "Explain recursion.", "type": "ESSAY", "points": 3, "modelAnswer": "A function calling itself.",
+         "options": []},
+    ],
+}
+
+
+def _page() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_recorded_extraction_replays_through_the_api(tmp_path):
+    replays = tmp_path / "replays"
+    page = _page()
+
+    # Record once, as a live backend would have answered
+    live = ReplayBackend(tmp_path / "empty", fallback=json.dumps(RECORDED_EXAM))
+    recorder = ExamProcessor(cache=ExtractionCache(tmp_path / "cache-1"), omr=None,
+                             backend=RecordingBackend(live, replays))
+    recorded = recorder.process_teacher_exam(page)
+    assert len(list(replays.glob("*.json"))) == 1
+
+    replay = ReplayBackend(replays, latency="fixed:0.05")
+    set_processor(ExamProcessor(cache=ExtractionCache(tmp_path / "cache-2"), omr=None, backend=replay))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/teacher/process-exam/", files={"file": ("page.png", page, "image/png")})
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        set_processor(None)
+
+    assert response.status_code == 200
+    assert response.json()["questions"] == recorded["questions"]
+    assert len(recorded["questions"]) == 2
+    assert replay.stats()["hits"] == 1
+
+
+def test_unrecorded_image_is_a_miss(tmp_path):
+    replay = ReplayBackend(tmp_path)
+    with pytest.raises(ReplayMissError):
+        replay.generate_content(["prompt", _page()])
+    assert replay.stats()["misses"] == 1
+
+
+def test_replayed_stream_spreads_latency_over_chunks(tmp_path):
+    replay = ReplayBackend(tmp_path, latency="fixed:0.2", fallback="x" * 40, stream_chunk_chars=10)
+    start = time.perf_counter()
+    chunks = replay.generate_content(["prompt", _page()], stream=True)
+    first = time.perf_counter() - start
+    text = "".join(chunk.text for chunk in chunks)
+
+    assert text == "x" * 40
+    assert first < 0.15
+    assert time.perf_counter() - start >= 0.19
+
+
+def test_latency_distributions():
+    assert LatencyModel("fixed:0.3").sample() == 0.3
+    samples = [LatencyModel("uniform:0.1,0.2", seed=1).sample() for _ in range(50)]
+    assert all(0.1 <= s <= 0.2 for s in samples)
+    assert LatencyModel("normal:-5,0.1", seed=1).sample() == 0.0
+    with pytest.raises(ValueError):
+        LatencyModel("pareto:1")
+
+
+def test_backend_must_implement_generate_content():
+    class Incomplete(GenerationBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from models.common.batching import DynamicBatcher
+from models.common.token_stream import RowStreamer, StreamRelay
+from models.vlm.gemini.incremental_json import QuestionStreamParser
+
+EOS = 0
+
+
+class ByteTokenizer:
+    """Token id n > 0 is the single byte n - 1; 0 is the end-of-sequence token"""
+
+    def decode(self, token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False):
+        data = bytes(t - 1 for t in token_ids if not (skip_special_tokens and t == EOS))
+        return data.decode("utf-8", errors="replace")
+
+
+def encode(text: str):
+    return [b + 1 for b in text.encode("utf-8")]
+
+
+def test_each_row_gets_its_own_text():
+    answers = ['{"q": "é"}', '{"a": 1}', "ignored"]
+    received = [[], []]
+    streamer = RowStreamer(ByteTokenizer(), [received[0].append, received[1].append, None])
+
+    rows = [encode(answer) for answer in answers]
+    length = max(len(row) for row in rows)
+    # Finished rows are padded with end-of-sequence tokens, as generate does
+    rows = [row + [EOS] * (length - len(row)) for row in rows]
+    streamer.put(np.array([[5, 6]] * 3))  # the prompt, skipped
+    for step in range(length):
+        streamer.put(np.array([row[step] for row in rows]))
+    streamer.end()
+
+    assert "".join(received[0]) == answers[0]
+    assert "".join(received[1]) == answers[1]
+    # "é" is two bytes and only goes out once whole
+    assert "é" in received[0]
+    assert all("�" not in piece for piece in received[0])
+
+
+def test_failing_listener_is_dropped():
+    received = []
+
+    def gone(text):
+        raise RuntimeError("client disconnected")
+
+    streamer = RowStreamer(ByteTokenizer(), [gone, received.append])
+    streamer.put(np.array([[1], [1]]))
+    for a, b in zip(encode("xy"), encode("ok")):
+        streamer.put(np.array([a, b]))
+    streamer.end()
+
+    assert streamer.listeners[0] is None
+    assert "".join(received) == "ok"
+
+
+DOCUMENT = json.dumps({"title": "t", "questions": [{"text": "a", "type": "mcq"}, {"text": "b", "type": "essay"}]})
+
+
+class StreamingModel:
+    """Streams DOCUMENT to every relay of a batch in 7-character pieces, like _process_batch
+    in the student API; fails halfway through any batch of more than fail_above items"""
+
+    def __init__(self, fail_above: int = 4):
+        self.fail_above = fail_above
+        self.batches = []
+
+    def __call__(self, relays):
+        self.batches.append(len(relays))
+        for relay in relays:
+            relay.restart()
+        for start in range(0, len(DOCUMENT), 7):
+            if len(relays) > self.fail_above and start > len(DOCUMENT) // 2:
+                raise MemoryError("batch too large")
+            for relay in relays:
+                relay(DOCUMENT[start:start + 7])
+            time.sleep(0.005)
+        return [json.loads(DOCUMENT) for _ in relays]
+
+
+async def _stream(batcher):
+    """The event flow of /process-exam/stream: (events, text) once the result is in"""
+    relay = StreamRelay()
+    result = asyncio.wrap_future(batcher.submit(relay))
+    result.add_done_callback(lambda _: relay.close())
+    parser = QuestionStreamParser()
+    events = []
+    async for kind, text in relay.events():
+        if kind == "reset":
+            parser = QuestionStreamParser()
+            events.append("reset")
+            continue
+        events.append("token")
+        events += ["question"] * len(parser.feed(text))
+    events.append(await result)
+    return events, parser.text
+
+
+def test_concurrent_streams_share_one_batch():
+    model = StreamingModel()
+    batcher = DynamicBatcher(model, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(_stream(batcher) for _ in range(4)))
+
+    streams = asyncio.run(main())
+    batcher.stop()
+
+    assert model.batches == [4]
+    for events, text in streams:
+        assert text == DOCUMENT
+        assert events.count("question") == 2 and "reset" not in events
+        assert events[-1] == json.loads(DOCUMENT)
+
+
+def test_retried_request_resets_its_stream():
+    model = StreamingModel(fail_above=1)
+    batcher = DynamicBatcher(model, max_batch_size=2, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(_stream(batcher) for _ in range(2)))
+
+    streams = asyncio.run(main())
+    batcher.stop()
+
+    assert model.batches == [2, 1, 1]
+    for events, text in streams:
+        # Tokens of the failed batch are voided once, then the retry streams the whole answer
+        assert events.count("reset") == 1
+        assert text == DOCUMENT
+        assert events[events.index("reset"):].count("question") == 2
@@ -0,0 +1,55 @@
+from PIL import Image, ImageDraw, ImageFont
+
+from models.common.vision_budget import (
+    choose_long_edge,
+    estimate_text_height,
+    gemini_image_tokens,
+    qwen_image_tokens,
+)
+from models.vlm.gemini.image_preprocessing import ImagePreprocessor
+
+
+def _page(font_size: int) -> Image.Image:
+    """A 1600 px tall page of text lines in the given font size"""
+    font = ImageFont.load_default(size=font_size)
+    page = Image.new("L", (1130, 1600), 255)
+    draw = ImageDraw.Draw(page)
+    y = 60
+    while y < 1500:
+        draw.text((60, y), "Which of the following statements about gradient descent is true?",
+                  font=font, fill=0)
+        y += int(font_size * 1.8)
+    return page
+
+
+def test_token_estimates():
+    assert gemini_image_tokens((300, 200)) == 258
+    # Gemini tiles by the short side, so below the 768 px tile cap the count follows the aspect ratio
+    assert gemini_image_tokens((900, 600)) == gemini_image_tokens((1050, 700)) == 6 * 258
+    assert qwen_image_tokens((1120, 840), 4 * 28 * 28, 10_000_000) == 40 * 30
+    # Capped at max_pixels
+    assert qwen_image_tokens((4000, 3000), 4 * 28 * 28, 1280 * 28 * 28) <= 1280
+
+
+def test_text_height_follows_the_font_size():
+    small = estimate_text_height(_page(14))
+    large = estimate_text_height(_page(28))
+    assert small is not None and large is not None
+    assert 1.6 < large / small < 2.4
+    assert estimate_text_height(Image.new("L", (800, 1000), 255)) is None
+
+
+def test_smallest_legible_edge_is_chosen():
+    ladder = [768, 1024, 1280]
+    assert choose_long_edge(1600, 32, 12, ladder) == 768
+    assert choose_long_edge(1600, 16, 12, ladder) == 1280
+    # Too small everywhere or unmeasurable: the largest allowed
+    assert choose_long_edge(1600, 8, 12, ladder) == 1280
+    assert choose_long_edge(1600, None, 12, ladder) == 1280
+
+
+def test_adaptive_preprocessing_shrinks_large_print_only():
+    preprocessor = ImagePreprocessor(target_long_edge=1280, deskew=False, auto_crop=False,
+                                     min_text_height=12, resolution_ladder=(768, 1024))
+    assert max(preprocessor.apply(_page(40)).size) == 768
+    assert max(preprocessor.apply(_page(12)).size) == 1280
@@ -0,0 +1,24 @@
+import os
+
+from fastapi import HTTPException, UploadFile
+
+# Largest single upload read into memory; larger ones are refused with 413
+VLM_MAX_UPLOAD_BYTES = int(os.getenv("VLM_MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+
+
+def _too_large(file: UploadFile) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"{file.filename} is larger than {VLM_MAX_UPLOAD_BYTES} bytes")
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """The upload's bytes, as a 413 if it is larger than VLM_MAX_UPLOAD_BYTES.
+
+    Starlette has already spooled the body to disk past 1 MB, so only up to the
+    limit plus one byte is ever read into memory.
+    """
+    if file.size is not None and file.size > VLM_MAX_UPLOAD_BYTES:
+        raise _too_large(file)
+    data = await file.read(VLM_MAX_UPLOAD_BYTES + 1)
+    if len(data) > VLM_MAX_UPLOAD_BYTES:
+        raise _too_large(file)
+    return data
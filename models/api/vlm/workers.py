@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maximum number of blocking VLM jobs (Gemini calls, image decoding, file I/O) running at once.
+# Requests beyond this wait in the pool queue instead of blocking the event loop.
+VLM_MAX_WORKERS = int(os.getenv("VLM_MAX_WORKERS", "8"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Jobs submitted that no worker has started yet
+_queued = 0
+_queued_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the shared worker pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=VLM_MAX_WORKERS, thread_name_prefix="vlm-worker"
+                )
+                logger.info(f"Started VLM worker pool with {VLM_MAX_WORKERS} workers")
+    return _executor
+
+
+def _count_queued(change: int):
+    global _queued
+    with _queued_lock:
+        _queued += change
+
+
+def _submit(func: Callable) -> Future:
+    """Submit func to the worker pool, counting it as queued until a worker starts it"""
+    def run():
+        _count_queued(-1)
+        return func()
+
+    _count_queued(1)
+    try:
+        future = get_executor().submit(run)
+    except Exception:
+        _count_queued(-1)
+        raise
+    # Only a job that never started can be cancelled
+    future.add_done_callback(lambda done: done.cancelled() and _count_queued(-1))
+    return future
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """Run a blocking function in the worker pool and await its result"""
+    return await asyncio.wrap_future(_submit(partial(func, *args, **kwargs)))
+
+
+def queue_depth() -> int:
+    """Jobs submitted to the worker pool that no worker has picked up yet"""
+    with _queued_lock:
+        return _queued
+
+
+def shutdown_executor():
+    """Stop the worker pool, waiting for running jobs to finish"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+            logger.info("VLM worker pool stopped")
+
+
+async def iterate_blocking(func: Callable, *args, **kwargs):
+    """Run a blocking generator function in the worker pool, yielding its items as they arrive"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for item in func(*args, **kwargs):
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+            return
+        loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+    _submit(produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        # Stop the producer at its next item if the consumer went away (e.g. client disconnected)
+        cancelled.set()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from models.common import instrumentation
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BatchQueueFullError(Exception):
+    """Raised when too many requests are already waiting for the model"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DynamicBatcher:
+    """Owns a model on one worker thread and runs queued requests through it in batches.
+
+    The worker takes the oldest request, then keeps collecting until it has
+    max_batch_size of them or max_wait_ms have passed since that request was
+    taken, and hands the whole batch to process_batch in one call.
+    process_batch gets the items in submission order and returns one result per
+    item; a result that is an Exception fails only its own request. If the call
+    itself raises (e.g. out of memory on a large batch), the items are retried
+    one at a time so a single bad input can't fail its neighbours; process_batch
+    then sees those items a second time.
+
+    submit() rejects requests once max_queue are waiting, with a Retry-After
+    estimate from the recent batch durations.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 4,
+                 max_wait_ms: float = 10, max_queue: int = 32, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._batch_seconds = 1.0  # moving average, seeded pessimistically
+        instrumentation.register_queue(name, self.queue_depth)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                logger.info(f"Started {self.name}: batches of up to {self.max_batch_size}, "
+                            f"waiting at most {self.max_wait * 1000:.0f} ms")
+
+    def stop(self):
+        """Finish the queued requests, then stop the worker"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has probably drained"""
+        batches = math.ceil((self.queue_depth() + 1) / self.max_batch_size)
+        return max(1, math.ceil(batches * self._batch_seconds))
+
+    def submit(self, item) -> Future:
+        """Queue one request; the future resolves once its batch has run"""
+        if self._thread is None:
+            self.start()
+        future: Future = Future()
+        # Checked and queued together, so concurrent submits can't overshoot max_queue
+        with self._lock:
+            depth = self.queue_depth()
+            if depth >= self.max_queue:
+                raise BatchQueueFullError(f"{depth} requests already waiting", self.retry_after())
+            self._queue.put((item, future))
+        return future
+
+    async def run(self, item):
+        """submit() from async code, awaiting the result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.queue_depth(),
+            "batches": self.batches,
+            "items": self.items,
+            "meanBatchSize": round(self.items / self.batches, 2) if self.batches else None,
+            "meanBatchSeconds": round(self._batch_seconds, 3),
+        }
+
+    def _collect(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Stop marker: run what we have, the marker goes back behind the rest
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                if self._queue.empty():
+                    return
+                # Requests queued before stop() still run
+                self._queue.put(None)
+                continue
+            # Requests whose caller went away are dropped before they cost model time
+            batch = [(item, future) for item, future in self._collect(first)
+                     if future.set_running_or_notify_cancel()]
+            if batch:
+                self._execute(batch)
+
+    def _execute(self, batch: List):
+        items = [item for item, _ in batch]
+        start = time.perf_counter()
+        try:
+            with instrumentation.stage(f"{self.name}_batch"):
+                results = self.process_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"process_batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            if len(items) == 1:
+                results = [e]
+            else:
+                logger.warning(f"Batch of {len(items)} failed ({str(e)}), retrying one by one")
+                results = []
+                for item in items:
+                    try:
+                        results.append(self.process_batch([item])[0])
+                    except Exception as item_error:
+                        results.append(item_error)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * elapsed if self.batches > 1 else elapsed
+        logger.info(f"{self.name}: batch of {len(items)} in {elapsed:.2f}s")
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,264 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from models.common.vision_budget import gemini_image_tokens, payload_size
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Priority classes; lower runs first
+INTERACTIVE = 0  # a professor waiting on an exam upload
+BULK = 1         # student grading, RAG answers and other background work
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Limits apply per process, so split the project quota between the services that run
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+# Input cost of an image whose size can't be read, for token budgeting until the real usage is known
+IMAGE_TOKEN_ESTIMATE = 1290
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to one minute's worth"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 if it can be taken now"""
+        self._refill()
+        # Requests bigger than the whole bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Take tokens; negative amounts refund. The balance may go negative (debt)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for quota (429) and transient 5xx errors from the Gemini SDK"""
+    # google.api_core exceptions carry the HTTP status as .code
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+
+class _HeldStream:
+    """Iterates a streamed response, calling release once it is exhausted, fails, or is closed or dropped"""
+
+    def __init__(self, stream, release: Callable):
+        self._iterator = iter(stream)
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def __del__(self):
+        self.close()
+
+
+class GeminiScheduler:
+    """Process-wide gate in front of every Gemini call.
+
+    Calls wait for a request-per-minute and a token-per-minute bucket and a
+    concurrency slot, are admitted by priority class (then arrival order), and
+    are retried with jittered exponential backoff on 429/5xx.
+    """
+
+    def __init__(self,
+                 requests_per_minute: float = GEMINI_RPM,
+                 tokens_per_minute: float = GEMINI_TPM,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 max_retries: int = GEMINI_MAX_RETRIES,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 30.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+
+        self._stats = {
+            priority: {"calls": 0, "retries": 0, "failures": 0, "totalWait": 0.0, "maxWait": 0.0,
+                       "recentWaits": deque(maxlen=1000)}
+            for priority in PRIORITY_NAMES
+        }
+
+    def generate_content(self, model, contents, priority: int = INTERACTIVE, **kwargs):
+        """Scheduled model.generate_content(contents, **kwargs)"""
+        return self.call(model.generate_content, contents, priority=priority,
+                         estimated_tokens=self.estimate_tokens(contents), **kwargs)
+
+    def call(self, func: Callable, *args, priority: int = INTERACTIVE,
+             estimated_tokens: int = IMAGE_TOKEN_ESTIMATE, **kwargs):
+        """Run func(*args, **kwargs) once admitted, retrying transient failures.
+
+        With stream=True the concurrency slot is held until the returned stream
+        is exhausted or closed; errors raised while it is consumed are not retried.
+        """
+        stats = self._stats[priority]
+        for attempt in range(self.max_retries + 1):
+            self._acquire(priority, estimated_tokens)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._release()
+                error = e
+            else:
+                if kwargs.get("stream"):
+                    return _HeldStream(result, self._release)
+                self._release()
+                self._record_usage(result, estimated_tokens)
+                return result
+
+            if not is_retryable(error) or attempt == self.max_retries:
+                with self._condition:
+                    stats["failures"] += 1
+                raise error
+            delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+            # Full jitter spreads out clients that were throttled together
+            delay = random.uniform(0, delay)
+            with self._condition:
+                stats["retries"] += 1
+            logger.warning(f"Gemini call failed ({str(error)}), retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+    @staticmethod
+    def estimate_tokens(contents) -> int:
+        """Cheap input-size estimate: ~4 characters per token, images by their tile count"""
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        total = 0
+        for part in parts:
+            if isinstance(part, str):
+                total += len(part) // 4
+            else:
+                size = payload_size(part)
+                total += gemini_image_tokens(size) if size else IMAGE_TOKEN_ESTIMATE
+        return max(total, 1)
+
+    def metrics(self) -> Dict:
+        """Queue-wait and retry statistics per priority class"""
+        with self._condition:
+            result = {
+                "inFlight": self._in_flight,
+                "queued": len(self._waiting),
+                "queuedByPriority": {
+                    name: sum(1 for p, _ in self._waiting if p == priority)
+                    for priority, name in PRIORITY_NAMES.items()
+                },
+                "classes": {},
+            }
+            for priority, name in PRIORITY_NAMES.items():
+                stats = self._stats[priority]
+                waits = sorted(stats["recentWaits"])
+                result["classes"][name] = {
+                    "calls": stats["calls"],
+                    "retries": stats["retries"],
+                    "failures": stats["failures"],
+                    "meanWaitS": stats["totalWait"] / stats["calls"] if stats["calls"] else 0.0,
+                    "maxWaitS": stats["maxWait"],
+                    "p50WaitS": waits[len(waits) // 2] if waits else 0.0,
+                    "p95WaitS": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                }
+            return result
+
+    def _acquire(self, priority: int, estimated_tokens: int):
+        ticket = (priority, next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                timeout = None
+                if self._waiting[0] == ticket and self._in_flight < self.max_concurrency:
+                    timeout = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                    if timeout <= 0:
+                        break
+                self._condition.wait(timeout)
+
+            heapq.heappop(self._waiting)
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self._in_flight += 1
+
+            waited = time.monotonic() - start
+            stats = self._stats[priority]
+            stats["calls"] += 1
+            stats["totalWait"] += waited
+            stats["maxWait"] = max(stats["maxWait"], waited)
+            stats["recentWaits"].append(waited)
+            # The next ticket may be admissible now too
+            self._condition.notify_all()
+
+        if waited > 1:
+            logger.info(f"{PRIORITY_NAMES[priority]} Gemini call waited {waited:.1f}s for capacity")
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _record_usage(self, response, estimated_tokens: int):
+        """Charge the token bucket for what the call really used"""
+        try:
+            actual = response.usage_metadata.total_token_count
+        except Exception:
+            # Streamed responses only report usage once consumed; keep the estimate
+            actual = None
+        if actual:
+            with self._condition:
+                self.tokens.consume(actual - estimated_tokens)
+
+
+_scheduler: Optional[GeminiScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GeminiScheduler:
+    """The scheduler shared by every Gemini caller in this process"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GeminiScheduler()
+    return _scheduler
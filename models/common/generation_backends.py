@@ -0,0 +1,485 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from PIL import Image
+
+from models.common.json_constraint import JsonConstraintLogitsProcessor, token_byte_table
+from models.common.vision_budget import gemini_image_tokens, payload_size, qwen_image_tokens
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Which model answers ExamProcessor's prompts: "gemini", "qwen" or "replay"
+VLM_BACKEND = os.getenv("VLM_BACKEND", "gemini")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-preview-04-17")
+QWEN_MODEL_ID = os.getenv("QWEN_MODEL_ID", "Qwen/Qwen2.5-VL-7B-Instruct")
+QWEN_MAX_NEW_TOKENS = int(os.getenv("QWEN_MAX_NEW_TOKENS", "2048"))
+# Pixel budget per image; Qwen spends one vision token per 28x28 pixels, so at most 1280 tokens by default
+QWEN_MIN_PIXELS = int(os.getenv("QWEN_MIN_PIXELS", str(256 * 28 * 28)))
+QWEN_MAX_PIXELS = int(os.getenv("QWEN_MAX_PIXELS", str(1280 * 28 * 28)))
+# Where Qwen runs: "auto" (GPU if there is one), "cuda" or "cpu"
+QWEN_DEVICE = os.getenv("QWEN_DEVICE", "auto")
+# "int8" quantizes the language model's linear layers on CPU; "auto" does so whenever running on CPU
+QWEN_QUANTIZE = os.getenv("QWEN_QUANTIZE", "auto")
+# Intra-op threads for CPU inference, 0 keeps torch's default (one per core)
+QWEN_CPU_THREADS = int(os.getenv("QWEN_CPU_THREADS", "0"))
+# Recorded responses served by the replay backend, and how long each one pretends to take
+VLM_REPLAY_DIR = os.getenv("VLM_REPLAY_DIR", "replays")
+VLM_REPLAY_LATENCY = os.getenv("VLM_REPLAY_LATENCY", "fixed:0")
+# Set to a directory to save every live response there, ready for replay
+VLM_RECORD_DIR = os.getenv("VLM_RECORD_DIR", "")
+
+
+class GeneratedText:
+    """Response or stream chunk with the .text attribute ExamProcessor reads from Gemini responses"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __iter__(self):
+        # A non-streamed response iterates as its single chunk
+        yield self
+
+
+class GenerationBackend(ABC):
+    """Turns a prompt plus an image into model text.
+
+    contents is a list of prompt strings and image payloads (PIL images,
+    {"mime_type", "data"} blobs or raw bytes). With stream=True the result is an
+    iterable of chunks with .text, otherwise one response with .text. schema is
+    the JSON schema the answer should follow, for backends that can enforce one.
+    """
+
+    name = "base"
+    # Whether calls count against the Gemini quota and so go through the shared scheduler
+    scheduled = False
+
+    @abstractmethod
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        """Model response to contents, or an iterable of chunks with stream=True"""
+
+    def signature(self) -> str:
+        """Identifies the model; cached extractions from another model must not be reused"""
+        return self.name
+
+    def image_tokens(self, size) -> int:
+        """Input tokens the model spends on an image of size (width, height); Gemini's tiling by default"""
+        return gemini_image_tokens(size)
+
+    def vision_tokens(self, contents: List) -> int:
+        """Input tokens spent on the images of a request"""
+        sizes = (payload_size(part) for part in contents if not isinstance(part, str))
+        return sum(self.image_tokens(size) for size in sizes if size)
+
+
+class GeminiBackend(GenerationBackend):
+    name = "gemini"
+    scheduled = True
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME, api_key: Optional[str] = None):
+        # Imported here so the other backends work without the Gemini SDK or a key
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        kwargs = {"stream": stream} if stream else {}
+        if schema is not None:
+            kwargs["generation_config"] = self._genai.GenerationConfig(
+                response_mime_type="application/json", response_schema=schema)
+        return self.model.generate_content(contents, **kwargs)
+
+    def signature(self) -> str:
+        return self.model_name
+
+
+def _to_pil(part) -> Image.Image:
+    if isinstance(part, Image.Image):
+        return part
+    if isinstance(part, dict):
+        part = part["data"]
+    return Image.open(io.BytesIO(part))
+
+
+def resolve_qwen_placement(device: str = QWEN_DEVICE, quantize: str = QWEN_QUANTIZE):
+    """(device, quantization) actually used for a QWEN_DEVICE / QWEN_QUANTIZE pair"""
+    device = device.lower()
+    if device not in ("auto", "cuda", "cpu"):
+        raise ValueError(f"Unknown QWEN_DEVICE: {device}")
+    if device == "auto":
+        import torch
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    quantize = quantize.lower()
+    if quantize == "auto":
+        quantize = "int8" if device == "cpu" else "none"
+    if quantize not in ("int8", "none"):
+        raise ValueError(f"Unknown QWEN_QUANTIZE: {quantize}")
+    if quantize == "int8" and device != "cpu":
+        logger.warning("int8 dynamic quantization only runs on CPU, loading unquantized")
+        quantize = "none"
+    return device, quantize
+
+
+def load_qwen_model(model_id: str = QWEN_MODEL_ID, device: str = QWEN_DEVICE,
+                    quantize: str = QWEN_QUANTIZE, threads: int = QWEN_CPU_THREADS):
+    """Load Qwen2.5-VL for the requested device (needs torch and transformers).
+
+    On GPU the weights stay in bfloat16 and are spread over the visible GPUs. On
+    CPU they load as float32 and, unless quantize is "none", the language
+    model's linear layers are dynamically quantized to int8 (weights stored as
+    int8, activations quantized per batch); the vision tower stays float32, it
+    runs once per image. Inputs must be moved to model.device, not a fixed device.
+    """
+    # Settings are checked before the heavy imports
+    device, quantize = resolve_qwen_placement(device, quantize)
+    import torch
+    from transformers import Qwen2_5_VLForConditionalGeneration
+
+    if device != "cpu":
+        return Qwen2_5_VLForConditionalGeneration.from_pretrained(
+            model_id,
+            torch_dtype=torch.bfloat16,
+            device_map="auto"
+        )
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+        model_id,
+        torch_dtype=torch.float32,
+        low_cpu_mem_usage=True
+    )
+    model.eval()
+    if quantize == "int8":
+        # Every Linear outside the vision tower, by name (the module layout differs between transformers versions)
+        linear_layers = {
+            name for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and "visual" not in name.split(".")
+        }
+        torch.ao.quantization.quantize_dynamic(model, linear_layers, dtype=torch.qint8, inplace=True)
+        logger.info(f"Quantized {len(linear_layers)} linear layers of {model_id} to int8")
+    logger.info(f"Running {model_id} on CPU with {torch.get_num_threads()} threads")
+    return model
+
+
+class QwenBackend(GenerationBackend):
+    """Qwen2.5-VL running locally through transformers (needs torch, transformers, qwen_vl_utils).
+
+    A JSON schema is enforced by constrained decoding: only tokens that keep the
+    answer valid under it are allowed, and generation stops once the JSON closes.
+    """
+
+    name = "qwen"
+
+    def __init__(self, model_id: str = QWEN_MODEL_ID, max_new_tokens: int = QWEN_MAX_NEW_TOKENS,
+                 min_pixels: int = QWEN_MIN_PIXELS, max_pixels: int = QWEN_MAX_PIXELS,
+                 device: str = QWEN_DEVICE, quantize: str = QWEN_QUANTIZE, threads: int = QWEN_CPU_THREADS):
+        try:
+            import torch
+            from transformers import AutoProcessor
+        except ImportError:
+            raise ImportError("QwenBackend needs torch and transformers: pip install torch transformers qwen-vl-utils")
+        self.model_id = model_id
+        self.max_new_tokens = max_new_tokens
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self._torch = torch
+        self.device, self.quantize = resolve_qwen_placement(device, quantize)
+        self.model = load_qwen_model(model_id, device=self.device, quantize=self.quantize, threads=threads)
+        self.processor = AutoProcessor.from_pretrained(model_id, min_pixels=min_pixels, max_pixels=max_pixels)
+        self._token_bytes = None
+        logger.info(f"Loaded {model_id} on {self.model.device}")
+
+    def _inputs(self, contents: List):
+        from qwen_vl_utils import process_vision_info
+
+        content = []
+        for part in contents:
+            if isinstance(part, str):
+                content.append({"type": "text", "text": part})
+            else:
+                # qwen_vl_utils resizes to its own (much larger) bounds unless given these
+                content.append({"type": "image", "image": _to_pil(part),
+                                "min_pixels": self.min_pixels, "max_pixels": self.max_pixels})
+        messages = [{"role": "user", "content": content}]
+        text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        image_inputs, video_inputs = process_vision_info(messages)
+        return self.processor(
+            text=[text],
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt"
+        ).to(self.model.device)
+
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        inputs = self._inputs(contents)
+        generate_kwargs = dict(
+            **inputs,
+            max_new_tokens=self.max_new_tokens,
+            pad_token_id=self.processor.tokenizer.eos_token_id
+        )
+        if schema is not None:
+            from transformers import LogitsProcessorList
+
+            generate_kwargs["logits_processor"] = LogitsProcessorList([self._json_constraint(schema)])
+        if stream:
+            return self._stream(generate_kwargs)
+
+        with self._torch.no_grad():
+            generated_ids = self.model.generate(**generate_kwargs)
+        generated_ids_trimmed = [
+            out_ids[len(in_ids):]
+            for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        output_text = self.processor.batch_decode(
+            generated_ids_trimmed,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )[0]
+        return GeneratedText(output_text)
+
+    def _json_constraint(self, schema: Dict) -> JsonConstraintLogitsProcessor:
+        if self._token_bytes is None:
+            # Built on first use: one pass over the ~150k token vocabulary
+            self._token_bytes = token_byte_table(self.processor.tokenizer)
+        eos = self.model.generation_config.eos_token_id
+        eos_ids = {self.processor.tokenizer.eos_token_id, *(eos if isinstance(eos, list) else [eos])} - {None}
+        return JsonConstraintLogitsProcessor(schema, self._token_bytes, eos_ids)
+
+    def _stream(self, generate_kwargs: Dict) -> Iterator[GeneratedText]:
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def run():
+            with self._torch.no_grad():
+                self.model.generate(**generate_kwargs, streamer=streamer)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield GeneratedText(text)
+        thread.join()
+
+    def signature(self) -> str:
+        # int8 weights can change the output, so quantized extractions are cached apart
+        return f"{self.model_id}|pixels={self.min_pixels}:{self.max_pixels}" + ("|int8" if self.quantize == "int8" else "")
+
+    def image_tokens(self, size) -> int:
+        return qwen_image_tokens(size, self.min_pixels, self.max_pixels)
+
+
+class LatencyModel:
+    """Synthetic model latency drawn from a distribution spec:
+
+    "fixed:S", "uniform:LOW,HIGH", "normal:MEAN,SD" or "lognormal:MU,SIGMA"
+    (MU and SIGMA of the underlying normal, so the median is e**MU seconds).
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str = "fixed:0", seed: Optional[int] = None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip().lower()
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.params = [float(p) for p in params.split(",") if p.strip()] or [0.0]
+        expected = 1 if self.kind == "fixed" else 2
+        if len(self.params) != expected:
+            raise ValueError(f"{self.kind} latency takes {expected} parameter(s): {spec}")
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                value = self.params[0]
+            elif self.kind == "uniform":
+                value = self._random.uniform(*self.params)
+            elif self.kind == "normal":
+                value = self._random.gauss(*self.params)
+            else:
+                value = self._random.lognormvariate(*self.params)
+        return max(0.0, value)
+
+
+class ReplayMissError(LookupError):
+    """Raised when no recording exists for an image and the replay backend has no fallback"""
+
+
+def _image_bytes(part) -> bytes:
+    if isinstance(part, (bytes, bytearray)):
+        return bytes(part)
+    if isinstance(part, dict):
+        return part["data"]
+    if isinstance(part, Image.Image):
+        return part.tobytes()
+    raise TypeError(f"Unsupported content part: {type(part).__name__}")
+
+
+def replay_keys(contents: List):
+    """(image hash, prompt hash) identifying a request in a recording directory"""
+    images = hashlib.sha256()
+    prompts = hashlib.sha256()
+    for part in contents:
+        if isinstance(part, str):
+            prompts.update(part.encode("utf-8"))
+        else:
+            images.update(_image_bytes(part))
+    return images.hexdigest()[:32], prompts.hexdigest()[:16]
+
+
+class ReplayBackend(GenerationBackend):
+    """Serves responses recorded earlier (see RecordingBackend), without network or GPU.
+
+    Recordings live in <directory>/<image hash>.json as {prompt hash: text}. The
+    image hash covers the payload actually sent, i.e. after preprocessing. A
+    request whose exact prompt was not recorded for that image gets the image's
+    last recording (prompts change more often than the test images), then
+    fallback, then ReplayMissError.
+
+    Calls go through the Gemini scheduler like live ones, so GEMINI_RPM and
+    GEMINI_MAX_CONCURRENCY shape load tests the same way they shape production.
+    """
+
+    name = "replay"
+    scheduled = True
+
+    def __init__(self, directory: Union[str, Path] = VLM_REPLAY_DIR, latency: Union[str, LatencyModel] = VLM_REPLAY_LATENCY,
+                 fallback: Optional[str] = None, stream_chunk_chars: int = 256, seed: Optional[int] = None):
+        self.directory = Path(directory)
+        self.latency = latency if isinstance(latency, LatencyModel) else LatencyModel(latency, seed)
+        self.fallback = fallback
+        self.stream_chunk_chars = stream_chunk_chars
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, contents: List) -> Optional[str]:
+        image_key, prompt_key = replay_keys(contents)
+        path = self.directory / f"{image_key}.json"
+        if not path.exists():
+            return None
+        recorded = json.loads(path.read_text(encoding="utf-8"))
+        if prompt_key in recorded:
+            return recorded[prompt_key]
+        return list(recorded.values())[-1] if recorded else None
+
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        text = self.lookup(contents)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if text is None:
+            if self.fallback is None:
+                raise ReplayMissError(f"No recording for image {replay_keys(contents)[0]} in {self.directory}")
+            text = self.fallback
+
+        delay = self.latency.sample()
+        if not stream:
+            time.sleep(delay)
+            return GeneratedText(text)
+
+        # The latency is spread evenly over the chunks, like tokens arriving. As with
+        # Gemini, the call itself returns once the first chunk is there.
+        size = max(1, self.stream_chunk_chars)
+        chunks = [text[start:start + size] for start in range(0, len(text), size)] or [""]
+        time.sleep(delay / len(chunks))
+        return self._stream(chunks, delay / len(chunks))
+
+    @staticmethod
+    def _stream(chunks: List[str], interval: float) -> Iterator[GeneratedText]:
+        yield GeneratedText(chunks[0])
+        for chunk in chunks[1:]:
+            time.sleep(interval)
+            yield GeneratedText(chunk)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "latency": self.latency.spec}
+
+
+class RecordingBackend(GenerationBackend):
+    """Passes calls to another backend and saves each response for ReplayBackend"""
+
+    def __init__(self, inner: GenerationBackend, directory: Union[str, Path] = VLM_RECORD_DIR or VLM_REPLAY_DIR):
+        self.inner = inner
+        self.name = inner.name
+        self.scheduled = inner.scheduled
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        response = self.inner.generate_content(contents, stream=stream, schema=schema)
+        if stream:
+            return self._record_stream(contents, response)
+        self.save(contents, response.text)
+        return response
+
+    def _record_stream(self, contents: List, response) -> Iterator:
+        parts = []
+        for chunk in response:
+            try:
+                parts.append(chunk.text)
+            except ValueError:
+                pass
+            yield chunk
+        self.save(contents, "".join(parts))
+
+    def save(self, contents: List, text: str):
+        image_key, prompt_key = replay_keys(contents)
+        path = self.directory / f"{image_key}.json"
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            recorded = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+            # Re-inserted so the newest recording is also the image's fallback
+            recorded.pop(prompt_key, None)
+            recorded[prompt_key] = text
+            path.write_text(json.dumps(recorded, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def signature(self) -> str:
+        return self.inner.signature()
+
+    def image_tokens(self, size) -> int:
+        return self.inner.image_tokens(size)
+
+
+def create_backend(name: Optional[str] = None) -> GenerationBackend:
+    """The backend selected by VLM_BACKEND, recording to VLM_RECORD_DIR if that is set"""
+    name = (name or VLM_BACKEND).lower()
+    if name == "gemini":
+        backend = GeminiBackend()
+    elif name == "qwen":
+        backend = QwenBackend()
+    elif name == "replay":
+        return ReplayBackend()
+    else:
+        raise ValueError(f"Unknown VLM_BACKEND: {name}")
+    if VLM_RECORD_DIR:
+        logger.info(f"Recording {name} responses to {VLM_RECORD_DIR}")
+        backend = RecordingBackend(backend, VLM_RECORD_DIR)
+    return backend
@@ -0,0 +1,27 @@
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+
+def ink_mask(gray: Image.Image, threshold: float = 0.75) -> np.ndarray:
+    """Ink pixels of a grayscale page, judged against the local paper brightness so shadows don't count.
+
+    A pixel is ink when darker than threshold times the blurred background around it.
+    """
+    background = gray.filter(ImageFilter.BoxBlur(max(8, max(gray.size) // 40)))
+    pixels = np.asarray(gray, dtype=np.float32)
+    paper = np.asarray(background, dtype=np.float32)
+    return pixels < np.maximum(paper, 1) * threshold
+
+
+def ink_runs(active: np.ndarray, min_gap: int = 1) -> List[Tuple[int, int]]:
+    """[start, end) of runs of True, joining runs separated by fewer than min_gap False"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    runs = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1] = (runs[-1][0], int(end))
+        else:
+            runs.append((int(start), int(end)))
+    return runs
@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict
+
+# Recent observations kept per stage for the quantiles; older ones only count towards _count/_sum
+RESERVOIR_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "grader"
+
+
+class Summary:
+    """Durations of one stage: quantiles over the recent window, totals over all time"""
+
+    def __init__(self):
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        self.recent.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self) -> Dict[float, float]:
+        values = sorted(self.recent)
+        if not values:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    """Per-stage latency, in-flight counts and queue depths of one service, in Prometheus text format"""
+
+    def __init__(self, service: str = "unknown"):
+        self.service = service
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Summary] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._queues: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, stage: str, seconds: float, failed: bool = False):
+        with self._lock:
+            summary = self._stages.setdefault(stage, Summary())
+            summary.observe(seconds)
+            summary.errors += failed
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time the enclosed block as one run of stage; exceptions count as errors and propagate"""
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, failed)
+
+    def timed(self, stage: str):
+        """Decorator form of stage()"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def in_flight(self, name: str):
+        """Count the enclosed block as one in-flight unit of name"""
+        with self._lock:
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+
+    def register_queue(self, name: str, depth: Callable[[], float]):
+        """Report depth() as the current length of queue name on every scrape"""
+        with self._lock:
+            self._queues[name] = depth
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        service = _escape(self.service)
+        with self._lock:
+            stages = {name: (summary.quantiles(), summary.count, summary.total, summary.errors)
+                      for name, summary in sorted(self._stages.items())}
+            in_flight = dict(sorted(self._in_flight.items()))
+            queues = dict(sorted(self._queues.items()))
+
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent per processing stage",
+            f"# TYPE {PREFIX}_stage_seconds summary",
+        ]
+        for name, (quantiles, count, total, _) in stages.items():
+            labels = f'service="{service}",stage="{_escape(name)}"'
+            for q, value in quantiles.items():
+                lines.append(f'{PREFIX}_stage_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{PREFIX}_stage_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{PREFIX}_stage_seconds_count{{{labels}}} {count}")
+
+        lines += [
+            f"# HELP {PREFIX}_stage_errors_total Stage runs that raised",
+            f"# TYPE {PREFIX}_stage_errors_total counter",
+        ]
+        for name, (_, _, _, errors) in stages.items():
+            lines.append(f'{PREFIX}_stage_errors_total{{service="{service}",stage="{_escape(name)}"}} {errors}')
+
+        lines += [
+            f"# HELP {PREFIX}_in_flight Units of work currently being processed",
+            f"# TYPE {PREFIX}_in_flight gauge",
+        ]
+        for name, value in in_flight.items():
+            lines.append(f'{PREFIX}_in_flight{{service="{service}",name="{_escape(name)}"}} {value}')
+
+        lines += [
+            f"# HELP {PREFIX}_queue_depth Work waiting to be processed",
+            f"# TYPE {PREFIX}_queue_depth gauge",
+        ]
+        for name, depth in queues.items():
+            try:
+                value = float(depth())
+            except Exception:
+                continue
+            lines.append(f'{PREFIX}_queue_depth{{service="{service}",queue="{_escape(name)}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# One registry per process; each service names itself in instrument_app()
+registry = MetricsRegistry()
+stage = registry.stage
+timed = registry.timed
+in_flight = registry.in_flight
+register_queue = registry.register_queue
+
+
+def instrument_app(app, service: str, path: str = "/metrics"):
+    """Add a Prometheus /metrics endpoint and in-flight/latency tracking of HTTP requests to a FastAPI app"""
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    registry.service = service
+
+    @app.middleware("http")
+    async def track_requests(request: Request, call_next):
+        if request.url.path == path:
+            return await call_next(request)
+        with registry.in_flight("http_requests"), registry.stage("http_request"):
+            return await call_next(request)
+
+    @app.get(path, include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+class ModelQueue:
+    """Requests of a service sharing one in-process model take turns on it, off the event loop.
+
+    Calls waiting for their turn are reported as queue name.
+    """
+
+    def __init__(self, name: str = "model"):
+        self.name = name
+        self._turn = threading.Lock()
+        self._lock = threading.Lock()
+        self._waiting = 0
+        register_queue(name, self.depth)
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._waiting
+
+    def call(self, func: Callable, *args, **kwargs):
+        """func(*args, **kwargs) once no other call is using the model"""
+        with self._lock:
+            self._waiting += 1
+        try:
+            self._turn.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._turn.release()
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """call() from async code, on the default executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self.call(func, *args, **kwargs))
+
+
+def instrument_model_service(app, service: str, queue: str = "model") -> ModelQueue:
+    """instrument_app() for a service answering from one model; returns the ModelQueue to run inference through"""
+    instrument_app(app, service)
+    return ModelQueue(queue)
@@ -0,0 +1,320 @@
+import logging
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = frozenset(b" \t\n\r")
+_ESCAPES = frozenset(b'"\\/bfnrtu')
+_HEX = frozenset(b"0123456789abcdefABCDEF")
+_INTEGER = re.compile(rb"-?(?:0|[1-9][0-9]*)")
+_NUMBER = re.compile(rb"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+# Everything a number can start with, e.g. "-", "1.", "1.5e"
+_NUMBER_PREFIX = re.compile(rb"-?(?:(?:0|[1-9][0-9]*)(?:\.(?:[0-9]+(?:[eE][+-]?[0-9]*)?)?|[eE][+-]?[0-9]*)?)?")
+_MAX_NUMBER_LENGTH = 16
+
+
+def _types(schema: Dict) -> FrozenSet[str]:
+    """JSON types a schema allows; Gemini-style upper-case names and "nullable" are accepted"""
+    kind = schema.get("type")
+    if kind is None:
+        types = {"object", "array", "string", "integer", "number", "boolean", "null"}
+    elif isinstance(kind, str):
+        types = {kind.lower()}
+    else:
+        types = {k.lower() for k in kind}
+    if schema.get("nullable"):
+        types.add("null")
+    return frozenset(types)
+
+
+class JsonSchemaMatcher:
+    """Byte-by-byte validator of JSON against a schema, for constrained decoding.
+
+    feed() accepts bytes only if they can still be extended to a document
+    matching the schema; done turns True as the top-level value closes. The
+    supported schema subset is what the exam prompts use: object (only the
+    listed properties, each at most once, "required" checked on close), array,
+    string (with "enum"), integer, number, boolean and null; a missing "type"
+    allows any value. Runs of whitespace between tokens are capped so a model
+    can't stall by emitting blanks forever.
+
+    The state is a stack of small lists, so copy() for trying out a candidate
+    token is cheap.
+    """
+
+    def __init__(self, schema: Dict, max_whitespace: int = 16):
+        self.max_whitespace = max_whitespace
+        self.stack: List[list] = [["value", schema]]
+        self.whitespace = 0
+        self.done = False
+
+    def copy(self) -> "JsonSchemaMatcher":
+        clone = JsonSchemaMatcher.__new__(JsonSchemaMatcher)
+        clone.max_whitespace = self.max_whitespace
+        clone.stack = [frame.copy() for frame in self.stack]
+        clone.whitespace = self.whitespace
+        clone.done = self.done
+        return clone
+
+    def feed(self, data: bytes) -> bool:
+        """Consume bytes; False (with the state left undefined) if they break the schema"""
+        for byte in data:
+            if not self._step(byte):
+                return False
+        return True
+
+    def accepts(self, data: bytes) -> bool:
+        """Whether feed(data) would succeed, without changing this matcher"""
+        return self.copy().feed(data)
+
+    def _space(self, byte: int) -> Optional[bool]:
+        """True/False for whitespace (within the limit or not), None for anything else"""
+        if byte not in _WHITESPACE:
+            self.whitespace = 0
+            return None
+        self.whitespace += 1
+        return self.whitespace <= self.max_whitespace
+
+    def _step(self, byte: int) -> bool:
+        if self.done:
+            return False
+        frame = self.stack[-1]
+        kind = frame[0]
+
+        if kind == "string":
+            return self._string(frame, byte)
+
+        if kind == "number":
+            # ["number", integer_only, digits so far]
+            candidate = frame[2] + bytes((byte,))
+            if len(candidate) <= _MAX_NUMBER_LENGTH and _NUMBER_PREFIX.fullmatch(candidate) \
+                    and not (frame[1] and byte in b".eE"):
+                frame[2] = candidate
+                return True
+            # The number ended; the byte belongs to whatever encloses it
+            if not (_INTEGER if frame[1] else _NUMBER).fullmatch(frame[2]):
+                return False
+            self._close()
+            return self._step(byte)
+
+        if kind == "literal":
+            # ["literal", bytes still expected]
+            if byte != frame[1][0]:
+                return False
+            frame[1] = frame[1][1:]
+            if not frame[1]:
+                self._close()
+            return True
+
+        space = self._space(byte)
+        if space is not None:
+            return space
+
+        if kind == "value":
+            return self._value(frame[1], byte)
+        if kind == "object":
+            return self._object(frame, byte)
+        return self._array(frame, byte)
+
+    def _value(self, schema: Dict, byte: int) -> bool:
+        types = _types(schema)
+        if byte == ord("{") and "object" in types:
+            self.stack[-1] = ["object", schema, "start", frozenset()]
+        elif byte == ord("[") and "array" in types:
+            self.stack[-1] = ["array", schema.get("items", {}), "start"]
+        elif byte == ord('"') and "string" in types:
+            enum = schema.get("enum")
+            self.stack[-1] = ["string", tuple(e.encode("utf-8") for e in enum) if enum else None, b"", 0]
+        elif (byte == ord("-") or 48 <= byte <= 57) and types & {"integer", "number"}:
+            self.stack[-1] = ["number", "number" not in types, bytes((byte,))]
+        elif byte == ord("t") and "boolean" in types:
+            self.stack[-1] = ["literal", b"rue"]
+        elif byte == ord("f") and "boolean" in types:
+            self.stack[-1] = ["literal", b"alse"]
+        elif byte == ord("n") and "null" in types:
+            self.stack[-1] = ["literal", b"ull"]
+        else:
+            return False
+        return True
+
+    def _string(self, frame: list, byte: int) -> bool:
+        # ["string", allowed values or None, bytes so far (if allowed), escape state]
+        allowed, escape = frame[1], frame[3]
+        if escape == 1:
+            if byte not in _ESCAPES:
+                return False
+            frame[3] = 2 if byte == ord("u") else 0
+            return True
+        if escape >= 2:
+            # Inside \uXXXX: states 2..5 are the four hex digits
+            if byte not in _HEX:
+                return False
+            frame[3] = 0 if escape == 5 else escape + 1
+            return True
+        if byte == ord('"'):
+            if allowed is not None and frame[2] not in allowed:
+                return False
+            self._close(frame[2])
+            return True
+        if byte < 0x20:
+            return False
+        if byte == ord("\\"):
+            if allowed is not None:
+                # Keys and enum values are plain; no escapes needed
+                return False
+            frame[3] = 1
+            return True
+        if allowed is not None:
+            value = frame[2] + bytes((byte,))
+            if not any(option.startswith(value) for option in allowed):
+                return False
+            frame[2] = value
+        return True
+
+    def _object(self, frame: list, byte: int) -> bool:
+        # ["object", schema, state, keys seen]
+        schema, state, seen = frame[1], frame[2], frame[3]
+        properties = schema.get("properties")
+        if state in ("start", "key") and byte == ord('"'):
+            names = None
+            if properties is not None and not schema.get("additionalProperties"):
+                names = tuple(name.encode("utf-8") for name in properties if name not in seen)
+                if not names:
+                    return False
+            frame[2] = "in_key"
+            self.stack.append(["string", names, b"", 0])
+            return True
+        if state == "colon" and byte == ord(":"):
+            frame[2] = "comma_or_end"
+            key = frame[4]
+            self.stack.append(["value", (properties or {}).get(key, {})])
+            return True
+        if state == "comma_or_end" and byte == ord(","):
+            if properties is not None and not schema.get("additionalProperties") and set(properties) <= seen:
+                return False
+            frame[2] = "key"
+            return True
+        if state in ("start", "comma_or_end") and byte == ord("}"):
+            if not set(schema.get("required", ())) <= seen:
+                return False
+            self._close()
+            return True
+        return False
+
+    def _array(self, frame: list, byte: int) -> bool:
+        # ["array", item schema, state]
+        if frame[2] == "start" and byte == ord("]"):
+            self._close()
+            return True
+        if frame[2] == "start":
+            frame[2] = "comma_or_end"
+            self.stack.append(["value", frame[1]])
+            return self._step(byte)
+        if byte == ord(","):
+            self.stack.append(["value", frame[1]])
+            return True
+        if byte == ord("]"):
+            self._close()
+            return True
+        return False
+
+    def _close(self, value: bytes = b""):
+        """Pop the finished value and tell its parent"""
+        self.stack.pop()
+        self.whitespace = 0
+        if not self.stack:
+            self.done = True
+            return
+        parent = self.stack[-1]
+        if parent[0] == "object" and parent[2] == "in_key":
+            key = value.decode("utf-8", errors="replace")
+            parent[2] = "colon"
+            parent[3] = parent[3] | {key}
+            parent[4:] = [key]
+
+
+def select_tokens(matcher: JsonSchemaMatcher, ranked_ids: Iterable[int], token_bytes: Sequence[Optional[bytes]],
+                  keep: int) -> List[int]:
+    """The first keep token ids, in ranked order, that the matcher accepts next"""
+    allowed = []
+    for token_id in ranked_ids:
+        data = token_bytes[token_id] if token_id < len(token_bytes) else None
+        if data and matcher.accepts(data):
+            allowed.append(token_id)
+            if len(allowed) >= keep:
+                break
+    return allowed
+
+
+def token_byte_table(tokenizer) -> List[Optional[bytes]]:
+    """Raw bytes of every token of a byte-level BPE tokenizer (Qwen, GPT-2); None for special tokens"""
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    decoder = {char: byte for byte, char in bytes_to_unicode().items()}
+    special = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}))
+    table: List[Optional[bytes]] = []
+    for token_id, token in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+        if token_id in special or token is None:
+            table.append(None)
+            continue
+        try:
+            table.append(bytes(decoder[char] for char in token))
+        except KeyError:
+            table.append(None)
+    return table
+
+
+class JsonConstraintLogitsProcessor:
+    """transformers logits processor that only lets generate emit JSON matching schema.
+
+    At each step the tokens are tried in order of score and the first keep that
+    the row's matcher accepts stay available, everything else is masked; with
+    greedy decoding that is exactly the best valid token. Once the top-level
+    value closes, only the end-of-sequence tokens remain, so generation stops
+    there instead of running on into commentary.
+    """
+
+    def __init__(self, schema: Dict, token_bytes: Sequence[Optional[bytes]], eos_token_ids: Iterable[int],
+                 keep: int = 5, max_candidates: int = 4096):
+        self.schema = schema
+        self.token_bytes = token_bytes
+        self.eos_token_ids = sorted(set(eos_token_ids))
+        self.keep = keep
+        self.max_candidates = max_candidates
+        self.matchers: Optional[List[JsonSchemaMatcher]] = None
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        if self.matchers is None:
+            # First step: nothing generated yet
+            self.matchers = [JsonSchemaMatcher(self.schema) for _ in range(input_ids.shape[0])]
+        else:
+            for row, matcher in enumerate(self.matchers):
+                if matcher is None or matcher.done:
+                    continue
+                token_id = int(input_ids[row, -1])
+                data = self.token_bytes[token_id] if token_id < len(self.token_bytes) else None
+                if not data or not matcher.feed(data):
+                    # Only possible if something else changed the chosen token; stop constraining the row
+                    logger.warning(f"Row {row} left the JSON grammar, no longer constrained")
+                    self.matchers[row] = None
+
+        mask = torch.full_like(scores, float("-inf"))
+        for row, matcher in enumerate(self.matchers):
+            if matcher is None:
+                mask[row] = 0
+                continue
+            if matcher.done:
+                mask[row, self.eos_token_ids] = 0
+                continue
+            ranked = torch.argsort(scores[row], descending=True)[:self.max_candidates].tolist()
+            allowed = select_tokens(matcher, ranked, self.token_bytes, self.keep)
+            if not allowed:
+                logger.warning(f"No valid JSON continuation among the top {self.max_candidates} tokens, ending row {row}")
+                allowed = self.eos_token_ids
+            mask[row, allowed] = 0
+        return scores + mask
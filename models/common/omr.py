@@ -0,0 +1,304 @@
+import logging
+import os
+import string
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from models.common.ink import ink_mask
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A bubble counts as marked at this fraction of dark pixels, and as empty below the blank level.
+# Anything in between (ticks, crosses, erased marks) is left for the VLM to read.
+OMR_MARK_THRESHOLD = float(os.getenv("OMR_MARK_THRESHOLD", "0.5"))
+OMR_BLANK_THRESHOLD = float(os.getenv("OMR_BLANK_THRESHOLD", "0.2"))
+# Long edge the photo is reduced to before reading; bubbles stay ~15px across
+OMR_WORKING_SIZE = int(os.getenv("OMR_WORKING_SIZE", "1200"))
+
+# Sheet geometry in pixels of an A4 page at 150 dpi
+PAGE_WIDTH, PAGE_HEIGHT = 1240, 1754
+MARKER_SIZE = 48
+MARKER_INSET = 48
+GRID_TOP, GRID_BOTTOM = 300, 1620
+GRID_LEFT, GRID_RIGHT = 110, 1130
+ROW_HEIGHT = 44
+BUBBLE_SPACING = 44
+BUBBLE_RADIUS = 15
+NUMBER_WIDTH = 60
+COLUMN_GAP = 40
+
+# Fraction of the bubble radius sampled; keeps the printed outline out of the fill ratio
+_SAMPLE_RADIUS = 0.6
+
+
+def has_bubbles(question: Dict) -> bool:
+    """MCQ and true/false questions are answered by filling a bubble"""
+    return str(question.get("type", "")).upper() == "MCQ" and len(question.get("options") or []) >= 2
+
+
+def _marker_centers() -> np.ndarray:
+    near = MARKER_INSET + MARKER_SIZE / 2
+    far_x = PAGE_WIDTH - near
+    far_y = PAGE_HEIGHT - near
+    # top-left, top-right, bottom-right, bottom-left
+    return np.array([[near, near], [far_x, near], [far_x, far_y], [near, far_y]], dtype=np.float64)
+
+
+class SheetLayout:
+    """Where every option bubble of an exam sits on its printed answer sheet.
+
+    Derived only from the exam structure: MCQs get one row of bubbles each, in
+    question order, filling columns top to bottom. Essays get no row.
+    """
+
+    def __init__(self, questions: List[Dict]):
+        self.rows = [(index, len(q["options"])) for index, q in enumerate(questions) if has_bubbles(q)]
+        max_options = max((count for _, count in self.rows), default=0)
+        self.column_width = NUMBER_WIDTH + max_options * BUBBLE_SPACING + COLUMN_GAP
+        self.rows_per_column = (GRID_BOTTOM - GRID_TOP) // ROW_HEIGHT
+        if self.column_width > GRID_RIGHT - GRID_LEFT:
+            raise ValueError(f"{max_options} options per question do not fit on one sheet")
+        columns = (GRID_RIGHT - GRID_LEFT) // self.column_width
+        if len(self.rows) > columns * self.rows_per_column:
+            raise ValueError(f"{len(self.rows)} bubble questions do not fit on one sheet "
+                             f"(at most {columns * self.rows_per_column})")
+
+        centers, question_index, option_index = [], [], []
+        self.row_origins = []
+        for row, (index, count) in enumerate(self.rows):
+            column, position = divmod(row, self.rows_per_column)
+            x0 = GRID_LEFT + column * self.column_width
+            y = GRID_TOP + position * ROW_HEIGHT + ROW_HEIGHT / 2
+            self.row_origins.append((x0, y))
+            for option in range(count):
+                centers.append((x0 + NUMBER_WIDTH + option * BUBBLE_SPACING + BUBBLE_SPACING / 2, y))
+                question_index.append(index)
+                option_index.append(option)
+
+        self.centers = np.array(centers, dtype=np.float64).reshape(-1, 2)
+        self.question_index = np.array(question_index, dtype=np.int64)
+        self.option_index = np.array(option_index, dtype=np.int64)
+
+    def render(self, title: str = "") -> Image.Image:
+        """Printable answer sheet matching this layout"""
+        sheet = Image.new("L", (PAGE_WIDTH, PAGE_HEIGHT), 255)
+        draw = ImageDraw.Draw(sheet)
+        font = _font(22)
+        small = _font(16)
+
+        for x, y in _marker_centers():
+            half = MARKER_SIZE / 2
+            draw.rectangle([x - half, y - half, x + half, y + half], fill=0)
+
+        draw.text((GRID_LEFT, 120), title or "Answer Sheet", fill=0, font=_font(32))
+        draw.text((GRID_LEFT, 190), "Name: ____________________________", fill=0, font=font)
+        draw.text((GRID_LEFT + 560, 190), "ID: __________________", fill=0, font=font)
+        draw.text((GRID_LEFT, 240), "Fill one bubble per question completely with a dark pen.",
+                  fill=0, font=small)
+
+        for (index, count), (x0, y) in zip(self.rows, self.row_origins):
+            draw.text((x0, y - 11), f"{index + 1}.", fill=0, font=font)
+            for option in range(count):
+                cx = x0 + NUMBER_WIDTH + option * BUBBLE_SPACING + BUBBLE_SPACING / 2
+                draw.ellipse([cx - BUBBLE_RADIUS, y - BUBBLE_RADIUS, cx + BUBBLE_RADIUS, y + BUBBLE_RADIUS],
+                             outline=0, width=2)
+                # Letters sit beside the bubble, never inside it, so empty bubbles read as empty
+                draw.text((cx - 4, y - BUBBLE_RADIUS - 17), string.ascii_lowercase[option], fill=0, font=small)
+        return sheet
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _homography(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """3x3 projective transform mapping the source points onto the target points
+    (exactly for 4 points, least squares for more)"""
+    rows = []
+    for (x, y), (u, v) in zip(source, target):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y, u])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y, v])
+    system = np.array(rows, dtype=np.float64)
+    if len(system) == 8:
+        solution = np.linalg.solve(system[:, :8], system[:, 8])
+    else:
+        solution = np.linalg.lstsq(system[:, :8], system[:, 8], rcond=None)[0]
+    return np.append(solution, 1.0).reshape(3, 3)
+
+
+def _project(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Apply a homography to an (..., 2) array of points"""
+    flat = points.reshape(-1, 2)
+    projected = np.hstack([flat, np.ones((len(flat), 1))]) @ matrix.T
+    return (projected[:, :2] / projected[:, 2:3]).reshape(points.shape)
+
+
+class OMRReading:
+    """Answers read from one sheet"""
+
+    def __init__(self, registered: bool, answers: Dict[int, Dict], uncertain: List[int],
+                 fills: Optional[np.ndarray], elapsed_ms: float):
+        self.registered = registered
+        # question index -> {"answer", "selectedOption", "confidence", "source"}
+        self.answers = answers
+        # bubble questions whose marks were unclear
+        self.uncertain = uncertain
+        self.fills = fills
+        self.elapsed_ms = elapsed_ms
+
+
+class OMRReader:
+    """Reads filled bubbles from a photo of a printed answer sheet with NumPy only"""
+
+    def __init__(self, mark_threshold: float = OMR_MARK_THRESHOLD,
+                 blank_threshold: float = OMR_BLANK_THRESHOLD,
+                 working_size: int = OMR_WORKING_SIZE):
+        self.mark_threshold = mark_threshold
+        self.blank_threshold = blank_threshold
+        self.working_size = working_size
+        # Offsets (page pixels) sampled inside each bubble, shared by every bubble
+        steps = np.linspace(-1, 1, 9) * BUBBLE_RADIUS * _SAMPLE_RADIUS
+        grid = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+        self._offsets = grid[np.hypot(grid[:, 0], grid[:, 1]) <= BUBBLE_RADIUS * _SAMPLE_RADIUS]
+
+    def read(self, image: Image.Image, questions: List[Dict]) -> OMRReading:
+        start = time.perf_counter()
+        layout = SheetLayout(questions)
+        if not layout.rows:
+            return OMRReading(False, {}, [], None, 0.0)
+
+        dark = self._dark_mask(image)
+        corners = self._find_markers(dark)
+        if corners is None:
+            elapsed = (time.perf_counter() - start) * 1000
+            logger.info("OMR could not find the sheet's corner markers")
+            return OMRReading(False, {}, [index for index, _ in layout.rows], None, elapsed)
+
+        to_image = _homography(_marker_centers(), corners)
+        # Every sample point of every bubble, projected in one go: (bubbles, samples, 2)
+        points = layout.centers[:, None, :] + self._offsets[None, :, :]
+        projected = np.rint(_project(to_image, points)).astype(np.int64)
+        height, width = dark.shape
+        xs = np.clip(projected[..., 0], 0, width - 1)
+        ys = np.clip(projected[..., 1], 0, height - 1)
+        fills = dark[ys, xs].mean(axis=1)
+
+        answers, uncertain = self._decide(layout, questions, fills)
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"OMR read {len(answers)} of {len(layout.rows)} bubble questions in {elapsed:.0f}ms")
+        return OMRReading(True, answers, uncertain, fills, elapsed)
+
+    def _decide(self, layout: SheetLayout, questions: List[Dict], fills: np.ndarray) -> Tuple[Dict, List]:
+        answers, uncertain = {}, []
+        for index, _ in layout.rows:
+            row = fills[layout.question_index == index]
+            marked = np.flatnonzero(row >= self.mark_threshold)
+            unclear = (row > self.blank_threshold) & (row < self.mark_threshold)
+            if unclear.any() or len(marked) > 1:
+                uncertain.append(index)
+                continue
+            if len(marked) == 0:
+                answers[index] = {"answer": "na", "selectedOption": None,
+                                  "confidence": round(float(1 - row.max() / self.mark_threshold), 3),
+                                  "source": "omr"}
+                continue
+            option = int(marked[0])
+            others = np.delete(row, option)
+            answers[index] = {
+                "answer": questions[index]["options"][option].get("text", "").strip().lower(),
+                "selectedOption": string.ascii_lowercase[option],
+                "confidence": round(float(row[option] - (others.max() if len(others) else 0)), 3),
+                "source": "omr",
+            }
+        return answers, uncertain
+
+    def _dark_mask(self, image: Image.Image) -> np.ndarray:
+        """Ink pixels, judged against the local paper brightness so shadows don't count"""
+        gray = ImageOps.exif_transpose(image).convert("L")
+        scale = self.working_size / max(gray.size)
+        if scale < 1:
+            gray = gray.resize((round(gray.width * scale), round(gray.height * scale)), Image.BILINEAR)
+        return ink_mask(gray, threshold=0.6)
+
+    def _find_markers(self, dark: np.ndarray) -> Optional[np.ndarray]:
+        """Centers of the four solid corner squares, or None if the sheet isn't recognized"""
+        height, width = dark.shape
+        # The page is assumed to fill at least ~40% of the photo's width
+        expected = MARKER_SIZE / PAGE_WIDTH * min(width, height * PAGE_WIDTH / PAGE_HEIGHT)
+        window = max(3, int(expected * 0.35))
+
+        integral = np.zeros((height + 1, width + 1), dtype=np.int64)
+        integral[1:, 1:] = dark.cumsum(axis=0).cumsum(axis=1)
+        sums = (integral[window:, window:] - integral[:-window, window:]
+                - integral[window:, :-window] + integral[:-window, :-window])
+        solid = sums >= 0.95 * window * window
+        # A coarse grid of candidates is enough; markers span several windows
+        step = max(1, window // 3)
+        ys, xs = np.nonzero(solid[::step, ::step])
+        if len(xs) == 0:
+            return None
+        centers_x = xs * step + window // 2
+        centers_y = ys * step + window // 2
+
+        found = []
+        for corner_x, corner_y in ((0, 0), (width, 0), (width, height), (0, height)):
+            # Only look in this corner's quarter of the photo, outermost candidates first
+            in_quarter = (np.abs(centers_x - corner_x) < width / 2) & (np.abs(centers_y - corner_y) < height / 2)
+            distance = np.hypot(centers_x - corner_x, centers_y - corner_y)
+            marker = None
+            for candidate in np.flatnonzero(in_quarter)[np.argsort(distance[in_quarter])]:
+                marker = self._marker_at(dark, int(centers_x[candidate]), int(centers_y[candidate]), expected)
+                if marker is not None:
+                    break
+            if marker is None:
+                return None
+            found.append(marker)
+
+        corners = np.array(found, dtype=np.float64)
+        if not self._plausible(corners):
+            return None
+        return corners
+
+    @staticmethod
+    def _marker_at(dark: np.ndarray, x: int, y: int, expected: float) -> Optional[Tuple[float, float]]:
+        """Center of the solid square through (x, y), or None if the ink there isn't marker-shaped.
+
+        Rejects the dark band a table or shadow leaves along the paper edge, whose
+        runs are far longer in one direction than the other.
+        """
+        def extent(line: np.ndarray, position: int) -> Tuple[int, int]:
+            gaps_before = np.flatnonzero(~line[:position])
+            gaps_after = np.flatnonzero(~line[position:])
+            low = gaps_before[-1] + 1 if len(gaps_before) else 0
+            high = position + gaps_after[0] - 1 if len(gaps_after) else len(line) - 1
+            return low, high
+
+        left, right = extent(dark[y], x)
+        top, bottom = extent(dark[:, x], y)
+        size_x, size_y = right - left + 1, bottom - top + 1
+        if not (0.4 * expected <= min(size_x, size_y) and max(size_x, size_y) <= 2.5 * expected):
+            return None
+        if not 0.6 < size_x / size_y < 1.6:
+            return None
+        return (left + right) / 2, (top + bottom) / 2
+
+    @staticmethod
+    def _plausible(corners: np.ndarray) -> bool:
+        """The four markers must form a convex quadrilateral shaped roughly like the page"""
+        edges = np.roll(corners, -1, axis=0) - corners
+        cross = edges[:, 0] * np.roll(edges, -1, axis=0)[:, 1] - edges[:, 1] * np.roll(edges, -1, axis=0)[:, 0]
+        if not (np.all(cross > 0) or np.all(cross < 0)):
+            return False
+        lengths = np.hypot(edges[:, 0], edges[:, 1])
+        width = (lengths[0] + lengths[2]) / 2
+        height = (lengths[1] + lengths[3]) / 2
+        expected = (PAGE_HEIGHT - 2 * (MARKER_INSET + MARKER_SIZE / 2)) / (PAGE_WIDTH - 2 * (MARKER_INSET + MARKER_SIZE / 2))
+        return width > 0 and 0.7 < (height / width) / expected < 1.4
@@ -0,0 +1,274 @@
+import io
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from models.common.omr import _homography, _project
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (left, top, right, bottom) in template pixels
+Box = Tuple[int, int, int, int]
+
+# Descriptor window (pixels at working size) and the grid it is pooled to
+PATCH_SIZE = 40
+PATCH_GRID = 10
+
+
+def _box_sum(values: np.ndarray, radius: int) -> np.ndarray:
+    """Sum over a (2r+1)^2 window at every pixel, via an integral image"""
+    padded = np.pad(values, radius + 1, mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    return (integral[size:, size:] - integral[:-size, size:]
+            - integral[size:, :-size] + integral[:-size, :-size])[:values.shape[0], :values.shape[1]]
+
+
+def _normalized_homography(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """_homography on coordinates centred and scaled to ~1, which keeps least squares well conditioned"""
+    def conditioner(points):
+        center = points.mean(axis=0)
+        scale = np.sqrt(2) / max(np.sqrt(((points - center) ** 2).sum(axis=1)).mean(), 1e-9)
+        return np.array([[scale, 0, -scale * center[0]], [0, scale, -scale * center[1]], [0, 0, 1]])
+
+    source_t, target_t = conditioner(source), conditioner(target)
+    matrix = _homography(_project(source_t, source), _project(target_t, target))
+    matrix = np.linalg.inv(target_t) @ matrix @ source_t
+    return matrix / matrix[2, 2]
+
+
+class PageTemplate:
+    """Keypoints of a blank (teacher) page and the answer regions to cut from students' copies of it"""
+
+    def __init__(self, size: Tuple[int, int], keypoints: np.ndarray, descriptors: np.ndarray,
+                 regions: Sequence[Box]):
+        self.size = (int(size[0]), int(size[1]))
+        self.keypoints = np.asarray(keypoints, dtype=np.float32)
+        self.descriptors = np.asarray(descriptors, dtype=np.float32)
+        self.regions = [tuple(int(v) for v in box) for box in regions]
+
+    def save(self, path: Union[str, Path]):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, size=np.array(self.size), keypoints=self.keypoints,
+                            descriptors=self.descriptors, regions=np.array(self.regions, dtype=np.int32).reshape(-1, 4))
+        Path(path).write_bytes(buffer.getvalue())
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PageTemplate":
+        with np.load(path) as data:
+            return cls(tuple(data["size"]), data["keypoints"], data["descriptors"], data["regions"].tolist())
+
+    def to_dict(self) -> dict:
+        return {"size": list(self.size), "keypoints": len(self.keypoints), "regions": [list(b) for b in self.regions]}
+
+
+class Registration:
+    """Where a template lies in a photo"""
+
+    def __init__(self, homography: Optional[np.ndarray], matches: int, inliers: int, elapsed_ms: float):
+        # Maps template pixels to photo pixels; None if the photo didn't register
+        self.homography = homography
+        self.matches = matches
+        self.inliers = inliers
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def registered(self) -> bool:
+        return self.homography is not None
+
+
+class PageRegistrar:
+    """Registers photos of a printed page to its template with keypoints and a RANSAC homography.
+
+    Keypoints are Harris corners kept on a grid so they cover the whole page;
+    descriptors are normalized, pooled patches around them. Matching is mutual
+    nearest neighbour with a ratio test, and phone photos framed tighter or
+    looser than the template are tried at a few scales.
+    """
+
+    def __init__(self, working_size: int = 1000, max_keypoints: int = 800, cell: int = 20,
+                 ratio: float = 0.85, ransac_iterations: int = 600, inlier_px: float = 4.0,
+                 min_inliers: int = 15, output_scale: float = 1.3, seed: int = 0):
+        self.working_size = working_size
+        self.max_keypoints = max_keypoints
+        self.cell = cell
+        self.ratio = ratio
+        self.ransac_iterations = ransac_iterations
+        self.inlier_px = inlier_px
+        self.min_inliers = min_inliers
+        self.output_scale = output_scale
+        self.seed = seed
+
+    def _gray(self, image: Image.Image, long_edge: int) -> Tuple[np.ndarray, float]:
+        gray = ImageOps.exif_transpose(image).convert("L")
+        scale = long_edge / max(gray.size)
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.BILINEAR)
+        # Light blur so descriptors tolerate small shifts and JPEG noise
+        gray = gray.filter(ImageFilter.BoxBlur(1))
+        return np.asarray(gray, dtype=np.float32) / 255.0, scale
+
+    def _features(self, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(N, 2) keypoints as x, y and their (N, D) unit-length descriptors"""
+        dy, dx = np.gradient(pixels)
+        xx = _box_sum(dx * dx, 2)
+        yy = _box_sum(dy * dy, 2)
+        xy = _box_sum(dx * dy, 2)
+        response = xx * yy - xy * xy - 0.05 * (xx + yy) ** 2
+
+        height, width = pixels.shape
+        half = PATCH_SIZE // 2
+        # Strongest corner per grid cell, away from the border the patch needs
+        inner = response[half:height - half, half:width - half]
+        rows, cols = inner.shape[0] // self.cell, inner.shape[1] // self.cell
+        if rows == 0 or cols == 0:
+            return np.zeros((0, 2), np.float32), np.zeros((0, PATCH_GRID * PATCH_GRID), np.float32)
+        cells = inner[:rows * self.cell, :cols * self.cell].reshape(rows, self.cell, cols, self.cell)
+        cells = cells.transpose(0, 2, 1, 3).reshape(rows, cols, -1)
+        best = cells.argmax(axis=2)
+        strength = cells.max(axis=2)
+        ys = (np.arange(rows)[:, None] * self.cell + best // self.cell + half).ravel()
+        xs = (np.arange(cols)[None, :] * self.cell + best % self.cell + half).ravel()
+        strength = strength.ravel()
+
+        keep = strength > max(1e-6, np.percentile(strength, 50))
+        order = np.argsort(-strength[keep])[:self.max_keypoints]
+        xs, ys = xs[keep][order], ys[keep][order]
+
+        # Pool each window to a PATCH_GRID x PATCH_GRID grid of mean brightness
+        offsets = np.arange(-half, half)
+        patches = pixels[ys[:, None, None] + offsets[None, :, None], xs[:, None, None] + offsets[None, None, :]]
+        pool = PATCH_SIZE // PATCH_GRID
+        patches = patches.reshape(len(xs), PATCH_GRID, pool, PATCH_GRID, pool).mean(axis=(2, 4))
+        descriptors = patches.reshape(len(xs), -1)
+        descriptors = descriptors - descriptors.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(descriptors, axis=1, keepdims=True)
+        valid = norms[:, 0] > 1e-3
+        descriptors = descriptors[valid] / norms[valid]
+        return np.stack([xs, ys], axis=1)[valid].astype(np.float32), descriptors.astype(np.float32)
+
+    def build(self, page: Image.Image, regions: Sequence[Box]) -> PageTemplate:
+        """Template of a page; regions are boxes in the page's pixels"""
+        pixels, scale = self._gray(page, self.working_size)
+        keypoints, descriptors = self._features(pixels)
+        scaled = [tuple(round(v * scale) for v in box) for box in regions]
+        logger.info(f"Page template with {len(keypoints)} keypoints and {len(scaled)} answer regions")
+        return PageTemplate((pixels.shape[1], pixels.shape[0]), keypoints, descriptors, scaled)
+
+    def _match(self, template: PageTemplate, descriptors: np.ndarray) -> np.ndarray:
+        """(K, 2) index pairs (template, photo) of mutually best, unambiguous matches"""
+        if len(descriptors) < 2 or len(template.descriptors) < 2:
+            return np.zeros((0, 2), dtype=np.int64)
+        similarity = template.descriptors @ descriptors.T
+        distance = np.sqrt(np.maximum(0.0, 2.0 - 2.0 * similarity))
+        nearest = np.argsort(distance, axis=1)[:, :2]
+        rows = np.arange(len(distance))
+        first, second = distance[rows, nearest[:, 0]], distance[rows, nearest[:, 1]]
+        mutual = distance.argmin(axis=0)[nearest[:, 0]] == rows
+        keep = mutual & (first < self.ratio * second)
+        return np.stack([rows[keep], nearest[keep, 0]], axis=1)
+
+    def _ransac(self, source: np.ndarray, target: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        if len(source) < 4:
+            return None, np.zeros(len(source), dtype=bool)
+        rng = np.random.default_rng(self.seed)
+        best_inliers = np.zeros(len(source), dtype=bool)
+        iterations = self.ransac_iterations
+        attempt = 0
+        while attempt < iterations:
+            attempt += 1
+            sample = rng.choice(len(source), 4, replace=False)
+            try:
+                matrix = _normalized_homography(source[sample], target[sample])
+            except np.linalg.LinAlgError:
+                continue
+            errors = np.linalg.norm(_project(matrix, source) - target, axis=1)
+            inliers = errors < self.inlier_px
+            if inliers.sum() > best_inliers.sum():
+                best_inliers = inliers
+                # Enough samples for a 99% chance of one all-inlier draw at this inlier rate
+                rate = inliers.mean()
+                if rate >= 1.0:
+                    break
+                iterations = min(self.ransac_iterations, int(np.log(0.01) / np.log(1 - rate ** 4)) + 1)
+        if best_inliers.sum() < self.min_inliers:
+            return None, best_inliers
+        # Refit on every inlier, then once more on the inliers of the refit
+        matrix = _normalized_homography(source[best_inliers], target[best_inliers])
+        inliers = np.linalg.norm(_project(matrix, source) - target, axis=1) < self.inlier_px
+        if inliers.sum() >= self.min_inliers:
+            matrix = _normalized_homography(source[inliers], target[inliers])
+            best_inliers = inliers
+        return matrix, best_inliers
+
+    def _plausible(self, matrix: np.ndarray, template: PageTemplate, photo_size: Tuple[int, int]) -> bool:
+        """The template's outline lands as a convex, reasonably sized quadrilateral"""
+        width, height = template.size
+        corners = _project(matrix, np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float64))
+        edges = np.roll(corners, -1, axis=0) - corners
+        cross = edges[:, 0] * np.roll(edges, -1, axis=0)[:, 1] - edges[:, 1] * np.roll(edges, -1, axis=0)[:, 0]
+        if not (np.all(cross > 0) or np.all(cross < 0)):
+            return False
+        area = 0.5 * abs(np.dot(corners[:, 0], np.roll(corners[:, 1], -1)) - np.dot(corners[:, 1], np.roll(corners[:, 0], -1)))
+        return 0.15 < area / (photo_size[0] * photo_size[1]) < 4.0
+
+    def register(self, photo: Image.Image, template: PageTemplate) -> Registration:
+        """Locate the template in a photo; the homography maps template pixels to photo pixels"""
+        start = time.perf_counter()
+        photo = ImageOps.exif_transpose(photo)
+        best = (None, 0, 0, 1.0)
+        # The page may fill more or less of the photo than of the template
+        for relative in (1.0, 0.8, 1.25, 0.65):
+            pixels, scale = self._gray(photo, round(self.working_size * relative))
+            keypoints, descriptors = self._features(pixels)
+            pairs = self._match(template, descriptors)
+            matrix, inliers = self._ransac(template.keypoints[pairs[:, 0]].astype(np.float64),
+                                           keypoints[pairs[:, 1]].astype(np.float64))
+            if matrix is not None and not self._plausible(matrix, template, (pixels.shape[1], pixels.shape[0])):
+                matrix = None
+            if matrix is not None and inliers.sum() > best[2]:
+                best = (matrix, len(pairs), int(inliers.sum()), scale)
+            if best[0] is not None and best[2] >= 3 * self.min_inliers:
+                break
+
+        matrix, matches, inliers, scale = best
+        if matrix is not None:
+            # From working-size photo pixels to the photo itself
+            matrix = np.diag([1 / scale, 1 / scale, 1.0]) @ matrix
+            matrix = matrix / matrix[2, 2]
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"Template registration: {inliers} inliers of {matches} matches in {elapsed:.0f}ms"
+                    + ("" if matrix is not None else " (not registered)"))
+        return Registration(matrix, matches, inliers, elapsed)
+
+    def crop_regions(self, photo: Image.Image, template: PageTemplate, registration: Registration) -> List[Image.Image]:
+        """Each answer region of the photo, warped flat at output_scale times the template's size"""
+        photo = ImageOps.exif_transpose(photo)
+        crops = []
+        for left, top, right, bottom in template.regions:
+            size = (max(1, round((right - left) * self.output_scale)), max(1, round((bottom - top) * self.output_scale)))
+            # Output pixel -> template pixel -> photo pixel, the direction PIL's transform wants
+            to_template = np.array([[1 / self.output_scale, 0, left], [0, 1 / self.output_scale, top], [0, 0, 1]])
+            matrix = registration.homography @ to_template
+            matrix = matrix / matrix[2, 2]
+            crops.append(photo.transform(size, Image.PERSPECTIVE, tuple(matrix.ravel()[:8]), Image.BILINEAR,
+                                         fillcolor="white"))
+        return crops
+
+
+def stack_regions(crops: Sequence[Image.Image], gap: int = 12) -> Image.Image:
+    """The regions one below the other on a white strip, in template order"""
+    width = max(crop.width for crop in crops)
+    height = sum(crop.height for crop in crops) + gap * (len(crops) - 1)
+    mode = "RGB" if any(crop.mode == "RGB" for crop in crops) else "L"
+    strip = Image.new(mode, (width, height), "white")
+    y = 0
+    for crop in crops:
+        strip.paste(crop.convert(mode), (0, y))
+        y += crop.height + gap
+    return strip
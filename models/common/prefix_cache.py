@@ -0,0 +1,112 @@
+import copy
+import logging
+import time
+from typing import Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Processor outputs that belong to the image (or video) rather than the text
+VISION_INPUTS = ("pixel_values", "image_grid_thw", "pixel_values_videos", "video_grid_thw", "second_per_grid_ts")
+
+
+class PrefixKVCache:
+    """Key/value cache of a fixed prompt prefix for Qwen2.5-VL, computed once and reused.
+
+    Every request starts with the same long system prompt; its keys and values
+    are computed at startup and each generate call only prefills what follows.
+    Prompts come left-padded from the processor, so in a batch each row's
+    padding is moved behind the prefix ([prefix][padding][rest]) and all rows
+    share the cached prefix at positions 0..P-1. Padding in the middle is
+    masked out like padding at the start.
+
+    Qwen2.5-VL's generate only passes the image to the model on a cold cache,
+    and positions the prompt's tokens (3D rotary positions around the image)
+    from the uncached part alone, so the rest of the prompt is prefilled here
+    with positions from get_rope_index over the whole prompt. generate then
+    continues from the last prompt token.
+    """
+
+    def __init__(self, model, processor, prefix_text: str):
+        import torch
+
+        self._torch = torch
+        self.model = model
+        self.prefix_ids = processor.tokenizer(prefix_text, return_tensors="pt", add_special_tokens=False).input_ids[0]
+        self.length = len(self.prefix_ids)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model(input_ids=self.prefix_ids.unsqueeze(0).to(model.device), use_cache=True)
+        self.cache = output.past_key_values
+        self.prefill_seconds = time.perf_counter() - start
+        logger.info(f"Cached {self.length} prefix tokens in {self.prefill_seconds:.2f}s")
+
+    def arrange(self, input_ids, attention_mask) -> Optional[Tuple]:
+        """(input_ids, attention_mask) with every row as [prefix][padding][rest], or None
+        if some row doesn't start with the prefix after its left padding"""
+        torch = self._torch
+        prefix = self.prefix_ids.to(input_ids.device)
+        rows, masks = [], []
+        for ids, mask in zip(input_ids, attention_mask):
+            padding = int((mask == 0).sum())
+            if mask[:padding].any() or not torch.equal(ids[padding:padding + self.length], prefix):
+                return None
+            rows.append(torch.cat((prefix, ids[:padding], ids[padding + self.length:])))
+            masks.append(torch.cat((mask[padding:padding + self.length], mask[:padding], mask[padding + self.length:])))
+        return torch.stack(rows), torch.stack(masks)
+
+    def _rope_index(self, *args, **kwargs):
+        # On the outer model up to transformers 4.51, on the inner one since
+        get_rope_index = getattr(self.model, "get_rope_index", None) or self.model.model.get_rope_index
+        return get_rope_index(*args, **kwargs)
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        """Drop-in for model.generate(**inputs, **generate_kwargs) that skips the prefix.
+
+        The returned sequences hold the rearranged prompt, of the same length as
+        the original, followed by the generated tokens.
+        """
+        torch = self._torch
+        vision = {name: kwargs.pop(name) for name in VISION_INPUTS if name in kwargs}
+        arranged = self.arrange(input_ids, attention_mask)
+        if arranged is None:
+            logger.warning("Prompt doesn't start with the cached prefix, generating without it")
+            return self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **vision, **kwargs)
+        input_ids, attention_mask = arranged
+        batch, length = input_ids.shape
+
+        cache = copy.deepcopy(self.cache)
+        if batch > 1:
+            cache.batch_repeat_interleave(batch)
+        position_ids, rope_deltas = self._rope_index(
+            input_ids,
+            image_grid_thw=vision.get("image_grid_thw"),
+            video_grid_thw=vision.get("video_grid_thw"),
+            attention_mask=attention_mask
+        )
+
+        # Everything after the prefix except the last token, which generate needs to start from
+        end = length - 1
+        with torch.no_grad():
+            self.model(
+                input_ids=input_ids[:, self.length:end],
+                attention_mask=attention_mask[:, :end],
+                position_ids=position_ids[:, :, self.length:end],
+                past_key_values=cache,
+                cache_position=torch.arange(self.length, end, device=input_ids.device),
+                use_cache=True,
+                **vision
+            )
+        # Decode steps are positioned by rope_deltas, which the model only sets itself on a cold start
+        for owner in (self.model, getattr(self.model, "model", None)):
+            if owner is not None and hasattr(owner, "rope_deltas"):
+                owner.rope_deltas = rope_deltas
+
+        return self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            **kwargs
+        )
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tokens held back waiting for the rest of a multi-byte character before flushing anyway
+_MAX_PENDING = 8
+
+
+class RowStreamer:
+    """transformers streamer for a batched generate that hands every row's new text
+    to that row's listener as it is generated.
+
+    TextIteratorStreamer only handles a batch of one; here each request in a
+    batch gets its own callback (None for rows nobody is watching). Listeners
+    are called on the generating thread with text pieces that concatenate to
+    the row's decoded answer. A piece is held back while it ends in half a
+    UTF-8 character.
+    """
+
+    def __init__(self, tokenizer, listeners: Sequence[Optional[Callable[[str], None]]]):
+        self.tokenizer = tokenizer
+        self.listeners = list(listeners)
+        self._pending: List[List[int]] = [[] for _ in self.listeners]
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            # generate passes the prompt first
+            self._prompt_seen = True
+            return
+        for row, token_ids in enumerate(value.tolist()):
+            if self.listeners[row] is None:
+                continue
+            self._pending[row].extend(token_ids if isinstance(token_ids, list) else [token_ids])
+            self._flush(row)
+
+    def end(self):
+        for row, listener in enumerate(self.listeners):
+            if listener is not None:
+                self._flush(row, final=True)
+
+    def _flush(self, row: int, final: bool = False):
+        pending = self._pending[row]
+        text = self.tokenizer.decode(pending, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+        if text.endswith("\ufffd") and not final and len(pending) < _MAX_PENDING:
+            return
+        self._pending[row] = []
+        if text:
+            try:
+                self.listeners[row](text)
+            except Exception as e:
+                # A listener that went away mustn't fail the other rows' generation
+                logger.warning(f"Dropping stream listener for row {row}: {str(e)}")
+                self.listeners[row] = None
+
+
+# Marks where a retried request's text starts over
+_RESTART = object()
+
+
+class StreamRelay:
+    """Listener that carries one request's text from the inference thread to the event loop.
+
+    Create it on the event loop and pass it as the request's listener. The batch
+    function calls restart() before each attempt at the request: when a whole
+    batch fails and its requests are retried one at a time, the consumer gets a
+    reset instead of the failed attempt's text followed by the retry's. close()
+    ends the stream once the request's future is done.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._pieces: asyncio.Queue = asyncio.Queue()
+        self._sent = False
+
+    def __call__(self, text: str):
+        self._sent = True
+        self._post(text)
+
+    def restart(self):
+        if self._sent:
+            self._sent = False
+            self._post(_RESTART)
+
+    def close(self):
+        self._post(None)
+
+    async def events(self) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        """("token", text) for each piece, ("reset", None) when the text starts over"""
+        while True:
+            piece = await self._pieces.get()
+            if piece is None:
+                return
+            yield ("reset", None) if piece is _RESTART else ("token", piece)
+
+    def _post(self, piece):
+        # In order with everything posted before, from any thread
+        self._loop.call_soon_threadsafe(self._pieces.put_nowait, piece)
@@ -0,0 +1,96 @@
+import io
+import math
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from models.common.ink import ink_mask, ink_runs
+
+# Qwen2.5-VL merges 2x2 patches of 14 px, so one vision token covers 28 x 28 pixels
+QWEN_PATCH = 28
+# Gemini charges a flat 258 tokens per image tile
+GEMINI_TILE_TOKENS = 258
+
+
+def gemini_image_tokens(size: Tuple[int, int]) -> int:
+    """Tokens Gemini bills for an image: one tile up to 384 px, else tiles of about 2/3 the short side"""
+    width, height = size
+    if width <= 384 and height <= 384:
+        return GEMINI_TILE_TOKENS
+    unit = min(max(min(width, height) / 1.5, 256), 768)
+    return GEMINI_TILE_TOKENS * math.ceil(width / unit) * math.ceil(height / unit)
+
+
+def qwen_resize(size: Tuple[int, int], min_pixels: int, max_pixels: int) -> Tuple[int, int]:
+    """Size Qwen2.5-VL's processor resizes an image to (its smart_resize)"""
+    width, height = size
+    resized_h = max(QWEN_PATCH, round(height / QWEN_PATCH) * QWEN_PATCH)
+    resized_w = max(QWEN_PATCH, round(width / QWEN_PATCH) * QWEN_PATCH)
+    if resized_h * resized_w > max_pixels:
+        beta = math.sqrt(height * width / max_pixels)
+        resized_h = max(QWEN_PATCH, math.floor(height / beta / QWEN_PATCH) * QWEN_PATCH)
+        resized_w = max(QWEN_PATCH, math.floor(width / beta / QWEN_PATCH) * QWEN_PATCH)
+    elif resized_h * resized_w < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        resized_h = math.ceil(height * beta / QWEN_PATCH) * QWEN_PATCH
+        resized_w = math.ceil(width * beta / QWEN_PATCH) * QWEN_PATCH
+    return resized_w, resized_h
+
+
+def qwen_image_tokens(size: Tuple[int, int], min_pixels: int, max_pixels: int) -> int:
+    width, height = qwen_resize(size, min_pixels, max_pixels)
+    return (width // QWEN_PATCH) * (height // QWEN_PATCH)
+
+
+def payload_size(part) -> Optional[Tuple[int, int]]:
+    """Pixel size of an image content part (PIL image, {"mime_type", "data"} blob or bytes); None for text"""
+    if isinstance(part, Image.Image):
+        return part.size
+    if isinstance(part, dict):
+        part = part.get("data")
+    if isinstance(part, (bytes, bytearray)):
+        # Only the header is parsed
+        with Image.open(io.BytesIO(part)) as image:
+            return image.size
+    return None
+
+
+def estimate_text_height(image: Image.Image, strips: int = 4, working_width: int = 1200) -> Optional[float]:
+    """Median height in pixels of the page's text lines, or None if no text was found.
+
+    Measured on the row profile of a few vertical strips, so slightly skewed pages
+    and two-column layouts still show separate lines.
+    """
+    gray = image.convert("L")
+    scale = min(1.0, working_width / gray.width)
+    if scale < 1:
+        gray = gray.resize((round(gray.width * scale), round(gray.height * scale)), Image.BILINEAR)
+    ink = ink_mask(gray)
+
+    heights = []
+    for strip in np.array_split(ink, strips, axis=1):
+        profile = strip.mean(axis=1)
+        runs = ink_runs(profile > max(0.01, profile.max() * 0.05))
+        # Drop rules and specks: anything under 3 px or taller than a paragraph
+        heights.extend(end - start for start, end in runs if 3 <= end - start <= ink.shape[0] * 0.08)
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights)) / scale
+
+
+def choose_long_edge(long_edge: int, text_height: Optional[float], min_text_height: float,
+                     candidates: Iterable[int]) -> int:
+    """Smallest candidate long edge at which text lines stay at least min_text_height px tall.
+
+    long_edge is the image's current long edge, at which text_height was measured.
+    Falls back to the largest candidate when the text can't be measured or is
+    too small even there.
+    """
+    ladder = sorted(set(candidates))
+    if text_height is None or text_height <= 0:
+        return ladder[-1]
+    for candidate in ladder:
+        if text_height * min(1.0, candidate / long_edge) >= min_text_height:
+            return candidate
+    return ladder[-1]
@@ -2,6 +2,13 @@ from llama_index.core import Settings, StorageContext, load_index_from_storage
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from sentence_transformers import SentenceTransformer, util
 import google.generativeai as genai
+import sys
+from pathlib import Path
+
+# Add project root to Python path
+project_root = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.gemini_scheduler import BULK, get_scheduler
 
 
 # ===== 1. Configure Embeddings =====
@@ -25,7 +32,10 @@ def retrieve_context(query):
 
 def generate_answer_with_gemini(query, context_nodes):
     context_text = "\n".join([n.text for n in context_nodes])
-    response = gemini_model.generate_content(f"Question: {query}\nContext: {context_text}\nAnswer:")
+    # Shares the process-wide Gemini rate limits; RAG answers are background grading work
+    response = get_scheduler().generate_content(
+        gemini_model, f"Question: {query}\nContext: {context_text}\nAnswer:", priority=BULK
+    )
     return response.text
 
 def compute_similarity(student_answer, doctor_answer, rag_answer):
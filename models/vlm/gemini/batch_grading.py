@@ -0,0 +1,139 @@
+import logging
+import re
+import string
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Codes in the selection matrix besides option indices
+MISSING = -1       # not answered ("na" or no entry)
+UNRECOGNIZED = -2  # answered, but not with any of the question's options
+
+_LETTER = re.compile(r"^\(?([a-z])[\).]?$")
+
+
+def _normalize_text(text) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower()).strip()
+
+
+class ClassGrades:
+    """Result of grading a whole class against one answer key; rows are students"""
+
+    def __init__(self, correct: np.ndarray, missing: np.ndarray, points: np.ndarray,
+                 gradable: np.ndarray, max_points: float):
+        self.correct = correct
+        self.missing = missing
+        self.points = points
+        self.gradable = gradable
+        self.totals = points.sum(axis=1)
+        self.max_points = max_points
+
+    def to_dict(self, student_ids: Optional[Sequence] = None) -> Dict:
+        students = len(self.totals)
+        ids = list(student_ids) if student_ids is not None else list(range(students))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correct_rate = self.correct.sum(axis=0) / students if students else np.zeros(self.correct.shape[1])
+            missing_rate = self.missing.sum(axis=0) / students if students else np.zeros(self.missing.shape[1])
+        return {
+            "maxPoints": self.max_points,
+            "students": [
+                {
+                    "studentId": ids[row],
+                    "total": float(self.totals[row]),
+                    "correct": self.correct[row].tolist(),
+                    "missing": self.missing[row].tolist(),
+                }
+                for row in range(students)
+            ],
+            "questions": [
+                {
+                    "question_number": column + 1,
+                    "autoGraded": bool(self.gradable[column]),
+                    "correctRate": float(correct_rate[column]),
+                    "missingRate": float(missing_rate[column]),
+                }
+                for column in range(self.correct.shape[1])
+            ],
+        }
+
+
+class AnswerKey:
+    """An exam's answer key compiled once into option indices, for grading many sheets at once.
+
+    Only questions with options are auto-graded; essays show up as not gradable
+    (their missing mask is still filled in).
+    """
+
+    def __init__(self, exam_structure: Dict):
+        questions = exam_structure.get("questions", [])
+        self.size = len(questions)
+        max_options = max((len(q.get("options") or []) for q in questions), default=0)
+
+        self.correct_options = np.zeros((self.size, max(max_options, 1)), dtype=bool)
+        self.points = np.zeros(self.size, dtype=np.float64)
+        self.gradable = np.zeros(self.size, dtype=bool)
+        # Per question: normalized option text -> option index
+        self._lookup: List[Dict[str, int]] = []
+
+        for index, question in enumerate(questions):
+            options = question.get("options") or []
+            self.points[index] = float(question.get("points", 1) or 0)
+            self.gradable[index] = bool(options) and any(o.get("isCorrect") for o in options)
+            for position, option in enumerate(options):
+                self.correct_options[index, position] = bool(option.get("isCorrect"))
+            self._lookup.append({_normalize_text(o.get("text", "")): position for position, o in enumerate(options)})
+
+    def encode_answer(self, index: int, answer: Union[Dict, str, None]) -> int:
+        """Option index a student chose for question index, or MISSING / UNRECOGNIZED"""
+        letter = None
+        if isinstance(answer, dict):
+            letter = answer.get("selectedOption")
+            answer = answer.get("answer")
+        if letter:
+            position = string.ascii_lowercase.find(str(letter).lower())
+            if 0 <= position < len(self._lookup[index]):
+                return position
+
+        text = _normalize_text(answer) if answer is not None else ""
+        if not text or text in ("na", "n a", "none"):
+            return MISSING
+        position = self._lookup[index].get(text)
+        if position is not None:
+            return position
+        match = _LETTER.match(str(answer).strip().lower())
+        if match:
+            position = ord(match.group(1)) - ord("a")
+            if position < len(self._lookup[index]):
+                return position
+        return UNRECOGNIZED
+
+    def encode(self, students: Sequence[Union[Dict, List]]) -> np.ndarray:
+        """Students x questions matrix of chosen option indices.
+
+        Each student is a process_student_answers result ({"answers": [...]}) or
+        the answers list itself. Missing trailing answers count as not answered.
+        Keep the matrix to regrade after a key correction without re-reading sheets.
+        """
+        selected = np.full((len(students), self.size), MISSING, dtype=np.int16)
+        overlong = 0
+        for row, student in enumerate(students):
+            answers = student.get("answers", []) if isinstance(student, dict) else student
+            overlong += len(answers) > self.size
+            for index, answer in enumerate(answers[:self.size]):
+                selected[row, index] = self.encode_answer(index, answer)
+        if overlong:
+            logger.warning(f"{overlong} sheet(s) had more answers than the {self.size} questions; extra ignored")
+        return selected
+
+    def grade(self, selected: np.ndarray) -> ClassGrades:
+        """Grade an encoded class in one pass"""
+        columns = np.arange(self.size)[None, :]
+        chosen = self.correct_options[columns, np.clip(selected, 0, None)]
+        correct = chosen & (selected >= 0) & self.gradable[None, :]
+        missing = selected == MISSING
+        points = np.where(correct, self.points[None, :], 0.0)
+        return ClassGrades(correct, missing, points, self.gradable, float(self.points[self.gradable].sum()))
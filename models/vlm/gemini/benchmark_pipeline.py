@@ -0,0 +1,365 @@
+"""Benchmark the extraction pipeline over the bundled exams/ corpus with any generation backend.
+
+Every sub-directory of exams/ is one exam and its images are the pages, in name
+order. Each page goes through process_teacher_exam (latency, bytes and tokens
+are recorded per image), the pages are merged, and the exam is scored against
+its golden file if it has one:
+
+    golden.json        an extraction in ExamProcessor's format ({"questions": [...]})
+    exam_results.json  per-section answer lists ({"questions": [{"correct_answer": ["T", "C", ...]}]})
+
+A directory given with --students holds answer sheets <name>.jpg/.png, each
+with a golden <name>.json ({"answers": [...]}), and the exam's structure.json;
+those are run through process_student_answers.
+
+The JSON report has stable keys and ordering so two of them can be diffed
+between commits; --baseline prints the summary changes directly.
+
+Usage (from the project root):
+    python models/vlm/gemini/benchmark_pipeline.py --backend replay --replay-dir replays --output report.json
+    python models/vlm/gemini/benchmark_pipeline.py --backend gemini --record replays   # record for later replay
+    python models/vlm/gemini/benchmark_pipeline.py --backend replay --baseline old-report.json
+"""
+import argparse
+import json
+import os
+import re
+import string
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.gemini_scheduler import GeminiScheduler
+from models.common.generation_backends import (
+    GenerationBackend,
+    RecordingBackend,
+    ReplayBackend,
+    create_backend,
+)
+from models.vlm.gemini.benchmark_preprocessing import IMAGE_SUFFIXES
+
+GOLDEN_FILES = ("golden.json", "exam_results.json")
+
+
+class MeteredBackend(GenerationBackend):
+    """Counts calls, image bytes and tokens going through another backend"""
+
+    def __init__(self, inner: GenerationBackend):
+        self.inner = inner
+        self.name = inner.name
+        self.scheduled = inner.scheduled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.bytes_sent = 0
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self.vision_tokens = 0
+
+    def generate_content(self, contents: List, stream: bool = False, schema: Optional[Dict] = None):
+        response = self.inner.generate_content(contents, stream=stream, schema=schema)
+        sent = sum(len(part["data"]) if isinstance(part, dict) else len(part)
+                   for part in contents if isinstance(part, (bytes, dict)))
+        # Real usage when the backend reports it (Gemini), else the scheduler's estimate
+        try:
+            usage = response.usage_metadata
+            input_tokens, output_tokens = usage.prompt_token_count, usage.candidates_token_count
+        except Exception:
+            input_tokens = GeminiScheduler.estimate_tokens(contents)
+            output_tokens = len(response.text) // 4 if not stream else 0
+        vision_tokens = self.inner.vision_tokens(contents)
+        with self._lock:
+            self.calls += 1
+            self.bytes_sent += sent
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+            self.vision_tokens += vision_tokens
+        return response
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"calls": self.calls, "bytesSent": self.bytes_sent,
+                    "inputTokens": self.input_tokens, "outputTokens": self.output_tokens,
+                    "visionTokens": self.vision_tokens}
+
+    def signature(self) -> str:
+        return self.inner.signature()
+
+    def image_tokens(self, size) -> int:
+        return self.inner.image_tokens(size)
+
+
+def find_exams(exams_dir: Path) -> Dict[str, List[Path]]:
+    """Exam name -> page images"""
+    exams = {}
+    for directory in sorted(p for p in exams_dir.iterdir() if p.is_dir()):
+        pages = sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        if pages:
+            exams[directory.name] = pages
+    return exams
+
+
+def _option_token(question: Dict) -> Optional[str]:
+    """The correct answer of an extracted question as "t"/"f" or an option letter"""
+    options = question.get("options") or []
+    for index, option in enumerate(options):
+        if option.get("isCorrect"):
+            text = str(option.get("text", "")).strip().lower()
+            if text in ("true", "t", "false", "f"):
+                return text[0]
+            return string.ascii_lowercase[index] if index < 26 else None
+    return None
+
+
+def load_golden(directory: Path) -> Optional[Dict]:
+    """{"questions": count, "answers": [token or None per question]} from the exam's golden file"""
+    for name in GOLDEN_FILES:
+        path = directory / name
+        if not path.exists():
+            continue
+        data = json.loads(path.read_text(encoding="utf-8"))
+        questions = data.get("exam", data).get("questions", [])
+        if questions and "correct_answer" in questions[0]:
+            answers = [str(a).strip().lower() or None for q in questions for a in q.get("correct_answer", [])]
+            return {"source": name, "questions": len(answers), "answers": answers}
+        return {"source": name, "questions": len(questions), "answers": [_option_token(q) for q in questions]}
+    return None
+
+
+def score_exam(extracted: Dict, golden: Dict) -> Dict:
+    """Question-count and answer agreement of an extraction with its golden file, by position"""
+    predicted = [_option_token(q) for q in extracted.get("questions", [])]
+    expected = golden["answers"]
+    keyed = [(index, answer) for index, answer in enumerate(expected) if answer is not None]
+    matches = sum(1 for index, answer in keyed if index < len(predicted) and predicted[index] == answer)
+    return {
+        "golden": golden["source"],
+        "expectedQuestions": golden["questions"],
+        "extractedQuestions": len(predicted),
+        "questionCountMatch": golden["questions"] == len(predicted),
+        "questionCountError": len(predicted) - golden["questions"],
+        "answerAgreement": round(matches / len(keyed), 4) if keyed else None,
+    }
+
+
+def score_answers(extracted: List[Dict], golden: List) -> Dict:
+    """Share of a student sheet's golden answers read identically"""
+    def normalize(answer):
+        if isinstance(answer, dict):
+            answer = answer.get("answer", "na")
+        return re.sub(r"\s+", " ", str(answer).strip().lower())
+
+    matches = sum(1 for index, answer in enumerate(golden)
+                  if index < len(extracted) and normalize(extracted[index]) == normalize(answer))
+    return {
+        "expectedAnswers": len(golden),
+        "extractedAnswers": len(extracted),
+        "answerAgreement": round(matches / len(golden), 4) if golden else None,
+    }
+
+
+def _relative(path: Path) -> str:
+    try:
+        return str(path.resolve().relative_to(project_root.resolve()))
+    except ValueError:
+        return str(path)
+
+
+def _timed(backend: MeteredBackend, path: Path, call) -> Tuple[Dict, Dict]:
+    backend.reset()
+    start = time.perf_counter()
+    error = None
+    try:
+        result = call()
+    except Exception as e:
+        result, error = {}, str(e)
+    row = {
+        "image": _relative(path),
+        "fileBytes": path.stat().st_size,
+        "latencyS": round(time.perf_counter() - start, 3),
+        **backend.snapshot(),
+    }
+    if error:
+        row["error"] = error
+    return result, row
+
+
+def benchmark_exam(processor, backend: MeteredBackend, name: str, pages: List[Path]) -> Tuple[Dict, List[Dict]]:
+    results, rows = [], []
+    for page in pages:
+        result, row = _timed(backend, page, lambda: processor.process_teacher_exam(page, use_cache=False))
+        row["exam"] = name
+        row["questions"] = len(result.get("questions", []))
+        results.append(result)
+        rows.append(row)
+        print(f"📷 {row['image']}: {row['latencyS']} s, {row['bytesSent'] / 1024:.0f} KB sent, "
+              f"{row['inputTokens']}+{row['outputTokens']} tokens, {row['questions']} questions"
+              + (f" ❌ {row['error']}" if "error" in row else ""))
+
+    merged = processor.merge_exam_pages(results)
+    exam = {"exam": name, "pages": len(pages), "questions": len(merged["questions"])}
+    golden = load_golden(pages[0].parent)
+    if golden is not None:
+        exam["score"] = score_exam(merged, golden)
+    return exam, rows
+
+
+def benchmark_students(processor, backend: MeteredBackend, directory: Path) -> List[Dict]:
+    structure = json.loads((directory / "structure.json").read_text(encoding="utf-8"))
+    rows = []
+    for sheet in sorted(p for p in directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES):
+        result, row = _timed(backend, sheet, lambda: processor.process_student_answers(sheet, structure))
+        golden_path = sheet.with_suffix(".json")
+        if golden_path.exists():
+            golden = json.loads(golden_path.read_text(encoding="utf-8"))
+            row["score"] = score_answers(result.get("answers", []), golden.get("answers", []))
+        rows.append(row)
+        print(f"📝 {row['image']}: {row['latencyS']} s, {row['calls']} model call(s)"
+              + (f", agreement {row['score']['answerAgreement']}" if "score" in row else ""))
+    return rows
+
+
+def _mean(values) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def summarize(exams: List[Dict], images: List[Dict], students: List[Dict], wall_s: float) -> Dict:
+    latencies = [r["latencyS"] for r in images + students]
+    scored = [e["score"] for e in exams if "score" in e]
+    return {
+        "exams": len(exams),
+        "images": len(images),
+        "studentSheets": len(students),
+        "errors": sum("error" in r for r in images + students),
+        "wallS": round(wall_s, 3),
+        "imagesPerMinute": round(60 * len(latencies) / wall_s, 2) if wall_s else None,
+        "p50LatencyS": _percentile(latencies, 0.5),
+        "p95LatencyS": _percentile(latencies, 0.95),
+        "modelCalls": sum(r["calls"] for r in images + students),
+        "bytesSent": sum(r["bytesSent"] for r in images + students),
+        "inputTokens": sum(r["inputTokens"] for r in images + students),
+        "outputTokens": sum(r["outputTokens"] for r in images + students),
+        "visionTokens": sum(r["visionTokens"] for r in images + students),
+        "scoredExams": len(scored),
+        "questionCountMatches": sum(s["questionCountMatch"] for s in scored),
+        "meanAbsQuestionCountError": _mean([abs(s["questionCountError"]) for s in scored]),
+        "meanAnswerAgreement": _mean([s["answerAgreement"] for s in scored]),
+        "meanStudentAgreement": _mean([r["score"]["answerAgreement"] for r in students if "score" in r]),
+    }
+
+
+def compare(summary: Dict, baseline: Dict) -> List[str]:
+    lines = []
+    for key, value in summary.items():
+        old = baseline.get(key)
+        if old != value:
+            change = ""
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                change = f" ({value - old:+.4g})"
+            lines.append(f"{key}: {old} -> {value}{change}")
+    return lines
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=Path, default=project_root / "exams")
+    parser.add_argument("--exam", action="append", help="only these exam directories (repeatable)")
+    parser.add_argument("--students", type=Path, help="directory of student sheets with golden answers")
+    parser.add_argument("--backend", choices=("gemini", "qwen", "replay"), default=None,
+                        help="defaults to VLM_BACKEND")
+    parser.add_argument("--replay-dir", type=Path, help="recordings for the replay backend")
+    parser.add_argument("--latency", help="synthetic latency for the replay backend, e.g. lognormal:0.5,0.3")
+    parser.add_argument("--record", type=Path, help="save the backend's responses here for later replay")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="earlier report to compare the summary with")
+    args = parser.parse_args()
+
+    # Every page must reach the model; cached extractions would only measure the disk
+    os.environ["VLM_CACHE_DISABLED"] = "1"
+    from models.vlm.gemini.exam_processor import ExamProcessor
+
+    if args.backend == "replay" or (args.backend is None and (args.replay_dir or args.latency)):
+        replay_kwargs = {}
+        if args.replay_dir:
+            replay_kwargs["directory"] = args.replay_dir
+        if args.latency:
+            replay_kwargs["latency"] = args.latency
+        inner = ReplayBackend(**replay_kwargs)
+    else:
+        inner = create_backend(args.backend)
+    if args.record:
+        inner = RecordingBackend(inner, args.record)
+    backend = MeteredBackend(inner)
+    processor = ExamProcessor(backend=backend)
+
+    exams = find_exams(args.exams_dir)
+    if args.exam:
+        exams = {name: pages for name, pages in exams.items() if name in args.exam}
+
+    start = time.perf_counter()
+    exam_rows, image_rows = [], []
+    for name, pages in exams.items():
+        exam, rows = benchmark_exam(processor, backend, name, pages)
+        exam_rows.append(exam)
+        image_rows.extend(rows)
+    student_rows = benchmark_students(processor, backend, args.students) if args.students else []
+    wall_s = time.perf_counter() - start
+
+    if not image_rows and not student_rows:
+        print(f"No images found in {args.exams_dir}")
+        return
+
+    summary = summarize(exam_rows, image_rows, student_rows, wall_s)
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "backend": backend.name,
+            "model": backend.signature(),
+            "preprocessing": processor.preprocessor.signature(),
+            "structuredOutput": processor.structured,
+        },
+        "summary": summary,
+        "exams": exam_rows,
+        "images": image_rows,
+        "students": student_rows,
+    }
+
+    print("\n📊 Summary")
+    print(json.dumps(summary, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("summary", {})
+        changes = compare(summary, baseline)
+        print(f"\n🔁 Against {args.baseline}:")
+        print("\n".join(changes) if changes else "no changes")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
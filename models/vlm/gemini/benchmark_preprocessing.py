@@ -0,0 +1,135 @@
+"""Compare raw and preprocessed exam photos: bytes sent, latency and extraction agreement.
+
+Usage (from the project root):
+    python models/vlm/gemini/benchmark_preprocessing.py            # bytes + preprocessing time only
+    python models/vlm/gemini/benchmark_preprocessing.py --extract  # also run Gemini on both variants
+"""
+import argparse
+import json
+import sys
+import time
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.vlm.gemini.image_preprocessing import ImagePreprocessor
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+
+
+def find_images(exams_dir: Path) -> List[Path]:
+    return sorted(p for p in exams_dir.rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def agreement(raw: Dict, processed: Dict) -> Dict:
+    """How closely the extraction from the preprocessed image matches the raw one"""
+    raw_questions = raw.get("questions", [])
+    processed_questions = processed.get("questions", [])
+    pairs = list(zip(raw_questions, processed_questions))
+
+    text_similarity = [
+        SequenceMatcher(None, a.get("text", "").lower(), b.get("text", "").lower()).ratio()
+        for a, b in pairs
+    ]
+    answers_match = [
+        [o.get("isCorrect") for o in a.get("options", [])] == [o.get("isCorrect") for o in b.get("options", [])]
+        for a, b in pairs
+    ]
+    return {
+        "rawQuestions": len(raw_questions),
+        "processedQuestions": len(processed_questions),
+        "questionCountMatch": len(raw_questions) == len(processed_questions),
+        "meanTextSimilarity": sum(text_similarity) / len(text_similarity) if text_similarity else None,
+        "answerAgreement": sum(answers_match) / len(answers_match) if answers_match else None,
+    }
+
+
+def benchmark_image(path: Path, preprocessor: ImagePreprocessor, processors=None) -> Dict:
+    raw_bytes = path.stat().st_size
+
+    start = time.perf_counter()
+    payload = preprocessor.prepare(Image.open(path))
+    preprocess_ms = (time.perf_counter() - start) * 1000
+    # prepare() hands back the original image when it could not make it smaller
+    sent_bytes = len(payload["data"]) if isinstance(payload, dict) else raw_bytes
+
+    row = {
+        "image": str(path.relative_to(project_root)),
+        "rawBytes": raw_bytes,
+        "processedBytes": sent_bytes,
+        "reduction": 1 - sent_bytes / raw_bytes,
+        "preprocessMs": round(preprocess_ms, 1),
+    }
+
+    if processors:
+        raw_processor, processed_processor = processors
+        results = {}
+        for name, processor in (("raw", raw_processor), ("processed", processed_processor)):
+            start = time.perf_counter()
+            results[name] = processor.process_teacher_exam(str(path), use_cache=False)
+            row[f"{name}LatencyS"] = round(time.perf_counter() - start, 2)
+        row["agreement"] = agreement(results["raw"], results["processed"])
+
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=Path, default=project_root / "exams")
+    parser.add_argument("--extract", action="store_true", help="run Gemini on raw and preprocessed images")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args()
+
+    preprocessor = ImagePreprocessor(enabled=True)
+    processors = None
+    if args.extract:
+        from models.vlm.gemini.exam_processor import ExamProcessor
+        processors = (
+            ExamProcessor(preprocessor=ImagePreprocessor(enabled=False)),
+            ExamProcessor(preprocessor=preprocessor),
+        )
+
+    rows = []
+    for path in find_images(args.exams_dir):
+        row = benchmark_image(path, preprocessor, processors)
+        rows.append(row)
+        print(f"📷 {row['image']}: {row['rawBytes'] / 1024:.0f} KB -> {row['processedBytes'] / 1024:.0f} KB "
+              f"({row['reduction']:.0%} smaller) in {row['preprocessMs']} ms")
+        if "agreement" in row:
+            print(f"   ⏱️  raw {row['rawLatencyS']} s, processed {row['processedLatencyS']} s, "
+                  f"agreement {json.dumps(row['agreement'])}")
+
+    if not rows:
+        print(f"No images found in {args.exams_dir}")
+        return
+
+    raw_total = sum(r["rawBytes"] for r in rows)
+    processed_total = sum(r["processedBytes"] for r in rows)
+    summary = {
+        "images": len(rows),
+        "settings": preprocessor.signature(),
+        "rawBytes": raw_total,
+        "processedBytes": processed_total,
+        "reduction": 1 - processed_total / raw_total,
+        "meanPreprocessMs": round(sum(r["preprocessMs"] for r in rows) / len(rows), 1),
+    }
+    if args.extract:
+        summary["meanRawLatencyS"] = round(sum(r["rawLatencyS"] for r in rows) / len(rows), 2)
+        summary["meanProcessedLatencyS"] = round(sum(r["processedLatencyS"] for r in rows) / len(rows), 2)
+        summary["questionCountMatches"] = sum(r["agreement"]["questionCountMatch"] for r in rows)
+
+    print("\n📊 Summary")
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        args.output.write_text(json.dumps({"summary": summary, "images": rows}, indent=2))
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
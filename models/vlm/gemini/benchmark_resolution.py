@@ -0,0 +1,146 @@
+"""Compare resolution budgets for exam photos: vision tokens, bytes, legibility, latency and accuracy.
+
+A budget is a fixed long edge in pixels, or "adaptive" for ImagePreprocessor's
+legibility-driven choice (the smallest long edge that keeps text lines
+VLM_PREPROCESS_MIN_TEXT_PX tall). Every image of exams/ is preprocessed under
+each budget and the estimated Gemini and Qwen vision tokens are reported with
+the text-line height left after resizing. With --extract the exams are also run
+through the model and scored against their golden files, as in
+benchmark_pipeline.py.
+
+Replays are keyed by the exact payload sent, so replaying needs recordings made
+at every budget (run once with a live backend and --record).
+
+Usage (from the project root):
+    python models/vlm/gemini/benchmark_resolution.py                          # tokens + legibility only
+    python models/vlm/gemini/benchmark_resolution.py --budgets 768,1024,1280,adaptive --extract
+    python models/vlm/gemini/benchmark_resolution.py --extract --backend qwen --output resolution.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.generation_backends import QWEN_MAX_PIXELS, QWEN_MIN_PIXELS, RecordingBackend, create_backend
+from models.common.vision_budget import estimate_text_height, gemini_image_tokens, qwen_image_tokens
+from models.vlm.gemini.benchmark_pipeline import MeteredBackend, _relative, benchmark_exam, find_exams, summarize
+from models.vlm.gemini.image_preprocessing import ImagePreprocessor
+
+DEFAULT_BUDGETS = "640,768,1024,1280,1600,adaptive"
+
+
+def make_preprocessor(budget: str) -> ImagePreprocessor:
+    if budget == "adaptive":
+        return ImagePreprocessor(enabled=True, adaptive=True)
+    return ImagePreprocessor(enabled=True, adaptive=False, target_long_edge=int(budget))
+
+
+def measure_image(path: Path, preprocessor: ImagePreprocessor) -> Dict:
+    start = time.perf_counter()
+    image = preprocessor.apply(Image.open(path))
+    preprocess_ms = (time.perf_counter() - start) * 1000
+    blob = preprocessor.encode(image)
+    text_height = estimate_text_height(image)
+    return {
+        "image": _relative(path),
+        "size": list(image.size),
+        "bytes": len(blob["data"]),
+        "preprocessMs": round(preprocess_ms, 1),
+        "textHeightPx": round(text_height, 1) if text_height else None,
+        "legible": bool(text_height and text_height >= preprocessor.min_text_height),
+        "geminiTokens": gemini_image_tokens(image.size),
+        "qwenTokens": qwen_image_tokens(image.size, QWEN_MIN_PIXELS, QWEN_MAX_PIXELS),
+    }
+
+
+def summarize_budget(rows: List[Dict]) -> Dict:
+    count = len(rows) or 1
+    return {
+        "images": len(rows),
+        "meanLongEdge": round(sum(max(r["size"]) for r in rows) / count),
+        "meanBytes": round(sum(r["bytes"] for r in rows) / count),
+        "geminiTokens": sum(r["geminiTokens"] for r in rows),
+        "qwenTokens": sum(r["qwenTokens"] for r in rows),
+        "legibleShare": round(sum(r["legible"] for r in rows) / count, 3),
+        "meanPreprocessMs": round(sum(r["preprocessMs"] for r in rows) / count, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=Path, default=project_root / "exams")
+    parser.add_argument("--exam", action="append", help="only these exam directories (repeatable)")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGETS,
+                        help=f"comma-separated long edges and/or 'adaptive' (default {DEFAULT_BUDGETS})")
+    parser.add_argument("--extract", action="store_true", help="also run the model under every budget")
+    parser.add_argument("--backend", choices=("gemini", "qwen", "replay"), default=None,
+                        help="defaults to VLM_BACKEND")
+    parser.add_argument("--record", type=Path, help="save the backend's responses here for later replay")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args()
+
+    exams = find_exams(args.exams_dir)
+    if args.exam:
+        exams = {name: pages for name, pages in exams.items() if name in args.exam}
+    if not exams:
+        print(f"No images found in {args.exams_dir}")
+        return
+    budgets = [b.strip() for b in args.budgets.split(",") if b.strip()]
+
+    processor = backend = None
+    if args.extract:
+        # Every page must reach the model; cached extractions would only measure the disk
+        os.environ["VLM_CACHE_DISABLED"] = "1"
+        from models.vlm.gemini.exam_processor import ExamProcessor
+
+        inner = create_backend(args.backend)
+        if args.record:
+            inner = RecordingBackend(inner, args.record)
+        backend = MeteredBackend(inner)
+        processor = ExamProcessor(backend=backend)
+
+    report = {"budgets": {}}
+    for budget in budgets:
+        preprocessor = make_preprocessor(budget)
+        rows = [measure_image(page, preprocessor) for pages in exams.values() for page in pages]
+        result = {"summary": summarize_budget(rows), "images": rows}
+
+        if processor is not None:
+            processor.preprocessor = preprocessor
+            start = time.perf_counter()
+            exam_rows, image_rows = [], []
+            for name, pages in exams.items():
+                exam, page_rows = benchmark_exam(processor, backend, name, pages)
+                exam_rows.append(exam)
+                image_rows.extend(page_rows)
+            result["extraction"] = summarize(exam_rows, image_rows, [], time.perf_counter() - start)
+            result["exams"] = exam_rows
+
+        report["budgets"][budget] = result
+
+    print(f"\n{'budget':>9} {'edge':>6} {'KB':>6} {'gemini tok':>11} {'qwen tok':>9} {'legible':>8}"
+          + (f" {'p50 s':>7} {'agreement':>10}" if processor is not None else ""))
+    for budget, result in report["budgets"].items():
+        summary = result["summary"]
+        line = (f"{budget:>9} {summary['meanLongEdge']:>6} {summary['meanBytes'] / 1024:>6.0f} "
+                f"{summary['geminiTokens']:>11} {summary['qwenTokens']:>9} {summary['legibleShare']:>8.0%}")
+        if "extraction" in result:
+            extraction = result["extraction"]
+            line += f" {extraction['p50LatencyS'] or 0:>7.2f} {extraction['meanAnswerAgreement']!s:>10}"
+        print(line)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,134 +1,586 @@
-import google.generativeai as genai
-from PIL import Image
+from PIL import Image, ImageOps
 import logging
 import json
-from typing import Dict, List, Optional
+import re
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
 import os
-from dotenv import load_dotenv
+
+try:
+    from .batch_grading import AnswerKey
+    from .exam_schema import EXAM_SCHEMA, QUESTIONS_SCHEMA, describe_question, load_json, question_errors
+    from .extraction_cache import ExtractionCache
+    from .image_preprocessing import ImagePreprocessor
+    from .incremental_json import QuestionStreamParser
+    from .question_segmentation import QuestionSegmenter
+except ImportError:  # run as a script from this directory
+    from batch_grading import AnswerKey
+    from exam_schema import EXAM_SCHEMA, QUESTIONS_SCHEMA, describe_question, load_json, question_errors
+    from extraction_cache import ExtractionCache
+    from image_preprocessing import ImagePreprocessor
+    from incremental_json import QuestionStreamParser
+    from question_segmentation import QuestionSegmenter
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.gemini_scheduler import BULK, INTERACTIVE, get_scheduler
+from models.common.generation_backends import GenerationBackend, create_backend
+from models.common import instrumentation
+from models.common.omr import OMRReader, has_bubbles
+from models.common.page_template import PageRegistrar, PageTemplate, stack_regions
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum number of pages of one exam extracted at the same time
+DEFAULT_PAGE_CONCURRENCY = int(os.getenv('VLM_PAGE_CONCURRENCY', '4'))
+
+# Constrain teacher extraction to the exam JSON schema and repair bad questions in place.
+# Set VLM_STRUCTURED_OUTPUT=0 to fall back to free-form JSON in the prompt only.
+STRUCTURED_OUTPUT = os.getenv('VLM_STRUCTURED_OUTPUT', '1') != '0'
+
+# Split dense teacher pages into question blocks extracted in parallel; VLM_SEGMENT=1 to enable
+SEGMENT_ENABLED = os.getenv('VLM_SEGMENT', '0') == '1'
+# Maximum number of regions of one page extracted at the same time
+DEFAULT_REGION_CONCURRENCY = int(os.getenv('VLM_REGION_CONCURRENCY', '4'))
+
+# Read bubble answers locally before asking Gemini; set VLM_OMR=0 to send whole sheets instead
+OMR_ENABLED = os.getenv('VLM_OMR', '1') != '0'
+
+# Questions at the end of one page compared with the start of the next for repeats
+_PAGE_OVERLAP = 3
+
+# Metadata values the prompt uses when a field is missing on a page
+_DEFAULT_METADATA = {
+    "title": "Untitled Exam",
+    "subject": "none",
+    "year": "none",
+    "courseCode": "NONE",
+    "instructions": "",
+    "duration": 60,
+}
+
+# A file path, the raw file bytes, or a readable binary buffer such as an upload's spooled file
+ImageSource = Union[str, Path, bytes, BinaryIO]
+
 class ExamProcessor:
-    def __init__(self):
-        load_dotenv()
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17')
-        logger.info("ExamProcessor initialized with Gemini model")
-
-    def _load_image(self, image_path: str) -> Image.Image:
-        logger.info(f"Loading image from: {image_path}")
+    def __init__(self, cache: Optional[ExtractionCache] = None,
+                 preprocessor: Optional[ImagePreprocessor] = None,
+                 structured: Optional[bool] = None,
+                 omr: Optional[OMRReader] = None,
+                 backend: Optional[GenerationBackend] = None,
+                 segmenter: Optional[QuestionSegmenter] = None):
+        # Gemini unless VLM_BACKEND picks local Qwen or recorded replays
+        self.backend = backend or create_backend()
+        self.model_name = self.backend.signature()
+        # Set VLM_CACHE_DISABLED=1 to always call the model
+        if cache is None and not os.getenv('VLM_CACHE_DISABLED'):
+            cache = ExtractionCache()
+        self.cache = cache
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Every Gemini call (live or replayed) goes through the process-wide rate limiter
+        self.scheduler = get_scheduler()
+        self.structured = STRUCTURED_OUTPUT if structured is None else structured
+        if omr is None and OMR_ENABLED:
+            omr = OMRReader()
+        self.omr = omr
+        if segmenter is None and SEGMENT_ENABLED:
+            segmenter = QuestionSegmenter()
+        self.segmenter = segmenter
+        self.registrar = PageRegistrar()
+        self._repair_stats = {
+            "responses": 0,
+            "repairedLocally": 0,
+            "unparsable": 0,
+            "invalidQuestions": 0,
+            "recoveredQuestions": 0,
+            "requeryCalls": 0,
+            "fullCallsSaved": 0,
+            "segmentedPages": 0,
+            "regions": 0,
+            "failedRegions": 0,
+            "visionTokens": 0,
+        }
+        self._stats_lock = threading.Lock()
+        logger.info(f"ExamProcessor initialized with {self.backend.name} backend ({self.model_name})")
+
+    @staticmethod
+    def _read_source(source: ImageSource) -> bytes:
+        """Raw bytes of an image source, leaving buffers rewound"""
+        if isinstance(source, bytes):
+            return source
+        if isinstance(source, (str, Path)):
+            return Path(source).read_bytes()
+        position = source.tell()
+        data = source.read()
+        source.seek(position)
+        return data
+
+    @staticmethod
+    def _describe(source: ImageSource) -> str:
+        if isinstance(source, (str, Path)):
+            return str(source)
+        return "in-memory upload"
+
+    def _load_image(self, source: ImageSource) -> Image.Image:
+        logger.info(f"Loading image from: {self._describe(source)}")
         try:
-            image = Image.open(image_path)
+            if isinstance(source, bytes):
+                source = io.BytesIO(source)
+            image = Image.open(source)
             logger.info(f"Image loaded successfully. Size: {image.size}, Mode: {image.mode}")
             return image
         except Exception as e:
             logger.error(f"Failed to load image: {str(e)}")
             raise
 
-    def process_teacher_exam(self, image_path: str) -> Dict:
-        """Process teacher's exam paper to create exam structure"""
-        print(f"\n📄 Processing teacher exam from: {image_path}")
-        image = self._load_image(image_path)
-        
-        prompt = """
-        Analyze this exam paper and extract the following information in a structured format:
-        1. Title of the exam (if any)
-        2. Subject (if any)
-        3. Year (if any)
-        4. Course code (if any)
-        5. Instructions (if any)
-        6. Duration (in minutes)
-        7. Questions with:
-           - Question text
-           - Type (MCQ/Essay)
-           - Points (default 1 if not specified)
-           - Correct answer(s)
-           - Options (for MCQ)
-        
-        Format as JSON:
-        {
-            "title": "Untitled Exam",
-            "courseCode": "NONE",
-            "subject": "NONE",
-            "year": "NONE",
-            "semester": "NONE",
-            "instructions": "",
-            "duration": 60,
-            "questions": [
-                {
-                    "text": "",
-                    "type": "",
-                    "points": 1,
-                    "modelAnswer": "",
-                    "options": [
-                        {"text": "", "isCorrect": false}
-                    ]
-                }
-            ]
-        }
-        Ensure all field names exactly match the format above.
+    def _load_page(self, data: bytes) -> Image.Image:
+        """A page as segmentation and templates see it: preprocessed, or at least upright"""
+        page = self._load_image(data)
+        return self.preprocessor.apply(page) if self.preprocessor.enabled else ImageOps.exif_transpose(page)
+
+    def _prepare_image(self, source: ImageSource, data: Optional[bytes] = None):
+        """Load an image and shrink it into the payload sent to the model"""
+        if data is None:
+            data = self._read_source(source)
+        # PIL decodes lazily, so decoding is timed together with preprocessing
+        with instrumentation.stage("image_decode"):
+            return self.preprocessor.prepare(self._load_image(data), original=data)
+
+    def _generate(self, contents: List, priority: int = INTERACTIVE, **kwargs):
+        """Call the model, through the shared scheduler for quota-bound backends
+        (time includes waiting for it; streamed calls until the first chunk)"""
+        vision_tokens = self.backend.vision_tokens(contents)
+        if vision_tokens:
+            self._count("visionTokens", vision_tokens)
+            logger.info(f"Sending {vision_tokens} vision tokens to {self.model_name}")
+        with instrumentation.in_flight("gemini_calls"), instrumentation.stage("gemini_call"):
+            if self.backend.scheduled:
+                return self.scheduler.generate_content(self.backend, contents, priority=priority, **kwargs)
+            return self.backend.generate_content(contents, **kwargs)
+
+    def _structured_config(self, schema: Dict) -> Dict:
+        """generate_content kwargs that constrain the response to schema, when enabled"""
+        if not self.structured:
+            return {}
+        return {"schema": schema}
+
+    def _cache_version(self) -> str:
+        """Model, preprocessing and output settings; any of them changing must miss the cache"""
+        mode = "structured" if self.structured else "free"
+        if self.segmenter is not None:
+            mode += f"|segmented:{self.segmenter.max_regions}"
+        return f"{self.model_name}|{self.preprocessor.signature()}|{mode}"
+
+    @instrumentation.timed("teacher_exam")
+    def process_teacher_exam(self, image: ImageSource, use_cache: bool = True) -> Dict:
+        """Process teacher's exam paper to create exam structure.
+
+        The image may be a path, raw bytes or a binary buffer. Results are cached by
+        image content, prompt and model; pass use_cache=False to force a fresh
+        extraction (the fresh result still replaces the cached one).
         """
+        print(f"\n📄 Processing teacher exam from: {self._describe(image)}")
+        prompt = self._get_teacher_prompt()
+        data = self._read_source(image)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ExtractionCache.make_key(data, prompt, self._cache_version())
+            if use_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    print("⚡ Returning cached extraction")
+                    logger.info(f"Extraction cache hit for {self._describe(image)}")
+                    return cached
+
+        if self.segmenter is not None:
+            parsed_response = self._extract_regions(data)
+            if parsed_response is not None:
+                # A page missing failed blocks is returned but not pinned in the cache
+                if cache_key is not None and not parsed_response.get("failedRegions"):
+                    self.cache.put(cache_key, parsed_response)
+                return parsed_response
+
+        image = self._prepare_image(image, data)
         
         print("🔍 Analyzing image with Gemini...")
         logger.info("Sending prompt to Gemini for teacher exam")
         try:
-            response = self.model.generate_content([prompt, image])
+            response = self._generate([prompt, image], **self._structured_config(EXAM_SCHEMA))
             print(f"📊 Raw response length: {len(response.text)} characters")
             logger.info("Received response from Gemini")
             logger.debug(f"Raw response: {response.text}")
             
-            parsed_response = self._parse_json_response(response.text)
+            parsed_response = self._parse_teacher_response(response.text, image)
             print("✅ Successfully parsed response")
             logger.info("Successfully parsed response")
             logger.debug(f"Parsed structure: {json.dumps(parsed_response, indent=2)}")
+
+            # An empty structure means parsing failed; don't pin that result in the cache
+            if cache_key is not None and parsed_response.get("questions"):
+                self.cache.put(cache_key, parsed_response)
             return parsed_response
             
         except Exception as e:
             logger.error(f"Error processing teacher exam: {str(e)}")
             raise
 
-    def process_student_answers(self, image_path: str, exam_structure: Dict) -> Dict:
-        """Process student's answer sheet"""
-        image = self._load_image(image_path)
-        
-        prompt = """
-        Extract student answers from this answer sheet.
-        List answers in order, one per line.
-        If a question is not answered, mark it as 'NA'.
-        Format as JSON:
-        {
-            "answers": [
-                {
-                    "answer": "text of selected answer or written response in lowercase, or NA if not answered"
-                }
-            ]
-        }
-        Keep all text lowercase.
-        Ensure every question has an answer entry, even if it's NA.
+    def stream_teacher_exam(self, image: ImageSource, use_cache: bool = True) -> Iterator[Dict]:
+        """Process a teacher's exam while the model is still answering.
+
+        Yields {"type": "question", "index", "question"} as soon as each question's
+        closing brace arrives, then {"type": "exam", "exam"} with the full structure.
         """
-        
-        response = self.model.generate_content([prompt, image])
-        result = self._parse_json_response(response.text.lower())
-        
+        print(f"\n📄 Streaming teacher exam from: {self._describe(image)}")
+        prompt = self._get_teacher_prompt()
+        data = self._read_source(image)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ExtractionCache.make_key(data, prompt, self._cache_version())
+            cached = self.cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                logger.info(f"Extraction cache hit for {self._describe(image)}")
+                for index, question in enumerate(cached.get("questions", [])):
+                    yield {"type": "question", "index": index, "question": question}
+                yield {"type": "exam", "exam": cached}
+                return
+
+        image = self._prepare_image(image, data)
+        logger.info("Streaming prompt to Gemini for teacher exam")
+        response = self._generate([prompt, image], stream=True, **self._structured_config(EXAM_SCHEMA))
+
+        parser = QuestionStreamParser()
+        index = 0
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata)
+                continue
+            for fragment in parser.feed(text):
+                try:
+                    # Same normalization as the full parse, which lowercases the payload
+                    question = self._normalize_question(json.loads(fragment.lower()))
+                except (ValueError, AttributeError) as e:
+                    logger.warning(f"Skipping unparsable streamed question: {str(e)}")
+                    continue
+                yield {"type": "question", "index": index, "question": question}
+                index += 1
+
+        print(f"📊 Streamed response length: {len(parser.text)} characters")
+        # Questions repaired after the stream ended only show up in the final exam event
+        parsed_response = self._parse_teacher_response(parser.text, image)
+        if cache_key is not None and parsed_response.get("questions"):
+            self.cache.put(cache_key, parsed_response)
+        yield {"type": "exam", "exam": parsed_response}
+
+    def _extract_regions(self, data: bytes) -> Optional[Dict]:
+        """Extract a page as separate question blocks, concurrently, stitched back in reading order.
+
+        Returns None when the page doesn't split or no block yielded questions, so
+        the caller extracts the whole page instead. A block that fails is left out
+        rather than failing the page, and its number is listed under "failedRegions".
+        """
+        with instrumentation.stage("segmentation"):
+            page = self._load_page(data)
+            boxes = self.segmenter.segment(page)
+        if len(boxes) < 2:
+            logger.info("Page did not split into question blocks, extracting it whole")
+            return None
+
+        prompt = self._get_region_prompt()
+        crops = [self.preprocessor.encode(page.crop(box)) for box in boxes]
+        workers = max(1, min(DEFAULT_REGION_CONCURRENCY, len(crops)))
+        print(f"🧩 Extracting {len(crops)} question blocks with {workers} concurrent workers")
+
+        def extract_region(crop) -> Dict:
+            response = self._generate([prompt, crop], **self._structured_config(EXAM_SCHEMA))
+            return self._parse_teacher_response(response.text, crop)
+
+        results, failed = [], []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_region, crop) for crop in crops]
+            for index, future in enumerate(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    self._count("failedRegions")
+                    failed.append(index + 1)
+                    logger.warning(f"Question block {index + 1} of {len(crops)} failed: {str(e)}")
+
+        if not any(result.get("questions") for result in results):
+            return None
+        self._count("segmentedPages")
+        self._count("regions", len(crops))
+        # Blocks are cut at gaps, but a question split across two is deduplicated like across pages
+        merged = self.merge_exam_pages(results)
+        if failed:
+            merged["failedRegions"] = failed
+        return merged
+
+    def process_teacher_exam_pages(self, images: List[ImageSource], max_concurrency: Optional[int] = None,
+                                   use_cache: bool = True,
+                                   progress: Optional[Callable[[int, str], None]] = None) -> Dict:
+        """Process a multi-page teacher exam, extracting the pages concurrently.
+
+        progress, if given, is called with (page_index, "running" | "done" | "failed").
+        Pages that lost question blocks to failed extractions are listed under "incompletePages".
+        """
+        if not images:
+            raise ValueError("No exam pages provided")
+
+        workers = max(1, min(max_concurrency or DEFAULT_PAGE_CONCURRENCY, len(images)))
+        print(f"\n📚 Processing {len(images)} exam pages with {workers} concurrent workers")
+        logger.info(f"Extracting {len(images)} pages with concurrency {workers}")
+
+        def extract_page(index: int, image: ImageSource) -> Dict:
+            if progress:
+                progress(index, "running")
+            try:
+                page = self.process_teacher_exam(image, use_cache=use_cache)
+            except Exception:
+                if progress:
+                    progress(index, "failed")
+                raise
+            if progress:
+                progress(index, "done")
+            return page
+
+        # map() keeps the results in page order whatever order the calls finish in
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exam-page") as executor:
+            pages = list(executor.map(extract_page, range(len(images)), images))
+
+        merged = self.merge_exam_pages(pages)
+        incomplete = [number for number, page in enumerate(pages, start=1) if page.get("failedRegions")]
+        if incomplete:
+            merged["incompletePages"] = incomplete
+        logger.info(f"Merged {len(images)} pages into {len(merged['questions'])} questions")
+        return merged
+
+    def merge_exam_pages(self, pages: List[Dict]) -> Dict:
+        """Merge per-page exam structures into one exam, dropping questions repeated across
+        a page boundary (overlapping photos); questions within a page are all kept"""
+        merged = dict(_DEFAULT_METADATA)
+        merged["questions"] = []
+
+        # Metadata usually sits on the first page; take the first non-default value of each field
+        for field, default in _DEFAULT_METADATA.items():
+            for page in pages:
+                value = page.get(field, default)
+                if value not in (default, None, "") and str(value).lower() != str(default).lower():
+                    merged[field] = value
+                    break
+
+        questions = merged["questions"]
+        for page_number, page in enumerate(pages, start=1):
+            # Overlapping photos only repeat the end of the previous page at the start of this one
+            tail = list(range(max(0, len(questions) - _PAGE_OVERLAP), len(questions)))
+            last = len(questions) - 1
+            for position, question in enumerate(page.get("questions", [])):
+                duplicate = None
+                if position < _PAGE_OVERLAP:
+                    for index in tail:
+                        # Only the pair at the cut can have one copy cut short
+                        if self._same_question(questions[index], question,
+                                               truncated=index == last and position == 0):
+                            duplicate = index
+                            break
+                if duplicate is None:
+                    questions.append(question)
+                    continue
+
+                logger.info(f"Dropping duplicate question from page {page_number}: {question.get('text', '')[:60]}")
+                tail.remove(duplicate)
+                kept = questions[duplicate]
+                # Keep whichever copy was read more completely
+                if (len(question.get("options", [])), len(question.get("text", ""))) > \
+                        (len(kept.get("options", [])), len(kept.get("text", ""))):
+                    questions[duplicate] = question
+
+        return merged
+
+    @classmethod
+    def _same_question(cls, first: Dict, second: Dict, truncated: bool = False) -> bool:
+        """Whether two extracted questions are the same one read twice.
+
+        Type, text and options must all match. With truncated, one copy may have
+        been cut short by the photo's edge: its text (at least 20 characters) and
+        its options must then be the start of the other's.
+        """
+        first_type, first_text, first_options = cls._question_key(first)
+        second_type, second_text, second_options = cls._question_key(second)
+        if not first_text or not second_text or first_type != second_type:
+            return False
+        if first_text == second_text and first_options == second_options:
+            return True
+        if not truncated:
+            return False
+        (short_text, short_options), (long_text, long_options) = sorted(
+            ((first_text, first_options), (second_text, second_options)), key=lambda key: len(key[0]))
+        return len(short_text) >= 20 and long_text.startswith(short_text) and \
+            long_options[:len(short_options)] == short_options
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+    @classmethod
+    def _question_key(cls, question: Dict) -> tuple:
+        """(type, text, option texts), normalized, used to detect the same question on two pages"""
+        text = question.get("text", "").lower()
+        # Drop leading numbering such as "1.", "Q2)" or "(3)"
+        text = re.sub(r"^\s*(q(uestion)?\s*)?\(?\d+[\).:-]?\s*", "", text)
+        options = tuple(cls._normalize_text(option.get("text", "")) for option in question.get("options", []))
+        return str(question.get("type", "")).upper(), cls._normalize_text(text), options
+
+    def build_template(self, image: ImageSource, skip_header: bool = True,
+                       regions: Optional[List[List[float]]] = None) -> PageTemplate:
+        """Page template of an exam page, for cropping students' copies of it to their answers.
+
+        regions are the answer boxes as [left, top, right, bottom] fractions of the
+        page, e.g. drawn by the teacher around the answer columns. Without them the
+        page's question blocks are used, each widened to its text column and
+        extended down to the next block so handwriting in the gaps is kept;
+        skip_header then leaves out the first block (title, course, instructions).
+        """
+        page = self._load_page(self._read_source(image))
+        if regions:
+            boxes = []
+            for box in regions:
+                left, top, right, bottom = (min(1.0, max(0.0, float(v))) for v in box)
+                if right <= left or bottom <= top:
+                    raise ValueError(f"Empty answer region: {box}")
+                boxes.append((round(left * page.width), round(top * page.height),
+                              round(right * page.width), round(bottom * page.height)))
+            return self.registrar.build(page, boxes)
+
+        boxes = (self.segmenter or QuestionSegmenter()).segment(page)
+        if skip_header and len(boxes) > 2:
+            boxes = boxes[1:]
+        answer_boxes = []
+        for left, top, right, bottom in boxes:
+            column = [b for b in boxes if b[0] < right and b[2] > left]
+            below = [b[1] for b in column if b[1] > top]
+            answer_boxes.append((min(b[0] for b in column), top, max(b[2] for b in column),
+                                 max(bottom, min(below)) if below else page.height))
+        return self.registrar.build(page, answer_boxes)
+
+    def _answer_regions(self, data: bytes, template: PageTemplate):
+        """The sheet's answer regions stacked into one payload, or None if the photo didn't register"""
+        with instrumentation.stage("registration"):
+            photo = self._load_image(data)
+            registration = self.registrar.register(photo, template)
+        report = {"registered": registration.registered, "inliers": registration.inliers,
+                  "ms": round(registration.elapsed_ms, 1), "originalBytes": len(data)}
+        if not registration.registered:
+            logger.info("Sheet did not register to the exam template, sending the whole photo")
+            return None, report
+        strip = stack_regions(self.registrar.crop_regions(photo, template, registration))
+        payload = self.preprocessor.prepare(strip) if self.preprocessor.enabled else self.preprocessor.encode(strip)
+        report["regions"] = len(template.regions)
+        report["sentBytes"] = len(payload["data"]) if isinstance(payload, dict) else None
+        return payload, report
+
+    @instrumentation.timed("student_sheet")
+    def process_student_answers(self, image: ImageSource, exam_structure: Optional[Dict],
+                                template: Optional[PageTemplate] = None) -> Dict:
+        """Process student's answer sheet against its exam's structure.
+
+        Bubbles on a printed answer sheet (see models.common.omr) are read locally;
+        only essays and unclear marks are sent to Gemini, and not at all if none remain.
+        With the exam's page template (see build_template) only the sheet's answer
+        regions are sent, unless the photo can't be registered to it.
+        """
+        data = self._read_source(image)
+        # Without a structure the whole sheet is read blind, as before
+        questions = (exam_structure or {}).get("questions", [])
+
+        answers = {}
+        omr_report = {"registered": False, "localAnswers": 0, "ms": 0.0}
+        if self.omr is not None and any(has_bubbles(q) for q in questions):
+            try:
+                with instrumentation.stage("omr"):
+                    reading = self.omr.read(self._load_image(data), questions)
+            except Exception as e:
+                logger.warning(f"OMR failed, reading the whole sheet with Gemini: {str(e)}")
+            else:
+                answers.update(reading.answers)
+                omr_report = {"registered": reading.registered, "localAnswers": len(reading.answers),
+                              "ms": round(reading.elapsed_ms, 1)}
+
+        pending = [index for index in range(len(questions)) if index not in answers]
+        needs_vlm = bool(pending) or not questions
+        template_report = None
+        if needs_vlm:
+            payload = None
+            if template is not None:
+                try:
+                    payload, template_report = self._answer_regions(data, template)
+                except Exception as e:
+                    logger.warning(f"Template registration failed, sending the whole photo: {str(e)}")
+            answers.update(self._read_answers_with_gemini(data, questions, pending, payload))
+        omr_report["vlmQuestions"] = len(pending)
+        omr_report["vlmCalls"] = int(needs_vlm)
+
         # Ensure we have answers for all questions, fill with "na" if missing
-        expected_answers = len(exam_structure.get("questions", []))
-        current_answers = len(result.get("answers", []))
-        
-        if current_answers < expected_answers:
-            result["answers"].extend([{"answer": "na"} for _ in range(expected_answers - current_answers)])
-            
+        expected_answers = max(len(questions), len(answers))
+        result = {"answers": [answers.get(index, {"answer": "na"}) for index in range(expected_answers)]}
+        result["omr"] = omr_report
+        if template_report is not None:
+            result["template"] = template_report
         return result
 
-    def get_raw_response(self, image_path: str, is_student: bool = False) -> str:
+    def _read_answers_with_gemini(self, data: bytes, questions: List[Dict], pending: List[int],
+                                  payload=None) -> Dict[int, Dict]:
+        """Ask Gemini for the answers to the pending questions (all of them if the structure is unknown).
+
+        payload replaces the whole photo, e.g. with just its answer regions.
+        """
+        prompt = self._get_student_prompt(questions, pending, cropped=payload is not None)
+        if payload is None:
+            payload = self._prepare_image(data, data)
+        response = self._generate([prompt, payload], priority=BULK)
+        try:
+            parsed, _ = load_json(response.text.lower())
+            found = parsed.get("answers", [])
+        except (ValueError, AttributeError) as e:
+            logger.error(f"JSON parsing error: {str(e)}")
+            found = []
+
+        targets = pending if questions else range(len(found))
+        answers = {}
+        for position, entry in enumerate(found):
+            if not isinstance(entry, dict):
+                continue
+            # Prefer the question number the model echoed, fall back to list order
+            try:
+                index = int(entry.get("question")) - 1
+            except (TypeError, ValueError):
+                index = None
+            if index not in targets:
+                index = targets[position] if position < len(targets) else None
+            if index is None:
+                continue
+            answers[index] = {"answer": str(entry.get("answer", "na")).strip() or "na", "source": "vlm"}
+        return answers
+
+    def get_raw_response(self, image: ImageSource, is_student: bool = False,
+                         exam_structure: Optional[Dict] = None) -> str:
         """Get raw response from Gemini model for debugging"""
-        image = self._load_image(image_path)
-        prompt = self._get_student_prompt if is_student else self._get_teacher_prompt
-        response = self.model.generate_content([prompt, image])
+        image = self._prepare_image(image)
+        if is_student:
+            prompt = self._get_student_prompt((exam_structure or {}).get("questions"))
+        else:
+            prompt = self._get_teacher_prompt()
+        response = self._generate([prompt, image], priority=BULK if is_student else INTERACTIVE)
         return response.text
 
     def _get_teacher_prompt(self):
@@ -171,66 +623,176 @@ class ExamProcessor:
         Ensure all field names exactly match the format above.
         """
         
-    def _get_student_prompt(self):
-        return """
-        Given this student's answer sheet, extract answers for the following exam:
-        {exam_structure['questions']}
-        
+    def _get_region_prompt(self):
+        return self._get_teacher_prompt() + """
+        This image is one region of an exam page, not the whole page. It may hold the
+        header, one or more questions, or a section heading. Extract only what is
+        visible here and leave the defaults above for information that is not.
+        """
+
+    def _get_student_prompt(self, questions: Optional[List[Dict]] = None,
+                            pending: Optional[List[int]] = None, cropped: bool = False):
+        """Prompt for reading answers, listing the exam's questions when they are known.
+
+        pending limits it to those question indices (the rest were read another way);
+        cropped says the image holds only the sheet's answer regions.
+        """
+        if questions:
+            indices = pending if pending is not None else range(len(questions))
+            listed = []
+            for index in indices:
+                question = questions[index]
+                line = f"{index + 1}. [{str(question.get('type', 'MCQ')).upper()}] {question.get('text', '')}"
+                if question.get("options"):
+                    line += " Options: " + "; ".join(
+                        f"{chr(ord('a') + position)}) {option.get('text', '')}"
+                        for position, option in enumerate(question["options"])
+                    )
+                listed.append(line)
+            only = "only " if len(listed) < len(questions) else ""
+            scope = (f"This exam has {len(questions)} questions. Extract the student's answers to {only}these:\n"
+                     + "\n".join(listed)
+                     + "\nFor a multiple choice question answer with the text of the selected option.")
+        else:
+            scope = "Extract student answers from this answer sheet.\nList answers in order, one per line."
+        if cropped:
+            scope = ("The image shows only the question areas of the student's sheet, "
+                     "cut out and stacked top to bottom in page order.\n" + scope)
+
+        return f"""
+        {scope}
+        If a question is not answered, mark it as 'NA'.
         Format as JSON:
         {{
             "answers": [
                 {{
-                    "questionId": 1,
-                    "answer": "",
-                    "selectedOption": null
+                    "question": 1,
+                    "answer": "text of selected answer or written response in lowercase, or NA if not answered"
                 }}
             ]
         }}
+        Keep all text lowercase.
+        Ensure every question has an answer entry, even if it's NA.
+        """
+
+    def _parse_teacher_response(self, response: str, image) -> Dict:
+        """Parse a teacher exam extraction, repairing it instead of extracting the page again.
+
+        Malformed JSON is repaired locally. Questions that still fail validation are
+        re-read from the same image in one call that asks for just those questions.
         """
+        if not self.structured:
+            with instrumentation.stage("json_parse"):
+                return self._parse_json_response(response)
+
+        self._count("responses")
+        try:
+            with instrumentation.stage("json_parse"):
+                parsed, repaired = load_json(response.lower())
+        except ValueError as e:
+            logger.error(f"Unrepairable JSON from Gemini: {str(e)}")
+            self._count("unparsable")
+            return self._parse_json_response(response)
+        if not isinstance(parsed, dict):
+            self._count("unparsable")
+            return self._parse_json_response(response)
+
+        questions = parsed.get("questions")
+        if not isinstance(questions, list):
+            questions = []
+        parsed["questions"] = questions
+        invalid = {i: question_errors(q) for i, q in enumerate(questions)}
+        invalid = {i: errors for i, errors in invalid.items() if errors}
+
+        recovered = 0
+        if invalid:
+            logger.warning(f"{len(invalid)} of {len(questions)} questions invalid, re-querying only those")
+            self._count("invalidQuestions", len(invalid))
+            replacements = self._requery_questions(image, questions, invalid)
+            for index, replacement in replacements.items():
+                if not question_errors(replacement):
+                    questions[index] = replacement
+                    recovered += 1
+            self._count("recoveredQuestions", recovered)
+        # Drop what is still unusable rather than failing the whole page
+        parsed["questions"] = [q for q in questions if isinstance(q, dict) and str(q.get("text") or "").strip()]
+
+        if repaired:
+            logger.info("Repaired malformed JSON locally")
+            self._count("repairedLocally")
+        if repaired or recovered:
+            # Before, the only way out was the teacher uploading the page again
+            self._count("fullCallsSaved")
+        try:
+            return self._normalize_exam(parsed)
+        except Exception as e:
+            logger.error(f"JSON parsing error: {str(e)}")
+            return self._parse_json_response(response)
+
+    def _requery_questions(self, image, questions: List, invalid: Dict[int, List[str]]) -> Dict[int, Dict]:
+        """Ask the model again for just the invalid questions; returns replacements by index"""
+        lines = []
+        for index, errors in invalid.items():
+            excerpt = describe_question(questions[index])
+            where = f'starting "{excerpt}"' if excerpt else "(text unreadable)"
+            lines.append(f"- question {index + 1} on the page {where}: {', '.join(errors)}")
+        prompt = f"""
+        This exam page was already transcribed, but these questions came back incomplete:
+        {chr(10).join(lines)}
+
+        Re-read only these questions from the image, in the order listed, with:
+           - Question text
+           - Type (MCQ/Essay)
+           - Points (default 1 if not specified)
+           - Correct answer(s)
+           - Options (for MCQ, marking the correct one)
+
+        Format as JSON:
+        {{
+            "questions": [
+                {{
+                    "text": "",
+                    "type": "",
+                    "points": 1,
+                    "modelAnswer": "",
+                    "options": [
+                        {{"text": "", "isCorrect": false}}
+                    ]
+                }}
+            ]
+        }}
+        """
+        self._count("requeryCalls")
+        try:
+            response = self._generate([prompt, image], **self._structured_config(QUESTIONS_SCHEMA))
+            parsed, _ = load_json(response.text.lower())
+        except Exception as e:
+            logger.error(f"Re-query for invalid questions failed: {str(e)}")
+            return {}
+
+        found = parsed.get("questions") if isinstance(parsed, dict) else None
+        if not isinstance(found, list):
+            return {}
+        # Matched by position, as the prompt lists them in order
+        return dict(zip(invalid, found))
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._repair_stats[name] += amount
+
+    def repair_stats(self) -> Dict:
+        """How often structured extraction repaired output instead of extracting again,
+        page segmentation counts and the vision tokens sent"""
+        with self._stats_lock:
+            stats = dict(self._repair_stats)
+        stats["structuredOutput"] = self.structured
+        return stats
 
     def _parse_json_response(self, response: str) -> Dict:
         """Extract JSON from response and handle cleanup"""
         try:
-            # Find JSON content between curly braces
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            json_str = response[start:end].lower()  # Normalize case
-            parsed = json.loads(json_str)
-            
-            # Normalize field names and ensure required fields
-            normalized = {
-                "title": parsed.get("title", "Untitled Exam"),
-                "subject": parsed.get("subject", "NONE").lower(),
-                "year": parsed.get("year", "NONE").lower(),
-                "courseCode": parsed.get("coursecode", "NONE").upper(),
-                "instructions": parsed.get("instructions", ""),
-                "duration": int(parsed.get("duration", 60)),
-                "questions": []
-            }
-            
-            # Normalize questions
-            for q in parsed.get("questions", []):
-                normalized_question = {
-                    "text": q.get("text", "").strip(),
-                    "type": q.get("type", "MCQ").upper(),
-                    "points": int(q.get("points", 1)),
-                    "modelAnswer": q.get("modelanswer", "").strip(),
-                    "options": []
-                }
-                
-                # Normalize options
-                if "options" in q:
-                    normalized_question["options"] = [
-                        {
-                            "text": opt.get("text", "").strip(),
-                            "isCorrect": bool(opt.get("iscorrect", False))
-                        }
-                        for opt in q["options"]
-                    ]
-                
-                normalized["questions"].append(normalized_question)
-            
-            return normalized
+            parsed, _ = load_json(response.lower())  # Normalize case
+            return self._normalize_exam(parsed)
             
         except Exception as e:
             logger.error(f"JSON parsing error: {str(e)}")
@@ -243,20 +805,75 @@ class ExamProcessor:
                 "questions": []
             }
 
+    def _normalize_exam(self, parsed: Dict) -> Dict:
+        """Normalize field names of a parsed (lowercased) exam and ensure required fields"""
+        normalized = {
+            "title": parsed.get("title", "Untitled Exam"),
+            "subject": parsed.get("subject", "NONE").lower(),
+            "year": parsed.get("year", "NONE").lower(),
+            "courseCode": parsed.get("coursecode", "NONE").upper(),
+            "instructions": parsed.get("instructions", ""),
+            "duration": int(parsed.get("duration", 60)),
+            "questions": []
+        }
+        
+        # Normalize questions
+        for q in parsed.get("questions", []):
+            normalized["questions"].append(self._normalize_question(q))
+        
+        return normalized
+
+    @staticmethod
+    def _normalize_question(q: Dict) -> Dict:
+        """Normalize one question parsed from lowercased model output"""
+        normalized_question = {
+            "text": q.get("text", "").strip(),
+            "type": q.get("type", "MCQ").upper(),
+            "points": int(q.get("points", 1)),
+            "modelAnswer": q.get("modelanswer", "").strip(),
+            "options": []
+        }
+        
+        # Normalize options
+        if "options" in q:
+            normalized_question["options"] = [
+                {
+                    "text": opt.get("text", "").strip(),
+                    "isCorrect": bool(opt.get("iscorrect", False))
+                }
+                for opt in q["options"]
+            ]
+        return normalized_question
+
+    def grade_class(self, exam_structure: Dict, students: List, student_ids: Optional[List] = None) -> Dict:
+        """Grade every student's sheet against the exam's answer key in one pass.
+
+        students holds process_student_answers results (or their answers lists).
+        Returns per-student totals with correct/missing masks and per-question rates.
+        """
+        key = AnswerKey(exam_structure)
+        grades = key.grade(key.encode(students))
+        return grades.to_dict(student_ids)
+
     def compare_answers(self, teacher_answers: List[Dict], student_answers: List[Dict]) -> List[Dict]:
         """Compare answers and handle NA values"""
+        if len(student_answers) != len(teacher_answers):
+            logger.warning(f"Comparing {len(student_answers)} student answers with {len(teacher_answers)} "
+                           "teacher answers; missing ones count as not attempted")
         results = []
-        for i, (teacher, student) in enumerate(zip(teacher_answers, student_answers)):
+        for i, teacher in enumerate(teacher_answers):
+            # A short answer list must not silently drop the remaining questions
+            student = student_answers[i] if i < len(student_answers) else {"answer": "na"}
             is_correct = False
             points_awarded = 0
             
-            if student["answer"] != "na":  # Only evaluate if question was attempted
+            if student.get("answer", "na") != "na":  # Only evaluate if question was attempted
                 is_correct = teacher["answer"].lower() == student["answer"].lower()
                 points_awarded = teacher.get("points", 0) if is_correct else 0
             
             results.append({
                 "question_number": i + 1,
-                "attempted": student["answer"] != "na",
+                "attempted": student.get("answer", "na") != "na",
                 "is_correct": is_correct,
                 "points_awarded": points_awarded
             })
@@ -0,0 +1,156 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Question types the prompt asks for (true/false questions are MCQs with two options)
+QUESTION_TYPES = ("MCQ", "ESSAY")
+
+OPTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "isCorrect": {"type": "boolean"},
+    },
+    "required": ["text", "isCorrect"],
+}
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "type": {"type": "string", "enum": list(QUESTION_TYPES)},
+        "points": {"type": "integer"},
+        "modelAnswer": {"type": "string"},
+        "options": {"type": "array", "items": OPTION_SCHEMA},
+    },
+    "required": ["text", "type", "points"],
+}
+
+# Passed to Gemini as response_schema so the model can only emit this shape
+EXAM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "courseCode": {"type": "string"},
+        "subject": {"type": "string"},
+        "year": {"type": "string"},
+        "semester": {"type": "string"},
+        "instructions": {"type": "string"},
+        "duration": {"type": "integer"},
+        "questions": {"type": "array", "items": QUESTION_SCHEMA},
+    },
+    "required": ["questions"],
+}
+
+# Response to a re-query for a few questions of a page
+QUESTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {"type": "array", "items": QUESTION_SCHEMA},
+    },
+    "required": ["questions"],
+}
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def repair_json(text: str) -> str:
+    """Best-effort fix of the malformations models commonly produce.
+
+    Strips code fences and surrounding prose, drops trailing commas, and closes
+    output that was cut off (an unterminated string, array or object), discarding
+    the incomplete last value.
+    """
+    fenced = _FENCE.search(text)
+    if fenced and "{" in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON object in response")
+    text = text[start:]
+
+    stack = []
+    in_string = escape = False
+    # Where the text can be cut while keeping only complete values, and what is open there
+    safe_end, safe_stack = 0, []
+    end = None
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            safe_end, safe_stack = index + 1, list(stack)
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            safe_end, safe_stack = index + 1, list(stack)
+            if not stack:
+                end = index + 1
+                break
+        elif char == ",":
+            safe_end, safe_stack = index, list(stack)
+
+    if end is not None:
+        repaired = text[:end]
+    else:
+        # Truncated: keep the complete values and close whatever is still open
+        repaired = text[:safe_end].rstrip().rstrip(",") + "".join(reversed(safe_stack))
+    return _TRAILING_COMMA.sub(r"\1", repaired)
+
+
+def load_json(text: str) -> Tuple[Dict, bool]:
+    """Parse a model's JSON object, repairing it if needed. Returns (value, was_repaired)"""
+    start = text.find("{")
+    end = text.rfind("}") + 1
+    try:
+        return json.loads(text[start:end]), False
+    except ValueError:
+        pass
+    return json.loads(repair_json(text)), True
+
+
+def question_errors(question) -> List[str]:
+    """Problems that make an extracted question unusable; empty if it is valid.
+
+    Expects the lowercased payload _parse_json_response works on.
+    """
+    if not isinstance(question, dict):
+        return ["not an object"]
+    errors = []
+    if not str(question.get("text") or "").strip():
+        errors.append("missing question text")
+    question_type = str(question.get("type") or "").upper()
+    if question_type not in QUESTION_TYPES:
+        errors.append(f"unknown type {question_type or 'none'}")
+    try:
+        int(question.get("points", 1))
+    except (TypeError, ValueError):
+        errors.append("points is not a number")
+
+    options = question.get("options") or []
+    if not isinstance(options, list) or not all(isinstance(o, dict) for o in options):
+        errors.append("options is not a list of objects")
+    elif question_type == "MCQ":
+        if len(options) < 2:
+            errors.append("MCQ has fewer than two options")
+        elif any(not str(o.get("text") or "").strip() for o in options):
+            errors.append("MCQ option without text")
+        # No option marked correct is valid: a blank exam has no answers ticked yet
+    return errors
+
+
+def describe_question(question) -> Optional[str]:
+    """Short excerpt used to point the model back at a question"""
+    if isinstance(question, dict) and question.get("text"):
+        return str(question["text"]).strip()[:120]
+    return None
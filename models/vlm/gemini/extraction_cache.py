@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.getenv('VLM_CACHE_DIR', 'extraction_cache')
+DEFAULT_MAX_ENTRIES = int(os.getenv('VLM_CACHE_MAX_ENTRIES', '512'))
+DEFAULT_MAX_BYTES = int(os.getenv('VLM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+class ExtractionCache:
+    """Disk-backed LRU cache of normalized extraction results keyed by image, prompt and model"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = self._load_index()
+        logger.info(f"Extraction cache ready at {self.cache_dir} with {len(self._entries)} entries")
+
+    @staticmethod
+    def make_key(image_bytes: bytes, prompt: str, model_version: str) -> str:
+        """Hash the inputs that determine an extraction, so a new prompt or model misses"""
+        digest = hashlib.sha256()
+        for part in (model_version.encode(), prompt.encode(), image_bytes):
+            # Length-prefix each part so different splits can never collide
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for a key, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                value = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            # Mark as most recently used, on disk too so the order survives restarts
+            self._entries.move_to_end(key)
+            os.utime(path)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Dict):
+        """Store a result and evict the least recently used entries beyond the limits"""
+        path = self._path(key)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            path.parent.mkdir(exist_ok=True)
+            # Write then rename so readers never see a partial entry
+            tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._entries[key] = len(data)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": sum(self._entries.values()),
+                "maxEntries": self.max_entries,
+                "maxBytes": self.max_bytes,
+            }
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _path(self, key: str) -> Path:
+        # Shard by prefix to keep directories small
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        """Rebuild the LRU order from the entries already on disk"""
+        found = []
+        for path in self.cache_dir.glob('*/*.json'):
+            stat = path.stat()
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+        found.sort()
+        return OrderedDict((key, size) for _, key, size in found)
+
+    def _evict(self):
+        total = sum(self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            key, size = next(iter(self._entries.items()))
+            self._remove(key)
+            total -= size
+            logger.info(f"Evicted cache entry {key}")
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
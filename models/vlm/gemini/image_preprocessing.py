@@ -0,0 +1,217 @@
+import io
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Add project root to Python path
+sys.path.append(str(Path(__file__).parent.parent.parent.parent))
+from models.common.vision_budget import choose_long_edge, estimate_text_height
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+class ImagePreprocessor:
+    """Shrinks exam photos before they are sent to the VLM.
+
+    Every stage can be switched off, either through the constructor or the
+    VLM_PREPROCESS_* environment variables. With adaptive resolution the page
+    is sent at the smallest of the long edges in resolution_ladder (capped at
+    target_long_edge) that keeps its text lines min_text_height pixels tall.
+    """
+
+    def __init__(self,
+                 enabled: bool = _env_flag('VLM_PREPROCESS', True),
+                 target_long_edge: int = int(os.getenv('VLM_PREPROCESS_LONG_EDGE', '1280')),
+                 grayscale: bool = _env_flag('VLM_PREPROCESS_GRAYSCALE', True),
+                 normalize_contrast: bool = _env_flag('VLM_PREPROCESS_CONTRAST', True),
+                 auto_crop: bool = _env_flag('VLM_PREPROCESS_CROP', True),
+                 deskew: bool = _env_flag('VLM_PREPROCESS_DESKEW', True),
+                 max_skew_degrees: float = float(os.getenv('VLM_PREPROCESS_MAX_SKEW', '5')),
+                 jpeg_quality: int = int(os.getenv('VLM_PREPROCESS_JPEG_QUALITY', '75')),
+                 adaptive: bool = _env_flag('VLM_PREPROCESS_ADAPTIVE', True),
+                 min_text_height: float = float(os.getenv('VLM_PREPROCESS_MIN_TEXT_PX', '12')),
+                 resolution_ladder: Tuple[int, ...] = tuple(
+                     int(edge) for edge in os.getenv('VLM_PREPROCESS_EDGES', '768,896,1024,1152').split(',') if edge)):
+        self.enabled = enabled
+        self.target_long_edge = target_long_edge
+        self.grayscale = grayscale
+        self.normalize_contrast = normalize_contrast
+        self.auto_crop = auto_crop
+        self.deskew = deskew
+        self.max_skew_degrees = max_skew_degrees
+        self.jpeg_quality = jpeg_quality
+        self.adaptive = adaptive
+        self.min_text_height = min_text_height
+        self.resolution_ladder = tuple(resolution_ladder)
+
+    def signature(self) -> str:
+        """Settings that change the output, used in extraction cache keys"""
+        if not self.enabled:
+            return 'raw'
+        return (f"edge={self.target_long_edge};gray={int(self.grayscale)};"
+                f"contrast={int(self.normalize_contrast)};crop={int(self.auto_crop)};"
+                f"deskew={int(self.deskew)}:{self.max_skew_degrees};q={self.jpeg_quality}"
+                + (f";adaptive={self.min_text_height}:{','.join(map(str, self.resolution_ladder))}"
+                   if self.adaptive else ""))
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        """Run the enabled stages on an image that has not been decoded yet"""
+        if image.format == 'JPEG':
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying above the target size
+            mode = 'L' if self.grayscale else 'RGB'
+            image.draft(mode, (self.target_long_edge, self.target_long_edge))
+
+        # Phone photos carry their rotation in EXIF
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('L' if self.grayscale else 'RGB')
+
+        if self.normalize_contrast:
+            image = self._normalize_contrast(image)
+        if self.deskew:
+            image = self._deskew(image)
+        if self.auto_crop:
+            image = self._crop_margins(image)
+
+        long_edge = self.choose_long_edge(image) if self.adaptive else self.target_long_edge
+        if max(image.size) > long_edge:
+            image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        return image
+
+    def choose_long_edge(self, image: Image.Image) -> int:
+        """Smallest allowed long edge at which the page's text stays legible"""
+        current = max(image.size)
+        candidates = [edge for edge in self.resolution_ladder if edge < self.target_long_edge]
+        candidates.append(self.target_long_edge)
+        # Measured at no more than the largest size it could be sent at
+        scale = min(1.0, self.target_long_edge / current)
+        text_height = estimate_text_height(image)
+        long_edge = choose_long_edge(round(current * scale),
+                                     text_height * scale if text_height else None,
+                                     self.min_text_height, candidates)
+        logger.info(f"Text lines {text_height or 0:.0f}px tall at {current}px, sending at {min(current, long_edge)}px")
+        return long_edge
+
+    def encode(self, image: Image.Image) -> Dict:
+        """Encode as a JPEG blob the Gemini SDK sends as-is"""
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
+        return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+    def prepare(self, image: Image.Image, original: Optional[bytes] = None):
+        """Return the payload to send to the model for an opened image.
+
+        original is the encoded file the image was decoded from, if the caller has it.
+        """
+        if not self.enabled:
+            return image
+        original_size = image.size
+        original_format = image.format
+        original_bytes = len(original) if original is not None else self._file_size(image)
+        processed = self.apply(image)
+        blob = self.encode(processed)
+
+        # Already-compressed photos (e.g. from WhatsApp) can come out larger; the SDK
+        # uploads an unmodified file as-is, so send that instead
+        if original_bytes is not None and len(blob['data']) >= original_bytes \
+                and max(original_size) <= self.target_long_edge:
+            logger.info(f"Preprocessing did not shrink {original_bytes} byte image, sending original")
+            if original is not None and original_format in Image.MIME:
+                return {"mime_type": Image.MIME[original_format], "data": original}
+            return Image.open(image.filename)
+
+        logger.info(f"Preprocessed image {original_size} -> {processed.size}, "
+                    f"{original_bytes or '?'} -> {len(blob['data'])} bytes")
+        return blob
+
+    @staticmethod
+    def _file_size(image: Image.Image):
+        """Size of the file an image was opened from, if any"""
+        filename = getattr(image, 'filename', None)
+        if filename and os.path.isfile(filename):
+            return os.path.getsize(filename)
+        return None
+
+    @staticmethod
+    def _normalize_contrast(image: Image.Image) -> Image.Image:
+        """Flatten uneven lighting to a white page, then stretch the remaining range"""
+        if image.mode != 'L':
+            return ImageOps.autocontrast(image, cutoff=1)
+
+        # Estimate the paper brightness at each point from a heavily blurred small copy
+        small = image.resize((max(1, image.width // 8), max(1, image.height // 8)))
+        background = small.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.GaussianBlur(4))
+        background = np.asarray(background.resize(image.size, Image.BILINEAR), dtype=np.float32)
+
+        pixels = np.asarray(image, dtype=np.float32)
+        flattened = np.clip(pixels / np.maximum(background, 1.0) * 255.0, 0, 255)
+        # Push near-white paper texture to pure white, it only costs JPEG bytes
+        flattened[flattened > 230] = 255
+        return ImageOps.autocontrast(Image.fromarray(flattened.astype(np.uint8)), cutoff=(1, 0))
+
+    @staticmethod
+    def _ink_mask(image: Image.Image, max_edge: int = 800) -> Tuple[np.ndarray, float]:
+        """Binarized small copy of the page (True = ink) and its scale relative to the image"""
+        scale = min(1.0, max_edge / max(image.size))
+        small = image.convert('L')
+        if scale < 1.0:
+            small = small.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        pixels = np.asarray(small, dtype=np.float32)
+        # Anything clearly darker than the page background counts as ink
+        threshold = min(pixels.mean() - pixels.std(), 160)
+        return pixels < threshold, scale
+
+    def _deskew(self, image: Image.Image) -> Image.Image:
+        """Rotate so text lines are horizontal, picking the angle with the sharpest row profile"""
+        mask, _ = self._ink_mask(image)
+        if not mask.any():
+            return image
+        small = Image.fromarray(mask.astype(np.uint8) * 255)
+
+        best_angle, best_score = 0.0, -1.0
+        for angle in np.arange(-self.max_skew_degrees, self.max_skew_degrees + 0.01, 0.5):
+            rotated = np.asarray(small.rotate(float(angle), resample=Image.NEAREST), dtype=np.float32)
+            score = float(np.var(rotated.sum(axis=1)))
+            if score > best_score:
+                best_angle, best_score = float(angle), score
+
+        if abs(best_angle) < 0.25:
+            return image
+        logger.info(f"Deskewing by {best_angle:.1f} degrees")
+        fill = 255 if image.mode == 'L' else (255, 255, 255)
+        return image.rotate(best_angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+
+    def _crop_margins(self, image: Image.Image, padding: float = 0.02) -> Image.Image:
+        """Crop blank page margins around the printed content"""
+        mask, scale = self._ink_mask(image)
+        # Ignore rows/columns with only specks of noise
+        rows = np.flatnonzero(mask.mean(axis=1) > 0.005)
+        cols = np.flatnonzero(mask.mean(axis=0) > 0.005)
+        if rows.size == 0 or cols.size == 0:
+            return image
+
+        pad_y = int(mask.shape[0] * padding)
+        pad_x = int(mask.shape[1] * padding)
+        top = max(0, rows[0] - pad_y) / scale
+        bottom = min(mask.shape[0], rows[-1] + 1 + pad_y) / scale
+        left = max(0, cols[0] - pad_x) / scale
+        right = min(mask.shape[1], cols[-1] + 1 + pad_x) / scale
+
+        box = (int(left), int(top), min(image.width, int(right)), min(image.height, int(bottom)))
+        if box[2] - box[0] < image.width * 0.3 or box[3] - box[1] < image.height * 0.3:
+            # Almost certainly a bad threshold rather than a tiny exam
+            return image
+        return image.crop(box)
@@ -0,0 +1,85 @@
+from typing import List, Optional
+
+
+class QuestionStreamParser:
+    """Pulls each complete object out of a JSON array (by default "questions") while the
+    document is still streaming in.
+
+    feed() takes the next chunk of model output and returns the raw JSON text of every
+    array element whose closing brace arrived in it. Text before the JSON (e.g. a code
+    fence) is skipped, since scanning only starts at the first "{".
+    """
+
+    def __init__(self, array_key: str = "questions"):
+        self.array_key = array_key
+        self.text = ""
+        self.emitted = 0
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        # One entry per open container: (bracket, key it is the value of)
+        self._stack: List[tuple] = []
+        self._element_start: Optional[int] = None
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level object has closed"""
+        return self._started and not self._stack
+
+    def feed(self, chunk: str) -> List[str]:
+        self.text += chunk
+        found = []
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            index = self._pos
+            self._pos += 1
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._stack.append(("{", None))
+                continue
+            if not self._stack:
+                # Anything after the top-level object is commentary
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:index]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index + 1
+            elif char == ":":
+                self._current_key = self._last_string
+            elif char in "{[":
+                parent = self._stack[-1]
+                key = self._current_key if parent[0] == "{" else None
+                if char == "{" and self._in_target_array():
+                    self._element_start = index
+                self._stack.append((char, key))
+                self._current_key = None
+            elif char in "}]":
+                self._stack.pop()
+                if char == "}" and self._element_start is not None and self._in_target_array():
+                    found.append(text[self._element_start:index + 1])
+                    self._element_start = None
+            elif char == ",":
+                self._current_key = None
+
+        self.emitted += len(found)
+        return found
+
+    def _in_target_array(self) -> bool:
+        return bool(self._stack) and self._stack[-1] == ("[", self.array_key)
@@ -0,0 +1,145 @@
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Add project root to Python path
+sys.path.append(str(Path(__file__).parent.parent.parent.parent))
+from models.common.ink import ink_mask, ink_runs
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Most regions one page is split into; each becomes one model call
+DEFAULT_MAX_REGIONS = int(os.getenv('VLM_SEGMENT_MAX_REGIONS', '6'))
+
+# (left, top, right, bottom) in pixels of the segmented image
+Box = Tuple[int, int, int, int]
+
+
+class QuestionSegmenter:
+    """Splits a printed exam page into blocks of questions using projection profiles.
+
+    The binarized page is split into columns at a blank vertical gutter, each
+    column into text lines by its row profile, and lines into blocks at gaps
+    clearly wider than the usual line spacing or where a line starts back at
+    the margin after indented ones (the next question after a list of options).
+    Blocks are then merged, smallest first, down to max_regions.
+    """
+
+    def __init__(self, max_regions: int = DEFAULT_MAX_REGIONS, min_region_lines: int = 2,
+                 gap_factor: float = 1.8, working_width: int = 1000, padding: float = 0.008):
+        self.max_regions = max_regions
+        self.min_region_lines = min_region_lines
+        self.gap_factor = gap_factor
+        self.working_width = working_width
+        self.padding = padding
+
+    def segment(self, image: Image.Image) -> List[Box]:
+        """Boxes of the question blocks in reading order; a single box if the page doesn't split"""
+        gray = image.convert("L")
+        scale = min(1.0, self.working_width / gray.width)
+        if scale < 1:
+            gray = gray.resize((round(gray.width * scale), round(gray.height * scale)), Image.BILINEAR)
+        ink = ink_mask(gray)
+        if not ink.any():
+            return [(0, 0, image.width, image.height)]
+
+        boxes = []
+        for left, right in self._columns(ink):
+            lines = self._lines(ink[:, left:right])
+            for first, last in self._blocks(ink[:, left:right], lines):
+                boxes.append(self._box(ink, lines[first:last + 1], left, right))
+        boxes = self._limit(boxes)
+
+        pad = round(self.padding * ink.shape[0])
+        return [
+            (max(0, round((l - pad) / scale)), max(0, round((t - pad) / scale)),
+             min(image.width, round((r + pad) / scale)), min(image.height, round((b + pad) / scale)))
+            for l, t, r, b in boxes
+        ] or [(0, 0, image.width, image.height)]
+
+    def _columns(self, ink: np.ndarray) -> List[Tuple[int, int]]:
+        """x ranges of the text columns: two if a blank gutter runs down the middle, else one"""
+        width = ink.shape[1]
+        profile = ink.mean(axis=0)
+        blank = profile < 0.002
+        middle = slice(int(width * 0.3), int(width * 0.7))
+        for start, end in ink_runs(blank[middle]):
+            start += middle.start
+            end += middle.start
+            if end - start >= width * 0.02 and profile[:start].mean() > 0.01 and profile[end:].mean() > 0.01:
+                return [(0, start), (end, width)]
+        return [(0, width)]
+
+    def _lines(self, ink: np.ndarray) -> List[Tuple[int, int]]:
+        """y ranges of the text lines of one column"""
+        profile = ink.mean(axis=1)
+        # Specks and ruling noise stay under this share of the column
+        active = profile > max(0.004, profile.max() * 0.02)
+        lines = ink_runs(active, min_gap=2)
+        return [(top, bottom) for top, bottom in lines if bottom - top >= 3]
+
+    def _blocks(self, ink: np.ndarray, lines: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """(first, last) line index of each block"""
+        if not lines:
+            return []
+        gaps = np.array([lines[i + 1][0] - lines[i][1] for i in range(len(lines) - 1)], dtype=np.float64)
+        typical_gap = float(np.median(gaps)) if gaps.size else 0.0
+        lefts = [int(np.argmax(ink[top:bottom].any(axis=0))) for top, bottom in lines]
+        margin = min(lefts)
+        indent = max(4, ink.shape[1] * 0.02)
+
+        starts = [0]
+        for i, gap in enumerate(gaps, start=1):
+            wide = gap > max(self.gap_factor * typical_gap, 4)
+            outdent = lefts[i] - margin < indent <= lefts[i - 1] - margin and gap >= typical_gap
+            if wide or outdent:
+                starts.append(i)
+
+        blocks = [(start, end - 1) for start, end in zip(starts, starts[1:] + [len(lines)])]
+        # A lone line (a section title, a question cut at a wide gap) joins the block below it
+        merged = []
+        carry = None
+        for first, last in blocks:
+            if carry is not None:
+                first = carry
+                carry = None
+            if last - first + 1 < self.min_region_lines and (first, last) != blocks[-1]:
+                carry = first
+                continue
+            merged.append((first, last))
+        if carry is not None:
+            merged.append((carry, len(lines) - 1))
+        return merged
+
+    @staticmethod
+    def _box(ink: np.ndarray, lines: List[Tuple[int, int]], left: int, right: int) -> Box:
+        top, bottom = lines[0][0], lines[-1][1]
+        cols = np.flatnonzero(ink[top:bottom, left:right].any(axis=0))
+        return (left + int(cols[0]), top, left + int(cols[-1]) + 1, bottom)
+
+    def _limit(self, boxes: List[Box]) -> List[Box]:
+        """Merge vertically adjacent boxes of the same column until at most max_regions remain"""
+        boxes = list(boxes)
+        while len(boxes) > max(1, self.max_regions):
+            best, best_height = None, None
+            for i in range(len(boxes) - 1):
+                a, b = boxes[i], boxes[i + 1]
+                if b[1] < a[1]:
+                    # Next column; only join boxes stacked in one column
+                    continue
+                height = b[3] - a[1]
+                if best_height is None or height < best_height:
+                    best, best_height = i, height
+            if best is None:
+                break
+            a, b = boxes[best], boxes[best + 1]
+            boxes[best:best + 2] = [(min(a[0], b[0]), a[1], max(a[2], b[2]), b[3])]
+        return boxes
+
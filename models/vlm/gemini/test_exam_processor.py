@@ -46,7 +46,7 @@ def test_teacher_exam():
         
         # Get raw model response
         print("\n🤖 Getting raw model response...")
-        response = processor.model.generate_content([
+        response = processor.backend.generate_content([
             "Describe what you see in this exam image",
             processor._load_image(test_image_path)
         ])
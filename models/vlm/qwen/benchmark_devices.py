@@ -0,0 +1,150 @@
+"""Compare Qwen2.5-VL inference modes: GPU bfloat16, CPU float32 and CPU int8.
+
+Each mode runs in its own process, so its peak resident memory is measured on
+its own. The model extracts one exam page a few times with greedy decoding and
+the report gives, per mode and thread count:
+
+    loadS          time to load (and quantize) the model
+    prefillS       time to the first generated token (vision tower + prompt)
+    tokensPerS     decode speed after the first token
+    peakRssMB      peak resident memory of the process
+    peakGpuMB      peak GPU memory allocated by torch (GPU mode only)
+
+Usage (from the project root):
+    python models/vlm/qwen/benchmark_devices.py --modes cpu,cpu-int8 --threads 4,8
+    python models/vlm/qwen/benchmark_devices.py --modes cuda,cpu-int8 --output devices.json
+    QWEN_MODEL_ID=Qwen/Qwen2.5-VL-3B-Instruct python models/vlm/qwen/benchmark_devices.py
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+
+# Mode -> (QWEN_DEVICE, QWEN_QUANTIZE)
+MODES = {
+    "cuda": ("cuda", "none"),
+    "cpu": ("cpu", "none"),
+    "cpu-int8": ("cpu", "int8"),
+}
+DEFAULT_IMAGE = project_root / "exams" / "deep" / "deep1.jpg"
+PROMPT = ("Extract every question on this exam page as JSON: "
+          '{"questions": [{"text": ..., "type": "mcq" or "essay", "options": [...]}]}')
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_mode(mode: str, threads: int, image_path: Path, max_new_tokens: int, runs: int) -> Dict:
+    """Load the model in one mode and time extraction; runs in the child process"""
+    from PIL import Image
+    import torch
+
+    from models.common.generation_backends import QwenBackend
+
+    device, quantize = MODES[mode]
+    start = time.perf_counter()
+    backend = QwenBackend(device=device, quantize=quantize, threads=threads, max_new_tokens=max_new_tokens)
+    load_s = time.perf_counter() - start
+    rss_after_load = _peak_rss_mb()
+
+    image = Image.open(image_path)
+    inputs = backend._inputs([image, PROMPT])
+    prompt_tokens = inputs.input_ids.shape[1]
+    pad = backend.processor.tokenizer.eos_token_id
+
+    prefill, decode = [], []
+    for _ in range(runs):
+        with torch.no_grad():
+            start = time.perf_counter()
+            backend.model.generate(**inputs, max_new_tokens=1, do_sample=False, pad_token_id=pad)
+            prefill_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            output = backend.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                            pad_token_id=pad)
+            total_s = time.perf_counter() - start
+        new_tokens = output.shape[1] - prompt_tokens
+        prefill.append(prefill_s)
+        # The first token costs a prefill, the rest are decode steps
+        decode.append((new_tokens - 1) / max(total_s - prefill_s, 1e-6))
+
+    result = {
+        "mode": mode,
+        "device": str(backend.model.device),
+        "quantize": backend.quantize,
+        "threads": torch.get_num_threads() if device == "cpu" else None,
+        "promptTokens": prompt_tokens,
+        "newTokens": new_tokens,
+        "loadS": round(load_s, 2),
+        "prefillS": round(min(prefill), 3),
+        "tokensPerS": round(max(decode), 2),
+        "rssAfterLoadMB": rss_after_load,
+        "peakRssMB": _peak_rss_mb(),
+    }
+    if device == "cuda":
+        result["peakGpuMB"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+    return result
+
+
+def spawn(mode: str, threads: int, args) -> Optional[Dict]:
+    """Run one mode in a fresh interpreter so peak memory isn't shared between modes"""
+    command = [sys.executable, __file__, "--child", mode, "--threads", str(threads),
+               "--image", str(args.image), "--max-new-tokens", str(args.max_new_tokens), "--runs", str(args.runs)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"❌ {mode} (threads={threads}) failed:\n{completed.stderr[-2000:]}")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="cpu,cpu-int8", help=f"comma-separated, from {', '.join(MODES)}")
+    parser.add_argument("--threads", default="0", help="comma-separated CPU thread counts, 0 = torch default")
+    parser.add_argument("--image", type=Path, default=DEFAULT_IMAGE)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=2, help="timed runs per mode, the best is reported")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--child", choices=tuple(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_mode(args.child, int(args.threads), args.image, args.max_new_tokens, args.runs)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    rows: List[Dict] = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode}")
+        thread_counts = [int(t) for t in args.threads.split(",")] if mode != "cuda" else [0]
+        for threads in thread_counts:
+            print(f"⏱️  {mode} (threads={threads or 'default'})...")
+            result = spawn(mode, threads, args)
+            if result:
+                rows.append(result)
+
+    print(f"\n{'mode':>9} {'threads':>7} {'load s':>7} {'prefill s':>9} {'tok/s':>7} {'peak RSS MB':>12}")
+    for row in rows:
+        print(f"{row['mode']:>9} {row['threads'] or '-':>7} {row['loadS']:>7} {row['prefillS']:>9} "
+              f"{row['tokensPerS']:>7} {row['peakRssMB']:>12}")
+
+    if args.output:
+        args.output.write_text(json.dumps({"image": str(args.image), "results": rows}, indent=2))
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
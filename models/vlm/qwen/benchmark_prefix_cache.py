@@ -0,0 +1,110 @@
+"""Time-to-first-token of the Qwen student model with and without the system-prompt KV cache.
+
+Loads student-model/student-test.py's ExamProcessor (device and quantization from
+QWEN_DEVICE / QWEN_QUANTIZE) and, for each batch size, times generating a single
+token for exam pages with the cached prefix and with a full prefill. It also
+checks that both give the same first tokens under greedy decoding.
+
+Usage (from the project root):
+    python models/vlm/qwen/benchmark_prefix_cache.py
+    python models/vlm/qwen/benchmark_prefix_cache.py --batch-sizes 1,2,4 --runs 5 --output ttft.json
+"""
+import argparse
+import importlib.util
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.vlm.gemini.benchmark_preprocessing import find_images
+
+CHECK_TOKENS = 8
+
+
+def load_processor():
+    spec = importlib.util.spec_from_file_location(
+        "student_test", Path(__file__).parent / "student-model" / "student-test.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # The cache is built here explicitly, so construction time isn't counted twice
+    module.QWEN_PREFIX_CACHE = False
+    return module, module.ExamProcessor()
+
+
+def _ttft(generate, inputs, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        generate(inputs, max_new_tokens=1)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark_batch(processor, prefix_cache, images: List[Image.Image], runs: int) -> Dict:
+    inputs = processor._prepare_inputs(images)
+
+    processor.prefix_cache = None
+    full = _ttft(processor._generate, inputs, runs)
+    full_text = processor._generate(inputs, max_new_tokens=CHECK_TOKENS)
+
+    processor.prefix_cache = prefix_cache
+    cached = _ttft(processor._generate, inputs, runs)
+    cached_text = processor._generate(inputs, max_new_tokens=CHECK_TOKENS)
+
+    return {
+        "batchSize": len(images),
+        "promptTokens": int(inputs.input_ids.shape[1]),
+        "prefixTokens": prefix_cache.length,
+        "fullPrefillTtftS": round(full, 3),
+        "cachedPrefixTtftS": round(cached, 3),
+        "reduction": round(1 - cached / full, 3) if full else None,
+        "sameFirstTokens": full_text == cached_text,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=Path, default=project_root / "exams")
+    parser.add_argument("--batch-sizes", default="1,4")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per setting, the median is reported")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args()
+
+    images = [Image.open(path).convert("RGB") for path in find_images(args.exams_dir)]
+    if not images:
+        print(f"No images found in {args.exams_dir}")
+        return
+
+    module, processor = load_processor()
+    prefix_text = processor.processor.apply_chat_template(
+        [{"role": "system", "content": processor.system_prompt}], tokenize=False, add_generation_prompt=False
+    )
+    prefix_cache = module.PrefixKVCache(processor.model, processor.processor, prefix_text)
+    print(f"🧠 {prefix_cache.length} prefix tokens cached in {prefix_cache.prefill_seconds:.2f}s on {processor.model.device}")
+
+    rows = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",") if b.strip()]:
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        row = benchmark_batch(processor, prefix_cache, batch, args.runs)
+        rows.append(row)
+        print(f"⏱️  batch {batch_size}: TTFT {row['fullPrefillTtftS']}s -> {row['cachedPrefixTtftS']}s "
+              f"({row['reduction']:.0%} less), same first tokens: {row['sameFirstTokens']}")
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            "device": str(processor.model.device),
+            "prefixSetupS": round(prefix_cache.prefill_seconds, 3),
+            "results": rows,
+        }, indent=2))
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
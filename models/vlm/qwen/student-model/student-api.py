@@ -1,19 +1,81 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import uvicorn
-from test import ExamProcessor
+import asyncio
+import importlib.util
 import io
+import json
+import logging
+import os
+import sys
+from pathlib import Path
 from PIL import Image
 
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.batching import BatchQueueFullError, DynamicBatcher
+from models.common.instrumentation import instrument_app
+from models.common.token_stream import StreamRelay
+from models.vlm.gemini.incremental_json import QuestionStreamParser
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Requests run through the model together, and how long the first one waits for company
+QWEN_BATCH_SIZE = int(os.getenv("QWEN_BATCH_SIZE", "4"))
+QWEN_BATCH_WAIT_MS = float(os.getenv("QWEN_BATCH_WAIT_MS", "10"))
+# Requests waiting beyond this are turned away with 429 and a Retry-After estimate
+QWEN_MAX_QUEUE = int(os.getenv("QWEN_MAX_QUEUE", "16"))
+
+# student-test.py can't be imported by name
+_spec = importlib.util.spec_from_file_location("student_test", Path(__file__).with_name("student-test.py"))
+_student_test = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_student_test)
+ExamProcessor = _student_test.ExamProcessor
+
+# Initialize the model at startup
+processor = ExamProcessor()
+
+
+def _process_batch(requests):
+    """Run (image, metadata, relay) requests through the model as one batch;
+    relay, if any, gets the request's answer text while it is generated"""
+    images = [image for image, _, _ in requests]
+    metadatas = [metadata for _, metadata, _ in requests]
+    relays = [relay for _, _, relay in requests]
+    for relay in relays:
+        if relay is not None:
+            # A request retried after its batch failed streams again from the start
+            relay.restart()
+    return processor.process_exam_images(images, metadatas, relays)
+
+
+# The only caller of the model: concurrent uploads and streams share its batched generate calls
+batcher = DynamicBatcher(_process_batch, max_batch_size=QWEN_BATCH_SIZE, max_wait_ms=QWEN_BATCH_WAIT_MS,
+                         max_queue=QWEN_MAX_QUEUE, name="qwen_batcher")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the inference worker with the app and drain it on shutdown"""
+    batcher.start()
+    yield
+    batcher.stop()
+
+
 app = FastAPI(
     title="Exam VLM Processor API",
-    description="API for processing exam images using Qwen VLM model"
+    description="API for processing exam images using Qwen VLM model",
+    lifespan=lifespan
 )
 
-# Initialize the model at startup
-processor = ExamProcessor()
+# Prometheus /metrics: batch latency and the batcher's queue depth
+instrument_app(app, "qwen-student-api")
 
 class ExamMetadata(BaseModel):
     title: Optional[str] = None
@@ -37,19 +99,97 @@ async def process_exam(
         # Read and validate image
         image_content = await file.read()
         image = Image.open(io.BytesIO(image_content))
-        
-        # Process the exam
-        exam_data = processor.process_exam_image(image, metadata)
-        
+
+        # Process the exam in the next batch; the event loop stays free meanwhile
+        exam_data = await batcher.run((image, metadata, None))
+
         return JSONResponse(
             content=exam_data,
             status_code=200
         )
+    except BatchQueueFullError as e:
+        raise _too_busy(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
+def _too_busy(e: BatchQueueFullError) -> HTTPException:
+    logger.warning(f"Rejecting exam: {str(e)}")
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many exams waiting for the model: {str(e)}",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def _event(kind: str, payload) -> str:
+    return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+@app.post("/process-exam/stream")
+async def process_exam_stream(
+    file: UploadFile = File(...),
+    metadata: Optional[Dict[str, Any]] = None
+):
+    """Process an exam, pushing the answer over server-sent events while the model writes it.
+
+    Emits a `token` event for each new piece of text, a `question` event as soon as a
+    question object is complete, then one `exam` event with the full result, or an
+    `error` event. A `reset` event means the batch failed and the exam is being read
+    again on its own: tokens and questions sent before it are void. Streams go through
+    the same batches as /process-exam, so several run at once without holding up the
+    event loop.
+    """
+    try:
+        image = Image.open(io.BytesIO(await file.read()))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read image: {str(e)}")
+
+    relay = StreamRelay()
+    try:
+        result = asyncio.wrap_future(batcher.submit((image, metadata, relay)))
+    except BatchQueueFullError as e:
+        raise _too_busy(e)
+    # Queued after every piece, which the inference thread posted before finishing the batch
+    result.add_done_callback(lambda _: relay.close())
+
+    async def stream():
+        parser = QuestionStreamParser()
+        index = 0
+        try:
+            async for kind, text in relay.events():
+                if kind == "reset":
+                    parser = QuestionStreamParser()
+                    index = 0
+                    yield _event("reset", {})
+                    continue
+                yield _event("token", {"text": text})
+                for fragment in parser.feed(text):
+                    try:
+                        question = json.loads(fragment)
+                    except ValueError as e:
+                        logger.warning(f"Skipping unparsable streamed question: {str(e)}")
+                        continue
+                    yield _event("question", {"index": index, **question})
+                    index += 1
+            yield _event("exam", await result)
+        except Exception as e:
+            logger.error(f"Error streaming exam: {str(e)}")
+            yield _event("error", {"detail": str(e)})
+        finally:
+            # A client that left while still queued gives its place up
+            result.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/batching")
+async def batching_stats():
+    """Batch sizes and durations so far"""
+    return batcher.stats()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
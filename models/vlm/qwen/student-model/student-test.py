@@ -1,4 +1,4 @@
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
+from transformers import AutoProcessor, LogitsProcessorList
 from qwen_vl_utils import process_vision_info
 import torch
 import json
@@ -6,16 +6,115 @@ import requests
 from PIL import Image
 import io
 import os
+import sys
+import logging
+from pathlib import Path
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent.parent.parent
+sys.path.append(str(project_root))
+from models.common.generation_backends import (
+    QWEN_CPU_THREADS,
+    QWEN_DEVICE,
+    QWEN_MAX_PIXELS,
+    QWEN_MIN_PIXELS,
+    QWEN_QUANTIZE,
+    load_qwen_model,
+)
+from models.common.json_constraint import JsonConstraintLogitsProcessor, token_byte_table
+from models.common.prefix_cache import PrefixKVCache
+from models.common.token_stream import RowStreamer
+from models.common.vision_budget import choose_long_edge, estimate_text_height
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Same legibility rule as the Gemini preprocessor: the smallest of these long edges
+# that keeps text lines at least MIN_TEXT_HEIGHT pixels tall
+MIN_TEXT_HEIGHT = float(os.getenv('VLM_PREPROCESS_MIN_TEXT_PX', '12'))
+RESOLUTION_LADDER = [int(edge) for edge in os.getenv('VLM_PREPROCESS_EDGES', '768,896,1024,1152').split(',') if edge]
+# Keep the system prompt's key/value cache instead of re-encoding it on every call
+QWEN_PREFIX_CACHE = os.getenv('QWEN_PREFIX_CACHE', '1').strip().lower() not in ('0', 'false', 'no', 'off', '')
+# Only let the model emit JSON matching EXAM_JSON_SCHEMA, stopping once it closes
+QWEN_CONSTRAINED_JSON = os.getenv('QWEN_CONSTRAINED_JSON', '1').strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+_TEXT = {"type": ["string", "null"]}
+_COUNT = {"type": ["integer", "null"]}
+
+# The structure the system prompt asks for, enforced token by token when decoding
+EXAM_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "exam": {
+            "type": "object",
+            "properties": {
+                "title": _TEXT,
+                "courseCode": _TEXT,
+                "institution": _TEXT,
+                "faculty": _TEXT,
+                "level": _TEXT,
+                "major": _TEXT,
+                "date": _TEXT,
+                "duration": _COUNT,
+                "totalMarks": _COUNT,
+                "passingScore": _COUNT,
+                "examiner": _TEXT,
+                "instructions": _TEXT,
+                "questions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "text": {"type": "string"},
+                            "type": {"type": "string", "enum": ["mcq", "essay"]},
+                            "points": {"type": "number"},
+                            "order": {"type": "integer"},
+                            "options": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "text": {"type": "string"},
+                                        "isCorrect": {"type": "boolean"},
+                                        "order": {"type": "integer"},
+                                    },
+                                    "required": ["text", "isCorrect"],
+                                },
+                            },
+                        },
+                        "required": ["text", "type"],
+                    },
+                },
+            },
+            "required": ["questions"],
+        },
+    },
+    "required": ["exam"],
+}
 
 class ExamProcessor:
-    def __init__(self):
-        # Initialize the model and processor
-        self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+    def __init__(self, min_pixels=QWEN_MIN_PIXELS, max_pixels=QWEN_MAX_PIXELS,
+                 device=QWEN_DEVICE, quantize=QWEN_QUANTIZE, threads=QWEN_CPU_THREADS):
+        # Initialize the model and processor: bfloat16 on GPU, int8 on CPU-only
+        # machines unless QWEN_QUANTIZE=none (see load_qwen_model)
+        self.model = load_qwen_model(
             "Qwen/Qwen2.5-VL-7B-Instruct",
-            torch_dtype=torch.bfloat16,
-            device_map="auto"
+            device=device,
+            quantize=quantize,
+            threads=threads
         )
-        self.processor = AutoProcessor.from_pretrained("Qwen/Qwen2.5-VL-7B-Instruct")
+        # Each 28x28 pixels cost one vision token; these bound the tokens per image
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+        self.processor = AutoProcessor.from_pretrained(
+            "Qwen/Qwen2.5-VL-7B-Instruct",
+            min_pixels=min_pixels,
+            max_pixels=max_pixels
+        )
+        # Batched generation needs prompts padded on the left, next to the generated tokens
+        self.processor.tokenizer.padding_side = "left"
         
         # System prompt with detailed instructions
         self.system_prompt = """"Convert the provided exam content into a strict JSON matching the specified SQL schema. Follow these rules:
@@ -71,6 +170,19 @@ class ExamProcessor:
   }
 }"""
 
+        # The system prompt opens every conversation; encode it once at startup
+        self.prefix_cache = None
+        if QWEN_PREFIX_CACHE:
+            prefix_text = self.processor.apply_chat_template(
+                [{"role": "system", "content": self.system_prompt}], tokenize=False, add_generation_prompt=False
+            )
+            self.prefix_cache = PrefixKVCache(self.model, self.processor, prefix_text)
+
+        # Raw bytes of every token, for checking candidates against the JSON schema
+        self.token_bytes = token_byte_table(self.processor.tokenizer) if QWEN_CONSTRAINED_JSON else None
+        eos = self.model.generation_config.eos_token_id
+        self.eos_token_ids = {self.processor.tokenizer.eos_token_id, *(eos if isinstance(eos, list) else [eos])} - {None}
+
     def load_image(self, image_path):
         """Load image from file path or URL"""
         if image_path.startswith('http'):
@@ -80,77 +192,142 @@ class ExamProcessor:
             image = Image.open(image_path)
         return image
 
+    def fit_resolution(self, image):
+        """Downscale to the smallest resolution at which the exam text stays legible"""
+        long_edge = max(image.size)
+        target = choose_long_edge(long_edge, estimate_text_height(image), MIN_TEXT_HEIGHT,
+                                  RESOLUTION_LADDER + [long_edge])
+        if target < long_edge:
+            image = image.copy()
+            image.thumbnail((target, target), Image.LANCZOS)
+        return image
+
+    def _build_messages(self, image):
+        """Chat messages asking for one exam page as JSON"""
+        # Prepare the prompt
+        user_prompt = """Convert this exam paper into JSON format following the exact schema provided. 
+        Extract all questions and their details including:
+        - Question text
+        - Question type (mcq or essay)
+        - Points value
+        - For MCQs: all options (mark correct ones if indicated)
+        - Maintain original question order
+        
+        Include any exam metadata you can identify from the header."""
+        
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {
+                "role": "user", 
+                "content": [
+                    {"type": "image", "image": image,
+                     "min_pixels": self.min_pixels, "max_pixels": self.max_pixels},
+                    {"type": "text", "text": user_prompt}
+                ]
+            }
+        ]
+
+    @staticmethod
+    def _parse_output(output_text, metadata=None):
+        """Exam JSON out of the model's answer, with any provided metadata applied"""
+        # Try to extract JSON from the output
+        json_start = output_text.find('{')
+        json_end = output_text.rfind('}') + 1
+        json_str = output_text[json_start:json_end]
+        
+        exam_data = json.loads(json_str)
+        
+        # Apply any provided metadata
+        if metadata:
+            exam_data['exam'].update(metadata)
+            
+        return exam_data
+
     def process_exam_image(self, image, metadata=None):
         """Process exam directly from PIL Image object"""
-        try:
-            # Prepare the prompt
-            user_prompt = """Convert this exam paper into JSON format following the exact schema provided. 
-            Extract all questions and their details including:
-            - Question text
-            - Question type (mcq or essay)
-            - Points value
-            - For MCQs: all options (mark correct ones if indicated)
-            - Maintain original question order
-            
-            Include any exam metadata you can identify from the header."""
-            
-            # Create messages
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "image", "image": image},
-                        {"type": "text", "text": user_prompt}
-                    ]
-                }
-            ]
-            
-            # Process the input
-            text = self.processor.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
-            )
-            image_inputs, video_inputs = process_vision_info(messages)
-            inputs = self.processor(
-                text=[text],
-                images=image_inputs,
-                videos=video_inputs,
-                padding=True,
-                return_tensors="pt"
-            ).to("cuda")
-            
-            # Generate output
-            generated_ids = self.model.generate(
-                **inputs,
-                max_new_tokens=2048,
-                pad_token_id=self.processor.tokenizer.eos_token_id
+        result = self.process_exam_images([image], [metadata])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _prepare_inputs(self, images):
+        """Model inputs for a batch of exam pages"""
+        images = [self.fit_resolution(image) for image in images]
+        conversations = [self._build_messages(image) for image in images]
+        
+        # Process the input; prompts are left-padded to a common length
+        texts = [
+            self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in conversations
+        ]
+        image_inputs, video_inputs = process_vision_info(conversations)
+        inputs = self.processor(
+            text=texts,
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt"
+        ).to(self.model.device)
+        # Each row of image_grid_thw is one image's (t, h, w) patch grid; 2x2 patches make a token
+        vision_tokens = (inputs["image_grid_thw"].prod(dim=-1) // 4).tolist()
+        logger.info(f"Batch of {len(images)}: {vision_tokens} vision tokens, "
+                    f"{inputs.input_ids.shape[1]} input tokens per padded prompt")
+        return inputs
+
+    def _generate(self, inputs, max_new_tokens=2048, listeners=None):
+        """Decoded answers for prepared inputs, reusing the system prompt's cache when there is one.
+
+        With constrained decoding every answer is JSON matching EXAM_JSON_SCHEMA and ends
+        as soon as the top-level object closes; max_new_tokens only bounds runaway pages.
+        listeners, one per row or None, are called with each row's text as it is generated.
+        """
+        generate = self.prefix_cache.generate if self.prefix_cache is not None else self.model.generate
+        logits_processor = LogitsProcessorList()
+        if self.token_bytes is not None:
+            logits_processor.append(
+                JsonConstraintLogitsProcessor(EXAM_JSON_SCHEMA, self.token_bytes, self.eos_token_ids)
             )
-            
-            generated_ids_trimmed = [
-                out_ids[len(in_ids):] 
-                for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            output_text = self.processor.batch_decode(
-                generated_ids_trimmed, 
-                skip_special_tokens=True, 
-                clean_up_tokenization_spaces=False
-            )[0]
-            
-            # Try to extract JSON from the output
-            json_start = output_text.find('{')
-            json_end = output_text.rfind('}') + 1
-            json_str = output_text[json_start:json_end]
-            
-            exam_data = json.loads(json_str)
-            
-            # Apply any provided metadata
-            if metadata:
-                exam_data['exam'].update(metadata)
-                
-            return exam_data
+        generated_ids = generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.processor.tokenizer.eos_token_id,
+            logits_processor=logits_processor,
+            streamer=RowStreamer(self.processor.tokenizer, listeners) if listeners and any(listeners) else None
+        )
+        
+        generated_ids_trimmed = [
+            out_ids[len(in_ids):] 
+            for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        return self.processor.batch_decode(
+            generated_ids_trimmed, 
+            skip_special_tokens=True, 
+            clean_up_tokenization_spaces=False
+        )
+
+    def process_exam_images(self, images, metadatas=None, listeners=None):
+        """Process several exam pages in one padded batch through the model.
+
+        Returns one entry per image: its exam data, or the Exception for a page whose
+        answer couldn't be parsed. A failure of the batch as a whole is raised.
+        listeners (optional, one callable or None per image) receive each page's
+        answer text piece by piece while it is generated.
+        """
+        metadatas = metadatas or [None] * len(images)
+        try:
+            inputs = self._prepare_inputs(images)
+            output_texts = self._generate(inputs, listeners=listeners)
         except Exception as e:
             raise Exception(f"Error processing exam: {str(e)}")
 
+        results = []
+        for output_text, metadata in zip(output_texts, metadatas):
+            try:
+                results.append(self._parse_output(output_text, metadata))
+            except Exception as e:
+                results.append(Exception(f"Error processing exam: {str(e)}"))
+        return results
+
     def process_exam(self, image_path, metadata=None):
         """Process an exam from file path or URL"""
         image = self.load_image(image_path)
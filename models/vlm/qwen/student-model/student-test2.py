@@ -86,7 +86,7 @@ def process_exam_image(image_path, question_prompt):
     text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
     image_inputs, video_inputs = process_vision_info(messages)
     inputs = processor(text=[text], images=image_inputs, videos=video_inputs, padding=True, return_tensors="pt")
-    inputs = inputs.to("cuda")
+    inputs = inputs.to(model.device)
     
     # Generate response without token limit constraint
     generated_ids = model.generate(**inputs, max_length=model.config.max_position_embeddings)
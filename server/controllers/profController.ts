@@ -340,7 +340,7 @@ export const uploadExamPhotos = catchAsync(
     try {
       console.log("Processing exam photos with VLM...");
 
-      // Process image with VLM API - send only one file at a time
+      // Process image(s) with VLM API - multi-page exams are merged server-side
       const rawVlmResult = await VlmApiClient.processExamPhotos(filePaths);
 
       // Extract structured data from API response with fallbacks
@@ -4,6 +4,8 @@ import FormData from "form-data";
 import path from "path";
 
 const VLM_API_URL = process.env.VLM_API_URL || "http://localhost:6000";
+const JOB_POLL_INTERVAL_MS = 2000;
+const JOB_TIMEOUT_MS = 10 * 60 * 1000;
 
 /**
  * Client for interacting with the VLM API
@@ -21,56 +23,57 @@ export class VlmApiClient {
         throw new Error("No files provided for processing");
       }
 
+      for (const filePath of filePaths) {
+        if (!fs.existsSync(filePath)) {
+          throw new Error(`File not found: ${filePath}`);
+        }
+      }
+
       console.log(
-        `Sending request to process exam photos from: ${filePaths[0]}`
+        `Submitting job to process ${filePaths.length} exam photo(s) starting from: ${filePaths[0]}`
       );
 
       const form = new FormData();
 
-      // Use the first image file for processing
-      const filePath = filePaths[0];
-      if (!fs.existsSync(filePath)) {
-        throw new Error(`File not found: ${filePath}`);
-      }
-
-      // Add the file with the correct field name 'file'
-      form.append("file", fs.createReadStream(filePath), {
-        filename: path.basename(filePath),
-      });
+      // Pages are sent in order so the API can extract them concurrently and merge them
+      for (const filePath of filePaths) {
+        form.append("files", fs.createReadStream(filePath), {
+          filename: path.basename(filePath),
+        });
 
-      console.log(
-        "Sending file:",
-        path.basename(filePath),
-        "size:",
-        fs.statSync(filePath).size,
-        "bytes"
-      );
-
-      // Log the form data keys for debugging
-      console.log("Form data keys:", Object.keys(form).join(", "));
+        console.log(
+          "Sending file:",
+          path.basename(filePath),
+          "size:",
+          fs.statSync(filePath).size,
+          "bytes"
+        );
+      }
 
-      // Make POST request to the API
-      const response = await axios.post(
-        `${VLM_API_URL}/teacher/process-exam/`,
+      // Submit the extraction as a background job; the upload returns immediately
+      const submitted = await axios.post(
+        `${VLM_API_URL}/jobs/teacher/process-exam/`,
         form,
         {
           headers: {
             ...form.getHeaders(),
           },
-          timeout: 120000, // 120 seconds timeout
+          timeout: 60000, // upload only
           maxContentLength: Infinity, // Allow for large files
           maxBodyLength: Infinity,
         }
       );
 
-      if (!response.data) {
+      const result = await VlmApiClient.waitForJob(submitted.data.jobId);
+
+      if (!result) {
         throw new Error("No data returned from VLM API");
       }
 
       console.log("VLM API response received successfully");
 
-      // Return the response data
-      return response.data;
+      // Return the extracted exam
+      return result;
     } catch (error: any) {
       // Handle network errors
       if (error.code === "ECONNREFUSED") {
@@ -108,12 +111,49 @@ export class VlmApiClient {
     }
   }
 
+  /**
+   * Poll a VLM API job until it finishes
+   *
+   * @param jobId - Id returned when the job was submitted
+   * @returns The job result once it is done
+   */
+  static async waitForJob(jobId: string): Promise<any> {
+    const deadline = Date.now() + JOB_TIMEOUT_MS;
+
+    while (Date.now() < deadline) {
+      const { data: job } = await axios.get(`${VLM_API_URL}/jobs/${jobId}`, {
+        timeout: 10000,
+      });
+
+      if (job.status === "done") {
+        return job.result;
+      }
+      if (job.status === "failed") {
+        throw new Error(`VLM job failed: ${job.error}`);
+      }
+
+      console.log(
+        `VLM job ${jobId} ${job.status}: ${job.progress.completed}/${job.progress.total} pages`
+      );
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+
+    throw Object.assign(
+      new Error(`VLM job ${jobId} did not finish in time`),
+      { code: "ETIMEDOUT" }
+    );
+  }
+
   /**
    * Process student answer sheets through the VLM API
    *
+   * All sheets go to the batch endpoint in one request; it streams one NDJSON
+   * line per sheet as it finishes, then a summary line.
+   *
    * @param filePaths - Array of paths to student answer image files
    * @param examId - The exam ID to compare against
-   * @returns Processed student answers with scores
+   * @returns Processed student answers with scores, one result per sheet in
+   *   upload order (a single sheet returns its result alone)
    */
   static async processStudentAnswers(
     filePaths: string[],
@@ -124,31 +164,35 @@ export class VlmApiClient {
         throw new Error("No files provided for processing");
       }
 
-      // Use the first image for processing (can be enhanced to handle multiple images)
-      const filePath = filePaths[0];
-
-      if (!fs.existsSync(filePath)) {
-        throw new Error(`File not found: ${filePath}`);
+      for (const filePath of filePaths) {
+        if (!fs.existsSync(filePath)) {
+          throw new Error(`File not found: ${filePath}`);
+        }
       }
 
       console.log(
-        `Sending request to process student answers for exam ${examId}`
+        `Sending request to process ${filePaths.length} student answer sheet(s) for exam ${examId}`
       );
 
       const form = new FormData();
-      form.append("file", fs.createReadStream(filePath), {
-        filename: path.basename(filePath),
-      });
+      for (const filePath of filePaths) {
+        form.append("files", fs.createReadStream(filePath), {
+          filename: path.basename(filePath),
+        });
+      }
       form.append("exam_id", examId.toString());
 
       const response = await axios.post(
-        `${VLM_API_URL}/student/process-answers/`,
+        `${VLM_API_URL}/student/process-answers/batch/`,
         form,
         {
           headers: {
             ...form.getHeaders(),
           },
-          timeout: 60000, // 60 seconds timeout
+          responseType: "text",
+          timeout: JOB_TIMEOUT_MS, // the whole batch, not one sheet
+          maxContentLength: Infinity,
+          maxBodyLength: Infinity,
         }
       );
 
@@ -156,9 +200,32 @@ export class VlmApiClient {
         throw new Error("No data returned from VLM API");
       }
 
+      // Sheets finish out of order; each line carries its upload index
+      const lines = String(response.data)
+        .split("\n")
+        .filter((line) => line.trim())
+        .map((line) => JSON.parse(line));
+      const sheets = lines
+        .filter((line) => !line.done)
+        .sort((a, b) => a.index - b.index);
+
+      if (sheets.length !== filePaths.length) {
+        throw new Error(
+          `VLM API returned ${sheets.length} of ${filePaths.length} answer sheets`
+        );
+      }
+
+      const failed = sheets.filter((sheet) => sheet.status !== "ok");
+      if (failed.length) {
+        throw new Error(
+          failed.map((sheet) => `${sheet.filename}: ${sheet.error}`).join("; ")
+        );
+      }
+
       console.log("Student answer processing successful");
 
-      return response.data;
+      const results = sheets.map((sheet) => sheet.result);
+      return results.length === 1 ? results[0] : results;
     } catch (error: any) {
       // Handle different types of errors with better messages
       if (error.code === "ECONNREFUSED") {